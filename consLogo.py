@@ -8,9 +8,8 @@
 from consScore import oma
 from consScore import aminoCons
 import os
-from consScore import constool
+from consScore.alignment import Alignment
 import argparse
-from requests import exceptions
 from biskit.exe import Executor
 
 
@@ -20,15 +19,18 @@ class OrthoLogo:
     Initializing this class creates an object that stores the parameters of the methods in the pipe
     as fields. Calling the get_logo method runs the pipe, which takes a file in fasta format,
     as well as a motif as input and returns an image of the conserved and depleted acids in the motif.
+    The files of the pipe are written to workdir, which defaults to Seq2Logo in the current working directory. The
+    current working directory is never changed, so logos can be made in threads of one process.
     """
-    def __init__(self, protein, motif):
+    def __init__(self, protein, motif, speculative=False, workdir=None):
         filename = os.path.basename(protein)
         self.name = filename.split('.')[0]
         self.input = protein
         self.motif = motif
         self.sequence = ""
-        self.cwd = os.getcwd()
+        self.workdir = os.path.abspath(workdir or os.path.join(os.getcwd(), 'Seq2Logo'))
         self.start = 0
+        self.speculative = speculative
 
     def get_sequence(self):
         """
@@ -41,20 +43,27 @@ class OrthoLogo:
         else:
             raise oma.SequenceError("Cannot open {0}".format(self.input))
 
+    def work_path(self, filename=None):
+        """
+        Returns the absolute path to a file in the working directory, or to the working directory itself if no file
+        name is given, making the directory if needed
+        """
+        if not os.path.isdir(self.workdir):
+            os.makedirs(self.workdir, exist_ok=True)
+        return self.workdir + os.sep + filename if filename else self.workdir
+
     def call_orthologs(self):
         """
         Retrieves the HOG or the orthologs of the entered sequence by querying the OMA database
         """
         ortholog_call = oma.OrthologFinder(self.sequence)
-        try:
-            self.orthologs = ortholog_call.get_HOGs()
-        except exceptions.RequestException:
-            self.orthologs = ortholog_call.get_orthologs()
+        self.orthologs = ortholog_call.get_HOGs_or_orthologs(speculative=self.speculative)
 
-        with open("%s.orth" %(self.name), 'w') as o_file:
+        path = self.work_path('%s.orth' % (self.name))
+        with open(path, 'w') as o_file:
             o_file.write(self.orthologs)
 
-        return os.getcwd() + os.sep + '%s.orth'%(self.name)
+        return path
 
     def call_alignment(self, orthologs):
         """
@@ -64,7 +73,7 @@ class OrthoLogo:
         Returns:
             The path to the file containing the alignment of the orthologs
         """
-        alignment = aminoCons.build_alignment(orthologs)
+        alignment = aminoCons.build_alignment(orthologs, cwd=self.work_path())
         self.alignment = alignment
         return alignment
 
@@ -79,17 +88,7 @@ class OrthoLogo:
         Returns:
             The index at which the motif can be found
         """
-        with open(msa, "r") as file:
-            msa = file.read()
-        msa_list = constool.indv_block(msa)
-        index = -1
-        for prot in msa_list:
-            prot = constool.seqnwl_strip(prot)
-            prot = constool.get_fasta_sequence(prot)
-            index = prot.find(motif)
-            if not index == -1:
-                break
-        return index
+        return Alignment.read(msa).find(motif)
 
     def run_seq2logo(self, msa):
         """Use Executor to call and run Seq2Logo on the selected section of the msa
@@ -107,8 +106,8 @@ class OrthoLogo:
         if self.start == -1:
             raise oma.SequenceError("The motif could not be found. Please check the multiple sequence alignment.")
         self.end = self.start + len(self.motif)
-        logo = Executor(name='Seq2Logo.py', args='-f %s -o %s -I 2 -C 0 -T 0 -b 0 -c %d-%d'%(msa, self.dir_name,
-                                                                                             self.start, self.end))
+        logo = Executor(name='Seq2Logo.py', args='-f %s -o %s -I 2 -C 0 -T 0 -b 0 -c %d-%d'%(
+            os.path.abspath(msa), self.dir_name, self.start, self.end), cwd=self.work_path())
         logo.run()
 
     def get_logo(self):
@@ -119,10 +118,7 @@ class OrthoLogo:
         """
         self.get_sequence()
 
-        directory = self.cwd + os.sep + 'Seq2Logo'
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        os.chdir(directory)
+        directory = self.work_path()
 
         msa = directory +  os.sep + '%s.aln' % (self.name)
         if os.path.isfile(msa):
@@ -132,7 +128,6 @@ class OrthoLogo:
             orth = self.call_orthologs()
             aln = self.call_alignment(orth)
             self.run_seq2logo(aln)
-        os.chdir(self.cwd)
         return directory
 
 if __name__== '__main__':
@@ -91,11 +91,12 @@ class ConsLogoTest(biskit.test.BiskitTest):
 
     @classmethod
     def tearDownClass(cls):
-        os.remove(os.getcwd() + os.sep + 'atn1seq.eps')
-        os.remove(os.getcwd() + os.sep + 'atn1seq-001.jpg')
-        os.remove(os.getcwd() + os.sep + 'atn1seq_freq.mat')
-        os.remove(os.getcwd() + os.sep + 'atn1seq.txt')
-        os.remove(os.getcwd() + os.sep + 'atn1seq.orth')
+        directory = cls.test_logo.workdir + os.sep
+        os.remove(directory + 'atn1seq.eps')
+        os.remove(directory + 'atn1seq-001.jpg')
+        os.remove(directory + 'atn1seq_freq.mat')
+        os.remove(directory + 'atn1seq.txt')
+        os.remove(directory + 'atn1seq.orth')
 
 if __name__== '__main__':
     biskit.test.localTest()
@@ -0,0 +1,257 @@
+"""
+A compact, NumPy backed multiple sequence alignment. The alignment is held as a 2-D uint8 array with one row for
+each protein and one column for each alignment position, so statistics over columns and the selection of proteins
+or columns run as array operations instead of loops over characters.
+
+Alignments are read from the fasta or clustal output of MAFFT in a single pass over the text, and can be saved as a
+.npy file that is later memory mapped instead of read.
+
+Usage:
+    msa = Alignment.read('atn1seq.aln')
+    column = msa.find('PHHHQHSHIHSHLHLHQ')
+    position = msa.positions[column]
+"""
+
+import io
+import itertools
+import numpy as np
+from biskit.errors import BiskitError
+from consScore import fasta
+
+#: The byte of the gap character
+GAP = ord('-')
+
+
+class AlignmentError(BiskitError):
+    pass
+
+
+def _lines(source):
+    return io.StringIO(source) if isinstance(source, str) else source
+
+
+def _read_clustal(lines):
+    rows = {}
+    for line in lines:
+        if not line.strip() or line[0].isspace():
+            continue
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        rows.setdefault(fields[0], []).append(fields[1])
+    return [(name, ''.join(chunks)) for name, chunks in rows.items()]
+
+
+class Alignment:
+    """
+    A multiple sequence alignment, as a matrix of uint8 characters with the id and header of each row. One row is
+    the reference- by default the first protein- and positions maps each column to the zero indexed residue of the
+    reference at that column, or -1 where the reference has a gap.
+    """
+
+    def __init__(self, ids, matrix, headers=None, reference=0):
+        """
+        Args:
+            ids(list): The id of each row
+            matrix(numpy.ndarray): The 2-D uint8 array of the alignment, one row for each id
+            headers(list): The full header of each row. Defaults to the ids
+            reference(int): The row that column positions refer to
+        """
+        matrix = np.asanyarray(matrix, dtype=np.uint8)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise AlignmentError('The alignment matrix does not have one row for each of the {0} ids'.format(len(ids)))
+        self.ids = list(ids)
+        self.headers = list(headers) if headers is not None else list(self.ids)
+        self.matrix = matrix
+        self.reference = reference
+        self._positions = None
+
+    @classmethod
+    def from_records(cls, records, reference=0):
+        """
+        Builds an alignment from fasta Records, or from (header, sequence) tuples. Every sequence must be the same
+        length
+        """
+        headers = []
+        data = bytearray()
+        length = None
+        for header, sequence in records:
+            if length is None:
+                length = len(sequence)
+            elif len(sequence) != length:
+                raise AlignmentError('{0} is {1} columns long, but the alignment is {2} columns long'.format(
+                    fasta.header_id(header), len(sequence), length))
+            headers.append(header)
+            data += sequence.encode('ascii')
+        matrix = np.frombuffer(bytes(data), dtype=np.uint8).reshape(len(headers), length or 0)
+        return cls([fasta.header_id(h) for h in headers], matrix, headers=headers, reference=reference)
+
+    @classmethod
+    def parse(cls, source, reference=0):
+        """
+        Reads an alignment in fasta or clustal format, in one pass. Use read for a file
+        Args:
+            source: The alignment text, or an iterable of its lines such as an open file
+            reference(int): The row that column positions refer to
+        Returns:
+            An Alignment object
+        """
+        lines = iter(_lines(source))
+        for line in lines:
+            if line.strip():
+                break
+        else:
+            return cls([], np.zeros((0, 0), dtype=np.uint8), reference=reference)
+        if line.startswith('CLUSTAL'):
+            return cls.from_records(_read_clustal(lines), reference=reference)
+        return cls.from_records(fasta.parse(itertools.chain([line], lines)), reference=reference)
+
+    @classmethod
+    def read(cls, path, reference=0):
+        """
+        Reads an alignment file written by MAFFT, or saved by Alignment.save. A .npy file is memory mapped rather
+        than read. A missing file raises FileNotFoundError
+        """
+        if path.endswith('.npy'):
+            return cls.load(path, reference=reference)
+        with open(path, 'r') as handle:
+            return cls.parse(handle, reference=reference)
+
+    def save(self, path):
+        """
+        Saves the matrix as a .npy file at path, and the headers next to it in path + '.ids', one per line
+        """
+        np.save(path, self.matrix)
+        with open(path + '.ids', 'w') as handle:
+            for header in self.headers:
+                handle.write(header + '\n')
+
+    @classmethod
+    def load(cls, path, mmap=True, reference=0):
+        """
+        Loads an alignment saved by Alignment.save
+        Args:
+            path(str): The .npy file
+            mmap(Boolean): If true, the matrix is memory mapped read only instead of read into memory
+            reference(int): The row that column positions refer to
+        """
+        matrix = np.load(path, mmap_mode='r' if mmap else None)
+        with open(path + '.ids', 'r') as handle:
+            headers = [line.rstrip('\n') for line in handle]
+        return cls([fasta.header_id(h) for h in headers], matrix, headers=headers, reference=reference)
+
+    @property
+    def shape(self):
+        """The number of rows and the number of columns"""
+        return self.matrix.shape
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def index(self, key):
+        """Returns the row number of the row with the given id, or the row number itself"""
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+        try:
+            return self.ids.index(key)
+        except ValueError:
+            raise KeyError(key)
+
+    def sequence(self, key):
+        """Returns the aligned sequence, with gaps, of a row given by id or row number"""
+        return self.matrix[self.index(key)].tobytes().decode('ascii')
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield fasta.Record(self.headers[row], self.sequence(row))
+
+    @property
+    def gaps(self):
+        """A boolean matrix, True where there is a gap"""
+        return self.matrix == GAP
+
+    def gap_fraction(self):
+        """Returns the fraction of rows with a gap, for each column"""
+        if not len(self):
+            return np.zeros(self.shape[1])
+        return self.gaps.mean(axis=0)
+
+    @property
+    def positions(self):
+        """
+        An integer array mapping each column to the zero indexed residue of the reference at that column, or -1
+        where the reference has a gap
+        """
+        if self._positions is None:
+            residues = self.matrix[self.reference] != GAP
+            positions = np.cumsum(residues) - 1
+            positions[~residues] = -1
+            self._positions = positions
+        return self._positions
+
+    def columns(self, positions=None):
+        """
+        Returns the columns at which the given zero indexed residues of the reference are. If no positions are
+        given, returns the columns of every residue of the reference
+        """
+        columns = np.flatnonzero(self.matrix[self.reference] != GAP)
+        if positions is None:
+            return columns
+        return columns[np.asarray(positions)]
+
+    def counts(self, alphabet):
+        """
+        Returns how often each character of the alphabet is in each column
+        Args:
+            alphabet(str): The characters counted
+        Returns:
+            An array with one row for each character of the alphabet and one column for each alignment column
+        """
+        codes = np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)
+        table = np.full(256, len(codes), dtype=np.intp)
+        table[codes] = np.arange(len(codes))
+        counts = np.zeros((len(codes) + 1, self.shape[1]), dtype=np.intp)
+        columns = np.broadcast_to(np.arange(self.shape[1]), self.shape)
+        np.add.at(counts, (table[self.matrix], columns), 1)
+        return counts[:-1]
+
+    def subset(self, rows=None, columns=None):
+        """
+        Returns a new alignment of some of the rows and columns
+        Args:
+            rows: Row numbers, ids, or a boolean mask over the rows. Defaults to every row
+            columns: Column numbers or a boolean mask over the columns. Defaults to every column
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        elif not isinstance(rows, np.ndarray) or rows.dtype != bool:
+            rows = np.array([self.index(r) for r in rows], dtype=np.intp)
+        else:
+            rows = np.flatnonzero(rows)
+        matrix = self.matrix[rows]
+        if columns is not None:
+            matrix = matrix[:, columns]
+        reference = int(np.flatnonzero(rows == self.reference)[0]) if self.reference in rows else 0
+        return Alignment([self.ids[r] for r in rows], np.ascontiguousarray(matrix),
+                         headers=[self.headers[r] for r in rows], reference=reference)
+
+    def find(self, motif):
+        """
+        Returns the first column at which the motif is found, checking each row in turn, or -1 if no row contains it.
+        Gaps are not skipped, so the motif must be unbroken in the row
+        """
+        motif = motif.encode('ascii')
+        for row in self.matrix:
+            index = row.tobytes().find(motif)
+            if index != -1:
+                return index
+        return -1
+
+    def write(self, handle, width=60):
+        """
+        Writes the alignment to an open file in fasta format
+        Returns:
+            The number of proteins written
+        """
+        return fasta.write(self, handle, width=width)
+
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for alignment
+"""
+import biskit.test
+import io
+import os
+import shutil
+import tempfile
+import numpy as np
+from consScore import alignment
+from consScore import treecache
+from consScore.alignment import Alignment
+
+ALIGNED = (">A first protein\n"
+           "--MKT-RQ\n"
+           ">B\n"
+           "MKMKTQR-\n"
+           ">C\n"
+           "-KMK--RQ\n")
+
+CLUSTAL = ("CLUSTAL format alignment by MAFFT FFT-NS-2 (v7.310)\n"
+           "\n"
+           "\n"
+           "A               --MK\n"
+           "B               MKMK\n"
+           "C               -KMK\n"
+           "                  **\n"
+           "\n"
+           "A               T-RQ\n"
+           "B               TQR-\n"
+           "C               --RQ\n"
+           "                  *\n")
+
+
+class TestAlignment(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the alignment module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.msa = Alignment.parse(ALIGNED)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_fasta(self):
+        """Tests that a fasta alignment is read into a matrix with the ids and headers of its rows"""
+        self.assertEqual(self.msa.shape, (3, 8))
+        self.assertEqual(self.msa.matrix.dtype, np.uint8)
+        self.assertEqual(self.msa.ids, ['A', 'B', 'C'])
+        self.assertEqual(self.msa.headers[0], 'A first protein')
+        self.assertEqual(self.msa.sequence('B'), 'MKMKTQR-')
+
+    def test_parse_clustal(self):
+        """Tests that a clustal alignment gives the same matrix as the fasta alignment"""
+        msa = Alignment.parse(io.StringIO(CLUSTAL))
+        self.assertEqual(msa.ids, ['A', 'B', 'C'])
+        self.assertTrue(np.array_equal(msa.matrix, self.msa.matrix))
+
+    def test_unequal_rows(self):
+        """Tests that rows of different lengths raise an error"""
+        with self.assertRaises(alignment.AlignmentError):
+            Alignment.parse(">A\nMK-\n>B\nMK\n")
+
+    def test_positions(self):
+        """Tests that columns map to the residues of the reference, and back"""
+        self.assertEqual(list(self.msa.positions), [-1, -1, 0, 1, 2, -1, 3, 4])
+        self.assertEqual(list(self.msa.columns([0, 4])), [2, 7])
+        self.assertEqual(list(self.msa.subset(['B', 'A']).positions), list(self.msa.positions))
+        self.assertEqual(list(self.msa.subset(['B']).positions), list(range(7)) + [-1])
+
+    def test_column_statistics(self):
+        """Tests the gap fraction and the residue counts of each column"""
+        self.assertEqual(list(self.msa.gap_fraction()), [2 / 3, 1 / 3, 0, 0, 1 / 3, 2 / 3, 0, 1 / 3])
+        counts = self.msa.counts('KM')
+        self.assertEqual(list(counts[0]), [0, 2, 0, 3, 0, 0, 0, 0])
+        self.assertEqual(list(counts[1]), [1, 0, 3, 0, 0, 0, 0, 0])
+
+    def test_subset(self):
+        """Tests that rows can be chosen by id or mask, and columns by number"""
+        msa = self.msa.subset(np.array([True, False, True]), columns=[2, 3])
+        self.assertEqual(msa.ids, ['A', 'C'])
+        self.assertEqual(msa.sequence(1), 'MK')
+
+    def test_find(self):
+        """Tests that find gives the first column of an unbroken motif in any row"""
+        self.assertEqual(self.msa.find('KTQ'), 3)
+        self.assertEqual(self.msa.find('MKTR'), -1)
+
+    def test_save_load(self):
+        """Tests that a saved alignment is memory mapped when it is loaded"""
+        path = os.path.join(self.directory, 'msa.npy')
+        self.msa.save(path)
+        msa = Alignment.read(path)
+        self.assertTrue(isinstance(msa.matrix, np.memmap))
+        self.assertEqual(msa.headers, self.msa.headers)
+        self.assertEqual(list(msa), list(self.msa))
+
+    def test_read_mafft(self):
+        """Tests that the alignment of the example data is read whole"""
+        msa = Alignment.read(os.path.join(os.path.dirname(__file__), 'example_data', 'atn1seq.aln'))
+        self.assertEqual(len(msa), 42)
+        self.assertEqual(msa.ids[0], 'PROCA12070')
+        self.assertEqual(msa.find('PHHHQHSHIHSHLHLHQ'), 1254)
+
+    def test_read_missing(self):
+        """Tests that reading a file that does not exist raises, rather than parsing the path as text"""
+        with self.assertRaises(FileNotFoundError):
+            Alignment.read(os.path.join(self.directory, 'missing.aln'))
+        with self.assertRaises(FileNotFoundError):
+            treecache.alignment_hash(os.path.join(self.directory, 'missing.aln'))
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -8,12 +8,20 @@ Created on Tue Jun 26 09:45:57 2018
 
 import os
 import re
+import shutil
+import subprocess
+import tempfile
 import warnings
-from consScore import constool
-from fractions import Fraction
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from consScore import fasta
+from consScore.alignment import Alignment
+from consScore import njtree
+from consScore import treecache
 from biskit import ProfileCollection
 import biskit.tools as t
-from biskit.exe import Executor
+from biskit.exe import Executor, ExeConfigCache
 from biskit.errors import BiskitError
 
 class SequenceError(BiskitError):
@@ -26,26 +34,166 @@ class Rate4SiteError(BiskitError):
     pass
 
 
+#: The MAFFT strategies that can be chosen, and the options that select them. 'auto' leaves the choice to MAFFT
+MAFFT_STRATEGIES = {'auto': '--auto',
+                    'FFT-NS-1': '--retree 1 --maxiterate 0',
+                    'FFT-NS-2': '--retree 2 --maxiterate 0',
+                    'FFT-NS-i': '--retree 2 --maxiterate 1000',
+                    'L-INS-i': '--localpair --maxiterate 1000'}
+
+#: Rough seconds per (number of sequences squared times length) of each strategy on one thread, used by the
+#: adaptive profile to estimate how long an alignment takes. Listed from the most accurate to the fastest
+MAFFT_COSTS = (('L-INS-i', 2e-6), ('FFT-NS-i', 2e-7), ('FFT-NS-2', 2e-8), ('FFT-NS-1', 1e-8))
+
+#: The size in bytes of the fasta text above which align_sequences writes it to a file in SPILL_DIR for MAFFT, rather
+#: than passing it through stdin
+MAFFT_SPILL_SIZE = 8 * 1024 * 1024
+
+#: The number of seconds align_sequences waits for MAFFT before giving up
+MAFFT_TIMEOUT = 3600
+
+#: Where align_sequences writes large inputs. /dev/shm is memory backed on Linux, so the file never reaches a disk
+SPILL_DIR = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+
+#: The Rate4Site performance profiles, and the options that select them. fast computes maximum likelihood rates with
+#: 4 gamma categories and keeps the branch lengths of the tree, balanced computes empirical Bayes rates with 8
+#: categories and optimises branch lengths under a homogeneous model, and accurate is the Rate4Site default of
+#: empirical Bayes rates with 16 categories and branch lengths optimised under the gamma model
+RATE4SITE_PROFILES = {'fast': '-im -k 4 -bn', 'balanced': '-ib -k 8 -bh', 'accurate': '-ib -k 16 -bg'}
+
+#: The tree argument of Rate4Site that asks for the neighbor-joining tree of njtree
+NJ_TREE = 'nj'
+
+
+class AlignmentProfile:
+
+    """
+    The options MAFFT is run with. The strategy is one of MAFFT_STRATEGIES, or 'adaptive', which chooses the most
+    accurate strategy expected to finish within the time budget, from the number and length of the sequences.
+    """
+
+    def __init__(self, strategy='auto', retree=None, maxiterate=None, thread=None, time_budget=60):
+        """
+        Args:
+            strategy(str): One of MAFFT_STRATEGIES, or 'adaptive'
+            retree(int): Overrides the number of times the guide tree is built
+            maxiterate(int): Overrides the largest number of refinement iterations
+            thread(int): The number of threads MAFFT uses. -1 lets MAFFT use every core. If None, MAFFT uses one
+            time_budget(float): The seconds an adaptive alignment should take at most. Only a rough target
+        """
+        if strategy != 'adaptive' and strategy not in MAFFT_STRATEGIES:
+            raise MAFFTError('Unknown MAFFT strategy {0}'.format(strategy))
+        self.strategy = strategy
+        self.retree = retree
+        self.maxiterate = maxiterate
+        self.thread = thread
+        self.time_budget = time_budget
+
+    def __repr__(self):
+        return 'AlignmentProfile({0!r}, retree={1}, maxiterate={2}, thread={3}, time_budget={4})'.format(
+            self.strategy, self.retree, self.maxiterate, self.thread, self.time_budget)
+
+    def choose(self, count, length):
+        """
+        Returns the strategy used for the given number of sequences, of at most the given length
+        """
+        if self.strategy != 'adaptive':
+            return self.strategy
+        threads = self.thread if self.thread and self.thread > 0 else 1
+        for strategy, cost in MAFFT_COSTS:
+            if cost * count * count * length / threads <= self.time_budget:
+                return strategy
+        return MAFFT_COSTS[-1][0]
+
+    def options(self, strategy):
+        """
+        Returns the MAFFT command line options of the strategy with the overrides of this profile
+        """
+        options = MAFFT_STRATEGIES[strategy].split()
+        for flag, value in (('--retree', self.retree), ('--maxiterate', self.maxiterate)):
+            if value is not None:
+                if flag in options:
+                    del options[options.index(flag):options.index(flag) + 2]
+                options += [flag, str(value)]
+        if self.thread is not None:
+            options += ['--thread', str(self.thread)]
+        return ' '.join(options)
+
+    def describe(self, file):
+        """
+        Chooses the strategy for a fasta file, or for fasta Records
+        Returns:
+            The strategy, the options and the number and largest length of the sequences
+        """
+        count = 0
+        length = 0
+        for record in (fasta.read(file) if isinstance(file, str) else file):
+            count += 1
+            length = max(length, len(record.sequence))
+        strategy = self.choose(count, length)
+        return strategy, self.options(strategy), count, length
+
+
+def _profile(profile):
+    if profile is None:
+        return AlignmentProfile()
+    if isinstance(profile, str):
+        return AlignmentProfile(profile)
+    return profile
+
+
+def strategy_path(path):
+    """
+    Returns the path of the file recording the strategy that the alignment at path was made with
+    """
+    return os.path.splitext(path)[0] + '.strategy'
+
+
+def record_strategy(path, strategy, options, count, length):
+    """
+    Writes the strategy that the alignment at path was made with next to it, as tab separated keys and values
+    """
+    with open(strategy_path(path), 'w') as handle:
+        handle.write('strategy\t{0}\noptions\t{1}\nsequences\t{2}\nlength\t{3}\n'.format(strategy, options, count,
+                                                                                         length))
+
+
+def read_strategy(path):
+    """
+    Returns the strategy that the alignment at path was made with, as a dictionary of the keys written by
+    record_strategy, or None if it was not recorded
+    """
+    if not os.path.isfile(strategy_path(path)):
+        return None
+    with open(strategy_path(path), 'r') as handle:
+        return dict(line.rstrip('\n').split('\t', 1) for line in handle if '\t' in line)
+
+
 class MAFFT(Executor):
 
     """
       Calls the Mafft program to build an alignment of protein sequences
        Args:
            file: The absolute file path to the collection of protein sequences
+           profile: An AlignmentProfile, or the name of a strategy
+           cwd(str): The directory MAFFT runs in and the alignment is written to. Defaults to the current working
+               directory
        Returns:
-           A string detailing the path to the folder containing the alignment file. The
-           alignment is output in the current working directory.
+           A string detailing the path to the folder containing the alignment file.
 
-    Note- the alignment is given in clustal format, and the alignment method that maff uses is automatically chosen
-    based on the size of the file to be aligned
+    Note- the alignment is given in clustal format, and by default the alignment method that maff uses is automatically
+    chosen based on the size of the file to be aligned. A different AlignmentProfile, or the name of a strategy, can be
+    given as profile. The strategy used is recorded next to the alignment, see read_strategy
     """
 
-    def __init__(self, file):
+    def __init__(self, file, profile=None, cwd=None):
         filename = os.path.basename(file)
         self.filename = filename.split('.')[0]
+        self.strategy = _profile(profile).describe(file)
+        self.cwd = os.path.abspath(cwd or os.getcwd())
 
-        super().__init__(name="mafft", args=" --auto --clustalout {0}".format(file), f_out='%s.aln' % (self.filename))
-        self.cwd = os.getcwd()
+        super().__init__(name="mafft", args=" {0} --clustalout {1}".format(self.strategy[1], os.path.abspath(file)),
+                         f_out=self.cwd + os.sep + '%s.aln' % (self.filename), cwd=self.cwd)
         self.has_run = False
         self.returncode = None
 
@@ -68,6 +216,7 @@ class MAFFT(Executor):
         super().finish()
         self.has_run = True
         self.result = self.cwd + os.sep + '%s.aln' % (self.filename)
+        record_strategy(self.result, *self.strategy)
 
     def isfailed(self):
         """
@@ -87,37 +236,155 @@ class MAFFT(Executor):
         self.log.add(s)
         raise MAFFTError(s)
 
-def build_alignment(file):
+def build_alignment(file, profile=None, cwd=None):
     """
        Calls the Mafft program to build an alignment of protein sequences in fasta format
        Args:
            file: The absolute file path to the collection of protein sequences
+           profile: An AlignmentProfile, or the name of a strategy. Defaults to letting MAFFT choose
+           cwd(str): The directory MAFFT runs in and the alignment is written to. Defaults to the current working
+               directory
        Returns:
-           A string detailing the path to the folder containing the alignment file. The
-           alignment is output in the current working directory.
+           A string detailing the path to the folder containing the alignment file. The strategy used is recorded
+           next to it, see read_strategy
        """
     filename = os.path.basename(file)
     filename = filename.split('.')[0]
+    strategy = _profile(profile).describe(file)
+    cwd = os.path.abspath(cwd or os.getcwd())
 
-    aln = Executor(name="mafft", args=" --auto {0}".format(file), f_out='%s.aln' % (filename))
-    directory = os.getcwd() + os.sep + '%s.aln' % (filename)
+    directory = cwd + os.sep + '%s.aln' % (filename)
+    aln = Executor(name="mafft", args=" {0} {1}".format(strategy[1], os.path.abspath(file)), f_out=directory, cwd=cwd)
     aln.run()
+    record_strategy(directory, *strategy)
     return directory
 
-def clean_alignment(path, cache):
+def align_sequences(sequences, profile=None, as_alignment=True, spill_size=MAFFT_SPILL_SIZE, spill_dir=None,
+                    path=None, timeout=MAFFT_TIMEOUT):
+    """
+    Aligns protein sequences with MAFFT without files- the fasta text is passed to MAFFT through stdin, and the
+    alignment is read from its stdout. Input larger than spill_size is written to a file in spill_dir instead, since
+    a pipe is no faster for it and holds it in memory twice
+    Args:
+        sequences: The sequences in fasta format, as text or as fasta Records
+        profile: An AlignmentProfile, or the name of a strategy. Defaults to letting MAFFT choose
+        as_alignment(Boolean): If true, the alignment is returned as an Alignment object, otherwise as fasta text
+        spill_size(int): The size in bytes of the fasta text above which it is written to a file
+        spill_dir(str): Where the file is written. Defaults to SPILL_DIR
+        path(str): If given, the alignment is also written to this file, with its strategy recorded next to it as
+            build_alignment does
+        timeout(float): The number of seconds to wait for MAFFT before raising a MAFFTError. None waits for ever
+    Returns:
+        The alignment, as an Alignment object or as fasta text
+    """
+    if not isinstance(sequences, str):
+        sequences = ''.join(record.format() + '\n' for record in sequences)
+    strategy = _profile(profile).describe(fasta.parse(sequences))
+    exe = ExeConfigCache.get('mafft')
+    exe.validate()
+    command = [exe.bin] + strategy[1].split()
+    source = None
+    if len(sequences.encode('utf-8')) > spill_size:
+        handle, source = tempfile.mkstemp(suffix='.fasta', dir=spill_dir or SPILL_DIR)
+        with os.fdopen(handle, 'w') as file:
+            file.write(sequences)
+    try:
+        process = subprocess.run(command + [source or '-'], input=None if source else sequences,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                                 env=exe.environment(), timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise MAFFTError('MAFFT did not finish within {0} seconds'.format(timeout))
+    finally:
+        if source:
+            t.tryRemove(source)
+    if process.returncode != 0:
+        raise MAFFTError('MAFFT failed with exit code {0}: {1}'.format(process.returncode,
+                                                                        process.stderr.strip()[-500:]))
+    if path:
+        with open(path, 'w') as handle:
+            handle.write(process.stdout)
+        record_strategy(path, *strategy)
+    return Alignment.parse(process.stdout) if as_alignment else process.stdout
+
+
+def update_alignment(aln, file, threshold=0.2, profile=None, keeplength=True, cwd=None):
+    """
+    Brings a cached alignment up to date with a fasta file of the sequences that it should contain. Sequences of the
+    file that are not in the alignment yet are added to it with mafft --add, which keeps the existing alignment as it
+    is. The alignment is built again from scratch with build_alignment if the new sequences are more than the
+    threshold fraction of the aligned ones, or if sequences of the alignment are no longer in the file.
+    Sequences are matched by the id in their header.
+    Args:
+        aln(str): The file path to the alignment, in fasta format, as build_alignment writes it
+        file(str): The file path to all the sequences that should be aligned, in fasta format
+        threshold(float): The largest number of new sequences, as a fraction of the aligned sequences, that are added
+            rather than aligned again from scratch
+        profile: The AlignmentProfile used to build the alignment from scratch. Its threads are also used by --add
+        keeplength(Boolean): If true, residues of the new sequences that would open new columns are left out, so that
+            the columns of the alignment, and the positions of its first sequence, stay the same
+        cwd(str): The directory MAFFT runs in and the alignment is written to. Defaults to the current working
+            directory
+    Returns:
+        The path to the updated alignment, which is at the path of build_alignment for the file
+    """
+    aligned = set(r.id for r in fasta.read(aln))
+    wanted = set()
+    added = []
+    length = 0
+    for record in fasta.read(file):
+        wanted.add(record.id)
+        length = max(length, len(record.sequence))
+        if record.id not in aligned:
+            added.append(record)
+    cwd = os.path.abspath(cwd or os.getcwd())
+    path = cwd + os.sep + '%s.aln' % (os.path.basename(file).split('.')[0])
+    if not aligned or not aligned <= wanted or len(added) > threshold * len(aligned):
+        return build_alignment(file, profile=profile, cwd=cwd)
+    if os.path.abspath(aln) != os.path.abspath(path):
+        shutil.copyfile(aln, path)
+    if not added:
+        return path
+
+    addition = path[:-len('.aln')] + '.add'
+    with open(addition, 'w') as handle:
+        fasta.write(added, handle)
+    options = '--add {0}'.format(addition) + (' --keeplength' if keeplength else '')
+    thread = _profile(profile).thread
+    if thread is not None:
+        options += ' --thread {0}'.format(thread)
+    update = Executor(name="mafft", args=" {0} {1}".format(options, path), f_out=path + '.new', cwd=cwd)
+    try:
+        update.run()
+        os.replace(path + '.new', path)
+    finally:
+        t.tryRemove(addition)
+        t.tryRemove(path + '.new')
+    record_strategy(path, 'add', options.replace(addition, os.path.basename(addition)), len(wanted), length)
+    return path
+
+
+def clean_alignment(path, cache, cwd=None):
     """
     Deletes the files generated by Mafft when called using build_alignment
     Args:
         path (str): The file path to the alignment file
         cache (Boolean): If true, the alignment file is kept. If false, the alignment
         file is also deleted
+        cwd (str): The directory Mafft was run in. Defaults to the current working directory
     """
     filename = os.path.basename(path)
     filename = str(filename.split('.')[0])
+    cwd = os.path.abspath(cwd or os.getcwd())
 
     if not cache:
-        t.tryRemove(os.getcwd() + os.sep + '%s.aln' % (filename))
-    t.tryRemove(os.getcwd() + os.sep + '%s.dnd' % (filename))
+        t.tryRemove(cwd + os.sep + '%s.aln' % (filename))
+        t.tryRemove(cwd + os.sep + '%s.strategy' % (filename))
+    t.tryRemove(cwd + os.sep + '%s.dnd' % (filename))
+
+
+def _leaves(tree):
+    with open(tree, 'r') as handle:
+        return set(njtree.leaves(handle.read()))
 
 
 class Rate4Site(Executor):
@@ -135,14 +402,53 @@ class Rate4Site(Executor):
     """
 
     def __init__(self, msa, profile=True, cache=True, identity=True, score=True, qqint=False, std=False,
-                gapped=False, **kw):
-
+                gapped=False, tree=None, tree_cache=None, rate_profile='accurate', **kw):
+        """
+        Args:
+            msa(str): The path to the alignment file
+            tree(str): The path to a tree of the alignment, in Newick format, which Rate4Site uses instead of
+                building its own, or 'nj' to give Rate4Site the neighbor-joining tree that njtree builds, which is
+                much faster on large alignments
+            tree_cache(treecache.TreeCache): If no tree file is given, the cached tree of the alignment is used if
+                there is one, and otherwise the tree that is built is added to the cache
+            With 'nj' or a tree cache, Rate4Site reads a copy of the alignment written with njtree.write_alignment,
+            so that its sequence names are the leaves of the tree, and a tree whose leaves differ raises a
+            Rate4SiteError. The copy and the neighbor-joining tree are written to a folder of their own in the
+            tempdir, or the system temporary folder, which close deletes
+            cwd(str): The directory Rate4Site runs in and writes its output to. Rate4Site always names some of its
+                output files the same, so jobs that run at the same time need different directories. Defaults to the
+                current working directory
+            rate_profile(str): One of RATE4SITE_PROFILES, trading the accuracy of the rates for speed. Maximum
+                likelihood rates of the fast profile have no QQ interval or standard deviation
+        The other arguments choose the outputs, as described in rate2dict
+        """
+        if rate_profile not in RATE4SITE_PROFILES:
+            raise Rate4SiteError('Unknown Rate4Site profile {0}. Choose one of {1}'.format(
+                rate_profile, ', '.join(RATE4SITE_PROFILES)))
         aln_file = os.path.basename(msa)
         self.dir_name = aln_file.split('.')[0]
-        super().__init__(name='rate4site', args='-s %s -o %s.res' % (msa, self.dir_name),
-                         catch_out=1, **kw)
+        self.tree_cache = tree_cache
+        self.tree_key = None
+        cwd = os.path.abspath(kw.pop('cwd', None) or os.getcwd())
+        self.named_msa = None
+        self.job_dir = None
+        if tree == NJ_TREE or tree_cache is not None:
+            parent = kw.get('tempdir') if isinstance(kw.get('tempdir'), str) else None
+            self.job_dir = tempfile.mkdtemp(prefix='%s_' % self.dir_name, dir=parent)
+            try:
+                tree = self._prepare_tree(msa, tree, tree_cache)
+            except BaseException:
+                shutil.rmtree(self.job_dir, ignore_errors=True)
+                raise
+        self.tree = tree
+        args = '-s %s -o %s.res' % (os.path.abspath(self.named_msa or msa), self.dir_name)
+        if tree:
+            args += ' -t %s' % os.path.abspath(tree)
+        self.rate_profile = rate_profile
+        args += ' ' + RATE4SITE_PROFILES[rate_profile]
+        super().__init__(name='rate4site', args=args, catch_out=1, cwd=cwd, **kw)
         self.alpha = 0
-        self.cwd = os.getcwd()
+        self.cwd = cwd
         self.score_output = self.cwd + os.sep + '%s.res' % self.dir_name
         self.has_run = False
         self.cache = cache
@@ -153,6 +459,29 @@ class Rate4Site(Executor):
         self.gapped = gapped
         self.profile = profile
         self.num_sequences= 0
+        self.rates = None
+
+    def _prepare_tree(self, msa, tree, tree_cache):
+        """
+        Writes the renamed copy of the alignment into job_dir, and returns the tree Rate4Site is given- the tree
+        file, a cached tree of the alignment, or a neighbor-joining tree written into job_dir
+        """
+        alignment = Alignment.read(msa)
+        names = set(njtree.leaf_names(alignment.ids))
+        self.named_msa = njtree.write_alignment(alignment, self.job_dir + os.sep + '%s.aln' % self.dir_name)
+        if tree in (None, NJ_TREE) and tree_cache is not None:
+            self.tree_key = treecache.alignment_hash(alignment)
+            cached = tree_cache.get(self.tree_key)
+            # A cached tree with other names, such as one built before the alignment was renamed, is not used
+            if cached and _leaves(cached) == names:
+                tree = cached
+        if tree == NJ_TREE:
+            tree = njtree.write_tree(alignment, self.job_dir + os.sep + '%s.tree' % self.dir_name)
+            if tree_cache is not None:
+                tree = tree_cache.put(self.tree_key, tree)
+        if tree and _leaves(tree) != names:
+            raise Rate4SiteError('The leaves of the tree {0} are not the sequences of {1}'.format(tree, msa))
+        return tree
 
     def run(self, inp_mirror=None):
         """
@@ -170,11 +499,17 @@ class Rate4Site(Executor):
         Overwrites Executor method. Called when the program is done executing.
         """
         super().finish()
-        self.alpha = get_alpha(self.score_output)
+        self.rates = read_rates(self.score_output)
+        if self.rates.alpha is None:
+            raise Rate4SiteError('File format is not supported')
+        self.alpha = self.rates.alpha
+        built = self.cwd + os.sep + 'TheTree.txt'
+        if self.tree_cache is not None and not self.tree and os.path.isfile(built):
+            self.tree = self.tree_cache.put(self.tree_key, built)
         if self.profile:
-            self.result = self.rate2profile(self.score_output)
+            self.result = self.table2profile(self.rates.residues)
         else:
-            self.result = self.rate2dict(self.score_output)
+            self.result = self.table2dict(self.rates.residues)
         self.has_run = True
 
     def isfailed(self):
@@ -215,13 +550,17 @@ class Rate4Site(Executor):
         """
         t.tryRemove(self.cwd + os.sep + 'TheTree.txt')
         t.tryRemove(self.cwd + os.sep + '%s.res' % (self.dir_name))
-        t.tryRemove(self.tempdir, tree=True)
+        if self.job_dir:
+            t.tryRemove(self.job_dir, tree=True)
+        # The temporary folder is only removed if it was made for this job, never the shared system folder
+        if not self.keep_tempdir:
+            t.tryRemove(self.tempdir, tree=True)
         self.has_run = False
 
-    def rate2dict(self,r4s):
+    def rate2dict(self, r4s):
         """
-        Take the output from rate4site and convert it into a numpy array, mapping
-        each conservation score onto its corresponding amino acid.
+        Take the output from rate4site and convert it into a dictionary, mapping each conservation score onto its
+        corresponding amino acid.
 
         Args:
             r4s (str): The absolute filepath to the output file from the Rate4Site program, version 2.01
@@ -234,101 +573,188 @@ class Rate4Site(Executor):
                 gapped(boolean): MSA DATA, the number of aligned sequences having an amino acid (non-gapped) from the overall
                     number of sequences at each position
         Returns:
-            An array, where the entry at each index contains information about
+            A dictionary, where the entry at each index contains information about
             the amino acid at that position.
         """
-        # The document is parsed by pulling splitting the text from the output file
-        # using newlines as delimiters, and grabbing only the lines that do not start
-        # with a # symbol. Whats left are the rows of the table, where each row contains
-        # information about an amino acid. The rows are then split up depending on
-        # what information it carries.
-
-        try:
-            if os.path.isfile(r4s):
-                with open(r4s, 'r') as file:
-                    contents = file.read()
-                residues = extract_resi(contents)
-                r2dict = {}
-                i = 0
-                for r in residues:
-                    r2mat = []
-                    aa_data = re.split(r'[\]\[\s,]', r)
-                    aa_data = list(filter(lambda x: x is not '', aa_data))
-                    if self.identity:
-                        amino = aa_data[1]
-                        r2mat.append(amino)
-                    if self.score:
-                        conse = float(aa_data[2])
-                        r2mat.append(conse)
-                    if self.qqint:
-                        intqq = (float(aa_data[3]), float(aa_data[4]))
-                        r2mat.append(intqq)
-                    if self.std:
-                        stdev = float(aa_data[5])
-                        r2mat.append(stdev)
-                    if self.gapped:
-                        align = aa_data[6]
-                        r2mat.append(align)
-                    r2mat = tuple(r2mat)
-                    r2dict[i] = r2mat
-                    i += 1
-                return r2dict
-            else:
-                raise FileNotFoundError
-        finally:
-            warnings.warn("This method is especially susceptible to changes in the format of the output file", Warning)
+        return self.table2dict(read_rates(r4s).residues)
+
+    def table2dict(self, residues):
+        """
+        Builds the output dictionary of rate2dict from the residue table of read_rates
+        """
+        columns = []
+        if self.identity:
+            columns.append(residues['aa'].tolist())
+        if self.score:
+            columns.append(residues['score'].tolist())
+        if self.qqint:
+            columns.append(list(zip(residues['qq_low'].tolist(), residues['qq_high'].tolist())))
+        if self.std:
+            columns.append(residues['std'].tolist())
+        if self.gapped:
+            columns.append(['%d/%d' % pair for pair in zip(residues['msa_count'], residues['msa_total'])])
+        return {i: row for i, row in enumerate(zip(*columns))} if columns else {i: () for i in range(len(residues))}
 
     def rate2profile(self, r4s):
-        """"""
-        # Note: looping over the output dictionary feels inefficient. Dw, I can copy the above and output directly into a PC
-        try:
-            if os.path.isfile(r4s):
-                with open(r4s, 'r') as file:
-                    contents = file.read()
-                residues = extract_resi(contents)
-                r2mat = ProfileCollection()
-                identity = []
-                score = []
-                qqint = []
-                std = []
-                gapped = []
-
-                for r in residues:
-                    aa_data = re.split(r'[\]\[\s,]', r)
-                    aa_data = list(filter(lambda x: x is not '', aa_data))
-                    if self.identity:
-                        amino = aa_data[1]
-                        identity.append(amino)
-                    if self.score:
-                        conse = float(aa_data[2])
-                        score.append(conse)
-                    if self.qqint:
-                        intqq = [float(aa_data[3]), float(aa_data[4])]
-                        qqint.append(intqq)
-                    if self.std:
-                        stdev = float(aa_data[5])
-                        std.append(stdev)
-                    if self.gapped:
-                        align = Fraction(aa_data[6])
-                        self.num_sequences = align.denominator
-                        percent = align.numerator / align.denominator
-                        gapped.append(percent)
-
-                if self.identity:
-                    r2mat.set('Amino Acid', identity, asarray=2)
-                if self.score:
-                    r2mat.set('Conservation Score', score, asarray=2)
-                if self.qqint:
-                    r2mat.set('QQ interval', qqint, asarray=2)
-                if self.std:
-                    r2mat.set('Standard Deviation', std, asarray=2)
-                if self.gapped:
-                    r2mat.set('Gapped', gapped)
-                return r2mat
-            else:
-                raise FileNotFoundError
-        finally:
-            warnings.warn("This method is especially susceptible to changes in the format of the output file", Warning)
+        """
+        Take the output from rate4site and convert it into a ProfileCollection, with one profile for each of the
+        outputs chosen, as in rate2dict
+        Args:
+            r4s (str): The absolute filepath to the output file from the Rate4Site program, version 2.01
+        """
+        return self.table2profile(read_rates(r4s).residues)
+
+    def table2profile(self, residues):
+        """
+        Builds the output ProfileCollection of rate2profile from the residue table of read_rates
+        """
+        r2mat = ProfileCollection()
+        if self.identity:
+            r2mat.set('Amino Acid', residues['aa'].tolist(), asarray=2)
+        if self.score:
+            r2mat.set('Conservation Score', residues['score'].tolist(), asarray=2)
+        if self.qqint:
+            r2mat.set('QQ interval', np.stack([residues['qq_low'], residues['qq_high']], axis=1).tolist(), asarray=2)
+        if self.std:
+            r2mat.set('Standard Deviation', residues['std'].tolist(), asarray=2)
+        if self.gapped:
+            if len(residues):
+                self.num_sequences = int(residues['msa_total'][-1])
+            r2mat.set('Gapped', (residues['msa_count'] / residues['msa_total']).tolist())
+        return r2mat
+
+
+#: The outcome of one Rate4Site job of a Rate4SitePool- the alignment scored, the scores as Rate4Site.run returns
+#: them, and the alpha parameter
+Rate4SiteResult = namedtuple('Rate4SiteResult', ['msa', 'scores', 'alpha'])
+
+
+def _run_rate4site(msa, scratch, options):
+    directory = tempfile.mkdtemp(prefix='r4s_', dir=scratch)
+    try:
+        job = Rate4Site(msa, cwd=directory, tempdir=directory, cache=False, **options)
+        scores = job.run()
+        alpha = job.alpha
+        job.close()
+        return Rate4SiteResult(msa, scores, alpha)
+    finally:
+        t.tryRemove(directory, tree=True)
+
+
+class Rate4SitePool:
+
+    """
+    Runs many Rate4Site jobs at the same time. Each job runs in a scratch directory of its own, so the files that
+    Rate4Site writes under fixed names, such as r4s.res and TheTree.txt, do not clash. The scratch directory is
+    deleted once the scores are read.
+
+    Usage:
+        with Rate4SitePool(workers=8, profile=False) as pool:
+            results = pool.map(['a.aln', 'b.aln'])
+    """
+
+    def __init__(self, workers=None, scratch=None, processes=True, **options):
+        """
+        Args:
+            workers(int): The number of jobs run at the same time. Defaults to the number of cores
+            scratch(str): The directory the scratch directories are made in. Defaults to the system temporary directory
+            processes(Boolean): If true, jobs are run from a pool of processes, otherwise from a pool of threads
+            options: The keyword arguments of Rate4Site, such as profile, qqint or gapped. cache has no effect, as
+                the output files of each job are always deleted
+        """
+        options.pop('cache', None)
+        self.workers = workers or os.cpu_count() or 1
+        self.scratch = scratch
+        self.options = options
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._executor = pool(max_workers=self.workers)
+
+    def submit(self, msa):
+        """
+        Starts a job scoring the alignment
+        Args:
+            msa(str): The path to the alignment file
+        Returns:
+            A concurrent.futures.Future of the Rate4SiteResult
+        """
+        return self._executor.submit(_run_rate4site, os.path.abspath(msa), self.scratch, self.options)
+
+    def map(self, msas):
+        """
+        Scores the alignments, running up to workers jobs at the same time
+        Returns:
+            A list of the Rate4SiteResult of each alignment, in the order of the alignments
+        """
+        return [future.result() for future in [self.submit(msa) for msa in msas]]
+
+    def close(self):
+        """
+        Waits for the running jobs and stops the pool
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#: The columns of the residue table of a Rate4Site output file. A column missing from the file is NaN
+RESIDUE_DTYPE = np.dtype([('position', np.int32), ('aa', 'U1'), ('score', np.float64), ('qq_low', np.float64),
+                          ('qq_high', np.float64), ('std', np.float64), ('msa_count', np.int32),
+                          ('msa_total', np.int32)])
+
+#: The result of read_rates- the alpha parameter, the other header values, and the residue table
+RateTable = namedtuple('RateTable', ['alpha', 'metadata', 'residues'])
+
+_RESIDUE = re.compile(r'^\s*(\d+)\s+(\S)\s+(\S+)(?:\s+\[\s*([^,\]]+),\s*([^\]]+)\])?(?:\s+(\S+))?\s+(\d+)/(\d+)\s*$')
+_NUMBER = re.compile(r'[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?')
+_METADATA = (('alpha parameter', 'alpha'), ('LL=', 'log likelihood'), ('Average', 'average'),
+             ('Standard Deviation', 'standard deviation'), ('discrete categories', 'categories'))
+_warned = False
+
+
+def read_rates(r4s):
+    """
+    Reads a Rate4Site output file in a single pass
+    Args:
+        r4s (str): The absolute filepath to the output file from the Rate4Site program, version 2.01
+    Returns:
+        A RateTable of the alpha parameter (None if the file does not give it), a dictionary of the other numbers in
+        the comments- the log likelihood, average, standard deviation and number of rate categories, as far as the
+        file gives them- together with the description of the method, and a structured array of the residue table
+        with the columns of RESIDUE_DTYPE
+    """
+    global _warned
+    if not _warned:
+        _warned = True
+        warnings.warn("Reading Rate4Site output is especially susceptible to changes in the format of the output file",
+                      Warning)
+    metadata = {}
+    rows = []
+    with open(r4s, 'r') as file:
+        for line in file:
+            if line.startswith('#'):
+                if line.startswith('#Rates were calculated'):
+                    metadata['method'] = line[1:].strip()
+                for text, key in _METADATA:
+                    if text in line and key not in metadata:
+                        number = _NUMBER.findall(line)
+                        if number:
+                            metadata[key] = float(number[-1])
+                continue
+            if not line.strip():
+                continue
+            match = _RESIDUE.match(line)
+            if match is None:
+                raise Rate4SiteError('File format is not supported')
+            pos, aa, score, low, high, std, count, total = match.groups()
+            rows.append((int(pos), aa, float(score), float(low or 'nan'), float(high or 'nan'), float(std or 'nan'),
+                         int(count), int(total)))
+    alpha = metadata.pop('alpha', None)
+    return RateTable(alpha, metadata, np.array(rows, dtype=RESIDUE_DTYPE))
+
 
 def get_alpha(r4s):
     """
@@ -338,23 +764,10 @@ def get_alpha(r4s):
     Returns:
         The alpha parameter of the conservation score.
     """
-    try:
-        if os.path.isfile(r4s):
-            with open(r4s, 'r') as f:
-                contents = f.read()
-            splitted = contents.split(os.linesep)
-            for s in splitted:
-                if re.search('alpha parameter', s):
-                    parameter = constool.get_num(s)
-                    return parameter[0]
-            raise Rate4SiteError('File format is not supported')
-        else:
-            raise FileNotFoundError
-    except IndexError:
+    alpha = read_rates(r4s).alpha
+    if alpha is None:
         raise Rate4SiteError('File format is not supported')
-    finally:
-        warnings.warn("This method is especially susceptible to changes in the format of \
-        the output file", Warning)
+    return alpha
 
 def extract_resi(string):
     """
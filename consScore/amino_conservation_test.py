@@ -6,8 +6,14 @@ Created on Sun Jul  1 16:58:25 2018
 @author: suliat16
 """
 import os
+import shutil
+import tempfile
+import numpy as np
 from consScore import aminoCons as am
+from consScore import njtree
+from consScore import treecache
 import biskit.test
+from unittest.mock import patch
 
 class test_amino_conservation(biskit.test.BiskitTest):
 
@@ -126,9 +132,247 @@ class test_amino_conservation(biskit.test.BiskitTest):
         self.assertFalse(os.path.isfile(os.getcwd() + os.sep + 'multiFasta.res'))
         self.assertFalse(os.path.isdir(os.getcwd() + os.sep + 'multiFasta'))
 
+    def test_r4s_pool(self):
+        """Tests that jobs run by the pool score in scratch directories, and leave no files behind"""
+        msa = self.filepath + os.sep + 'multiFasta.aln'
+        with am.Rate4SitePool(workers=2, profile=False, gapped=True) as pool:
+            results = pool.map([msa, msa, msa])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0].msa, msa)
+        self.assertEqual(results[0].alpha, results[2].alpha)
+        self.assertDictEqual(results[0].scores, results[1].scores)
+        self.assertFalse(os.path.isfile(os.getcwd() + os.sep + 'r4s.res'))
+        self.assertFalse(os.path.isfile(os.getcwd() + os.sep + 'multiFasta.res'))
+
+    def test_r4s_nj_tree(self):
+        """Tests that Rate4Site is given the neighbor-joining tree of the alignment, which close deletes"""
+        r4s = am.Rate4Site(self.filepath + os.sep + 'multiFasta.aln')
+        self.assertFalse(' -t ' in r4s.args)
+        r4s = am.Rate4Site(self.filepath + os.sep + 'multiFasta.aln', tree='nj')
+        self.assertTrue(' -t %s' % r4s.tree in r4s.args)
+        self.assertTrue(r4s.args.startswith('-s %s ' % r4s.named_msa))
+        self.assertNotEqual(os.path.dirname(r4s.named_msa), os.getcwd())
+        with open(r4s.tree) as file:
+            leaves = set(njtree.leaves(file.read()))
+        self.assertEqual(leaves, set(am.Alignment.read(r4s.named_msa).ids))
+        r4s.close()
+        self.assertFalse(os.path.isfile(r4s.tree))
+        self.assertFalse(os.path.isfile(r4s.named_msa))
+
+    def test_r4s_tree_leaves(self):
+        """Tests that a tree whose leaves are not the sequences of the alignment is refused"""
+        directory = tempfile.mkdtemp()
+        try:
+            tree = os.path.join(directory, 'other.tree')
+            with open(tree, 'w') as file:
+                file.write('(a:0.1,b:0.1,c:0.1);\n')
+            with self.assertRaises(am.Rate4SiteError):
+                am.Rate4Site(self.filepath + os.sep + 'multiFasta.aln', tree=tree,
+                             tree_cache=treecache.TreeCache(directory), tempdir=directory)
+            self.assertEqual(sorted(os.listdir(directory)), ['other.tree'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_r4s_rate_profile(self):
+        """Tests that the performance profile selects the Rate4Site options, and that unknown profiles are refused"""
+        msa = self.filepath + os.sep + 'multiFasta.aln'
+        self.assertTrue(am.Rate4Site(msa).args.endswith(' -ib -k 16 -bg'))
+        self.assertTrue(am.Rate4Site(msa, rate_profile='fast').args.endswith(' -im -k 4 -bn'))
+        with self.assertRaises(am.Rate4SiteError):
+            am.Rate4Site(msa, rate_profile='quick')
+
+    def test_r4s_tree_cache(self):
+        """Tests that the tree Rate4Site builds is cached, and passed to Rate4Site on the next run"""
+        msa = self.filepath + os.sep + 'multiFasta.aln'
+        directory = tempfile.mkdtemp()
+        jobs = []
+        try:
+            cache = treecache.TreeCache(directory)
+            jobs.append(am.Rate4Site(msa, tree_cache=cache))
+            self.assertFalse(' -t ' in jobs[0].args)
+            jobs[0].run()
+            self.assertEqual(len(cache), 1)
+            jobs.append(am.Rate4Site(msa, tree_cache=cache))
+            self.assertTrue(' -t %s' % cache.get(msa) in jobs[1].args)
+        finally:
+            for job in jobs:
+                job.close()
+            shutil.rmtree(directory)
+
     @classmethod
     def tearDownClass(cls):
         am.clean_alignment(os.getcwd() + os.sep + 'multiFasta.aln', cache=False)
 
+
+class test_read_rates(biskit.test.BiskitTest):
+
+    """
+    Test suite testing the Rate4Site output parser, which does not need Rate4Site installed
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.filepath = os.getcwd() + os.sep + 'example_data'
+
+    def test_read_rates(self):
+        """Tests that the alpha parameter, the header values and the residue table are read in one go"""
+        rates = am.read_rates(self.filepath + os.sep + 'multiFasta.res')
+        self.assertEqual(rates.alpha, 2.83688)
+        self.assertEqual(rates.metadata['log likelihood'], -46.7933)
+        self.assertEqual(rates.metadata['categories'], 16)
+        self.assertEqual(rates.residues.dtype, am.RESIDUE_DTYPE)
+        self.assertEqual(list(rates.residues['position']), list(range(1, 9)))
+        self.assertEqual(''.join(rates.residues['aa']), 'AACCGGTT')
+        self.assertEqual(rates.residues['qq_high'][6], -0.7852)
+        self.assertTrue(np.all(rates.residues['msa_count'] == 3))
+
+    def test_read_rates_badfile(self):
+        """Tests that a file that is not Rate4Site output raises an error"""
+        with self.assertRaises(am.Rate4SiteError):
+            am.read_rates(self.filepath + os.sep + 'Fak2Human.fasta')
+
+    def test_read_rates_missing_columns(self):
+        """Tests that the columns a file leaves out are NaN"""
+        path = os.getcwd() + os.sep + 'partial.res'
+        with open(path, 'w') as file:
+            file.write('#The alpha parameter 1.5\n    1     M  -0.5   2/4\n')
+        try:
+            rates = am.read_rates(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(rates.residues['score'][0], -0.5)
+        self.assertTrue(np.isnan(rates.residues['std'][0]))
+        self.assertEqual(rates.residues['msa_total'][0], 4)
+
+
+class test_alignment_profile(biskit.test.BiskitTest):
+
+    """
+    Test suite testing the choice of Mafft options, which does not need Mafft installed
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.filepath = os.getcwd() + os.sep + 'example_data'
+        self.directory = tempfile.mkdtemp()
+        self.old_dir = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.old_dir)
+        shutil.rmtree(self.directory)
+
+    def test_options(self):
+        """Tests that the options of a strategy are overridden by the profile"""
+        profile = am.AlignmentProfile('FFT-NS-2', maxiterate=2, thread=4)
+        self.assertEqual(profile.options('FFT-NS-2'), '--retree 2 --maxiterate 2 --thread 4')
+        self.assertEqual(am.AlignmentProfile().options('auto'), '--auto')
+        with self.assertRaises(am.MAFFTError):
+            am.AlignmentProfile('G-INS-x')
+
+    def test_adaptive(self):
+        """Tests that the adaptive profile trades accuracy for speed as the alignment grows"""
+        profile = am.AlignmentProfile('adaptive', time_budget=60)
+        self.assertEqual(profile.choose(40, 500), 'L-INS-i')
+        self.assertEqual(profile.choose(300, 1000), 'FFT-NS-i')
+        self.assertEqual(profile.choose(1000, 1500), 'FFT-NS-2')
+        self.assertEqual(profile.choose(20000, 2000), 'FFT-NS-1')
+        self.assertEqual(am.AlignmentProfile('adaptive', thread=8).choose(1000, 1000), 'FFT-NS-i')
+
+    @patch('consScore.aminoCons.Executor')
+    def test_build_alignment_strategy(self, mock_exe):
+        """Tests that build_alignment runs Mafft with the options of the profile and records the strategy"""
+        os.chdir(self.directory)
+        aln = am.build_alignment(self.filepath + os.sep + 'multiFasta.fasta', profile='adaptive')
+        self.assertTrue(mock_exe.call_args[1]['args'].startswith(' --localpair --maxiterate 1000 '))
+        strategy = am.read_strategy(aln)
+        self.assertEqual(strategy['strategy'], 'L-INS-i')
+        self.assertEqual(strategy['sequences'], '3')
+        am.clean_alignment(aln, cache=False)
+        self.assertIsNone(am.read_strategy(aln))
+
+    def write(self, name, text):
+        path = self.directory + os.sep + name
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    @patch('consScore.aminoCons.build_alignment')
+    @patch('consScore.aminoCons.Executor')
+    def test_update_alignment_add(self, mock_exe, mock_build):
+        """Tests that a few new sequences are added to the cached alignment with mafft --add"""
+        os.chdir(self.directory)
+        aln = self.write('orth.aln', '>a\nMK-T\n>b\nMKWT\n>c\nM--T\n')
+        orth = self.write('orth.orth', '>a\nMKT\n>b\nMKWT\n>c\nMT\n')
+        self.assertEqual(am.update_alignment(aln, orth), aln)
+        self.assertFalse(mock_exe.called)
+
+        orth = self.write('orth.orth', '>a\nMKT\n>b\nMKWT\n>c\nMT\n>d\nMKTT\n')
+        mock_exe.return_value.run.side_effect = lambda: self.write('orth.aln.new', '>a\nMK-T\n>d\nMKTT\n')
+        self.assertEqual(am.update_alignment(aln, orth, threshold=0.5), aln)
+        self.assertTrue(' --add ' in mock_exe.call_args[1]['args'])
+        self.assertTrue('--keeplength' in mock_exe.call_args[1]['args'])
+        self.assertEqual(am.read_strategy(aln)['strategy'], 'add')
+        self.assertEqual(sorted(os.listdir(self.directory)), ['orth.aln', 'orth.orth', 'orth.strategy'])
+        self.assertFalse(mock_build.called)
+
+    @patch('consScore.aminoCons.build_alignment')
+    def test_update_alignment_realign(self, mock_build):
+        """Tests that the alignment is built again when too many sequences are new, or aligned ones are gone"""
+        os.chdir(self.directory)
+        aln = self.write('orth.aln', '>a\nMK-T\n>b\nMKWT\n')
+        orth = self.write('orth.orth', '>a\nMKT\n>b\nMKWT\n>c\nMT\n')
+        am.update_alignment(aln, orth, threshold=0.2)
+        self.assertEqual(mock_build.call_count, 1)
+        orth = self.write('orth.orth', '>a\nMKT\n')
+        am.update_alignment(aln, orth)
+        self.assertEqual(mock_build.call_count, 2)
+
+    @patch('consScore.aminoCons.subprocess.run')
+    @patch('consScore.aminoCons.ExeConfigCache.get')
+    def test_align_sequences(self, mock_exe, mock_run):
+        """Tests that sequences are passed to Mafft through stdin, or through a spill file when they are large"""
+        mock_exe.return_value.bin = 'mafft'
+        mock_run.return_value.returncode = 0
+        mock_run.return_value.stdout = '>a\nMK-T\n>b\nMKWT\n'
+        msa = am.align_sequences('>a\nMKT\n>b\nMKWT\n', profile='FFT-NS-2')
+        self.assertEqual(msa.ids, ['a', 'b'])
+        self.assertEqual(mock_run.call_args[0][0], ['mafft', '--retree', '2', '--maxiterate', '0', '-'])
+        self.assertEqual(mock_run.call_args[1]['input'], '>a\nMKT\n>b\nMKWT\n')
+        self.assertIs(mock_run.call_args[1]['env'], mock_exe.return_value.environment.return_value)
+        self.assertEqual(mock_run.call_args[1]['timeout'], am.MAFFT_TIMEOUT)
+
+        spilled = []
+        def run(command, **kw):
+            spilled.append(command[-1])
+            with open(command[-1]) as file:
+                self.assertEqual(file.read(), '>a\nMKT\n')
+            return mock_run.return_value
+        mock_run.side_effect = run
+        text = am.align_sequences([am.fasta.Record('a', 'MKT')], as_alignment=False, spill_size=0,
+                                  spill_dir=self.directory)
+        self.assertEqual(text, '>a\nMK-T\n>b\nMKWT\n')
+        self.assertEqual(os.path.dirname(spilled[0]), self.directory)
+        self.assertFalse(os.path.exists(spilled[0]))
+
+        mock_run.side_effect = None
+        path = os.path.join(self.directory, 'memory.aln')
+        am.align_sequences('>a\nMKT\n>b\nMKWT\n', profile='FFT-NS-2', path=path)
+        self.assertEqual(am.Alignment.read(path).ids, ['a', 'b'])
+        self.assertEqual(am.read_strategy(path)['strategy'], 'FFT-NS-2')
+        self.assertEqual(am.read_strategy(path)['sequences'], '2')
+
+        mock_run.side_effect = am.subprocess.TimeoutExpired('mafft', 5)
+        with self.assertRaises(am.MAFFTError):
+            am.align_sequences('>a\nMKT\n', timeout=5)
+        self.assertEqual(mock_run.call_args[1]['timeout'], 5)
+
+        mock_run.side_effect = None
+        mock_run.return_value.returncode = 1
+        with self.assertRaises(am.MAFFTError):
+            am.align_sequences('>a\nMKT\n')
+
 if __name__ == '__main__':
     biskit.test.localTest()
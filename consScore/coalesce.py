@@ -0,0 +1,86 @@
+"""
+Single-flight request coalescing. When several callers ask for the same piece of work at the same time, only the
+first one runs it- the others wait for, and share, its result. Optionally the most recent results are kept, so
+later callers asking for the same work get the result straight away.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Runs a function at most once at a time for each key. Used to stop duplicate sequences in a batch from each
+    querying OMA, or each running Mafft and Rate4Site, for the same result.
+    """
+
+    def __init__(self, remember=0):
+        """
+        Args:
+            remember(int): The number of completed results kept for later callers, least recently used first out.
+                Zero keeps none, so only callers that overlap in time share a result
+        """
+        self.remember = remember
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._done = OrderedDict()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Returns the result of function(*args, **kwargs) for the key. If the same key is already running, waits for
+        that call instead of starting another. If the call raises an exception, every caller waiting on it gets
+        the exception, and the next caller runs the function again.
+        Args:
+            key: Any hashable that identifies the work
+            function: The function doing the work
+        Returns:
+            The result of the function
+        """
+        with self._lock:
+            if key in self._done:
+                self._done.move_to_end(key)
+                self.shared += 1
+                return self._done[key]
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            with self._lock:
+                del self._calls[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._calls[key]
+            if self.remember:
+                self._done[key] = result
+                while len(self._done) > self.remember:
+                    self._done.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def running(self, key):
+        """
+        Returns True if the work for the key is in flight
+        """
+        with self._lock:
+            return key in self._calls
+
+    def forget(self, key=None):
+        """
+        Drops the kept result of the key, or every kept result if no key is given
+        """
+        with self._lock:
+            if key is None:
+                self._done.clear()
+            else:
+                self._done.pop(key, None)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for coalesce
+"""
+import biskit.test
+import threading
+import time
+from consScore import coalesce
+
+
+class TestSingleFlight(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the coalesce module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def test_concurrent_callers_share(self):
+        """Tests that callers overlapping in time run the function once and all get its result"""
+        flight = coalesce.SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'HOG'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['HOG'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.shared, 4)
+        self.assertFalse(flight.running('key'))
+
+    def test_exception_not_kept(self):
+        """Tests that an exception reaches the caller, and the next caller runs the function again"""
+        flight = coalesce.SingleFlight(remember=4)
+
+        def fail():
+            raise TimeoutError('The database timed out')
+
+        with self.assertRaises(TimeoutError):
+            flight.do('key', fail)
+        self.assertEqual(flight.do('key', lambda: 'retried'), 'retried')
+
+    def test_remember(self):
+        """Tests that kept results are returned to later callers, up to the given number of results"""
+        flight = coalesce.SingleFlight(remember=1)
+        flight.do('first', lambda: 1)
+        self.assertEqual(flight.do('first', lambda: 2), 1)
+        flight.do('second', lambda: 3)
+        self.assertEqual(flight.do('first', lambda: 4), 4)
+        flight.forget()
+        self.assertEqual(flight.do('first', lambda: 5), 5)
+
+    def test_no_remember(self):
+        """Tests that without remember, only overlapping callers share a result"""
+        flight = coalesce.SingleFlight()
+        flight.do('key', lambda: 1)
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -3,6 +3,8 @@ A variety of module level functions useful for handling sequence data
 """
 import os
 import re
+from itertools import islice
+from consScore import fasta as fa
 from biskit.errors import BiskitError
 
 
@@ -10,6 +12,12 @@ class SequenceError(BiskitError):
     pass
 
 
+#: UniProtKB accession, with an optional isoform suffix (https://www.uniprot.org/help/accession_numbers)
+UNIPROT_ACCESSION = re.compile(r'^(?:[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9](?:[A-Z][A-Z0-9]{2}[0-9]){1,2})(?:-[0-9]+)?$')
+#: OMA protein id- a five character species code followed by a five digit number
+OMA_ID = re.compile(r'^[A-Z0-9]{5}[0-9]{5}$')
+
+
 def remove_protein(fasta, iden):
     """
     Removes the protein matching the entered id from the fasta string
@@ -19,14 +27,8 @@ def remove_protein(fasta, iden):
     Returns:
          A string containing the proteins in fasta format, without the protein with the entered id
     """
-    fasta_list = indv_block(fasta)
-    for protein in fasta_list:
-        if iden in protein:
-            fasta_list.remove(protein)
-    fasta_string = ''
-    for protein in fasta_list:
-        fasta_string = fasta_string + protein + os.linesep
-    return fasta_string.strip()
+    fasta_list = (protein for protein in _blocks(fasta) if iden not in fa.header_ids(protein.split('\n', 1)[0]))
+    return os.linesep.join(fasta_list).strip()
 
 
 def remove_first_protein(fasta):
@@ -36,12 +38,36 @@ def remove_first_protein(fasta):
         fasta(str): The proteins in fasta format
     Returns: A string containing the proteins in fasta format, without the first protein
     """
-    fasta_list = indv_block(fasta)
-    fasta_list.pop(0)
-    fasta_string = ''
-    for f in fasta_list:
-        fasta_string = fasta_string + f + os.linesep
-    return fasta_string.strip()
+    return os.linesep.join(islice(_blocks(fasta), 1, None)).strip()
+
+
+def write_fasta_stream(lines, handle, skip=None):
+    """
+    Writes fasta text to a file one line at a time, leaving out the proteins selected by skip. Only the current
+    line is held in memory, so this can be used on responses that are too large to read as a single string.
+    Args:
+        lines: An iterable of the lines of the fasta text, with or without their newline characters
+        handle: The open file that the kept proteins are written to
+        skip(function): Called with the header line and the zero indexed position of each protein. If it returns
+            True, the protein is left out
+    Returns:
+        The number of proteins written
+    """
+    keep = True
+    index = -1
+    written = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.rstrip('\r\n')
+        if line.startswith('>'):
+            index += 1
+            keep = not (skip and skip(line, index))
+            if keep:
+                written += 1
+        if keep and line and index >= 0:
+            handle.write(line + os.linesep)
+    return written
 
 
 def header_check(sequences):
@@ -66,6 +92,29 @@ def header_check(sequences):
     return seq
 
 
+def get_accession(fasta):
+    """
+    Reads the UniProt accession or OMA id from the header of the first protein in a fasta string. Headers in the
+    UniProt layout (>sp|P54259|ATN1_HUMAN ...) and headers that start with the accession or OMA id
+    (>HUMAN27610 | FAK2_HUMAN ...) are recognised.
+    Args:
+        fasta(str): The protein(s) in fasta format
+    Returns:
+        The accession or OMA id as a string, or None if the header does not start with one
+    """
+    if not fasta or not fasta.startswith('>'):
+        return None
+    header = fasta.split('\n', 1)[0][1:].strip()
+    fields = [f.strip() for f in header.split('|')]
+    if len(fields) > 1 and fields[0] in ('sp', 'tr'):
+        candidate = fields[1]
+    else:
+        candidate = header.split()[0].split('|')[0] if header else ''
+    if OMA_ID.match(candidate) or UNIPROT_ACCESSION.match(candidate):
+        return candidate
+    return None
+
+
 def seqnwl_strip(string):
     """
     Removes the newline characters from within the sequences of the fasta
@@ -86,6 +135,12 @@ def seqnwl_strip(string):
     return newstring
 
 
+def _blocks(st):
+    if st.startswith('>'):
+        return fa.blocks(st)
+    return iter([st])
+
+
 def indv_block(st):
     """
     Return the header line and the sequence of individual constructs in a file
@@ -100,17 +155,7 @@ def indv_block(st):
         a list of 4 strings. Each string begins with >, and contains both the
         headers and the newline characters.
     """
-    if st.startswith('>'):
-        fstr = re.split('>', st)
-        seq_list = []
-        for f in fstr:
-            if f:
-                f = '>' + f
-                f = f.rstrip()
-                seq_list.append(f)
-        return seq_list
-    else:
-        return [st]
+    return list(_blocks(st))
 
 
 def get_fasta_sequence(fasta, index=0):
@@ -126,14 +171,13 @@ def get_fasta_sequence(fasta, index=0):
         The sequence of the specified protein, as a single string, with newline
         characters removed.
     """
-    fstr = indv_block(st=fasta)
-    fstr = fstr[index]
-    fstr = fstr.splitlines()
-    for f in fstr:
-        if f.startswith('>'):
-            fstr.remove(f)
-    fstr = "".join(fstr)
-    return fstr
+    if not fasta.lstrip().startswith('>'):
+        if index != 0:
+            raise IndexError('list index out of range')
+        return "".join(fasta.splitlines())
+    for record in islice(fa.parse(fasta), index, None):
+        return record.sequence
+    raise IndexError('list index out of range')
 
 
 def build_url(tail, variation, base_url):
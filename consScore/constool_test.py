@@ -3,6 +3,7 @@
 from consScore import aminoCons as am
 import biskit.test
 from consScore import constool
+import io
 
 class test_constool(biskit.test.BiskitTest):
 
@@ -62,6 +63,11 @@ class test_constool(biskit.test.BiskitTest):
         self.assertFalse('>OAP01791.1 CDC48A [Arabidopsis thaliana]' in tester)
         self.assertTrue('SKKDFSTAILERKKSPNRLVVDEAINDDNSVVSLHPATMEKLQL' in tester)
 
+    def test_get_fasta_leading_space(self):
+        """tests that get_fasta leaves out the header of fasta that starts with blank lines"""
+        self.assertEqual(constool.get_fasta_sequence("\n>h\nSEQ\nABC"), "SEQABC")
+        self.assertEqual(constool.get_fasta_sequence("  \n\n>h\nSEQ\n>i\nABC", index=1), "ABC")
+
     def test_get_fasta_multi(self):
         """tests that get_fasta returns a list of sequences given a fasta file"""
         tester = constool.get_fasta_sequence(""">PROCA12070 | ENSPCAG00000012030 | HOG:0377891.2a.2a | [Procavia capensis]
@@ -148,5 +154,36 @@ MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGGVSTSSSDGKAEKSRQSAKKARVEEASTPKVNKQSRSEXETSAP
         self.assertEqual(tester, ">PROCA12070 | ENSPCAG00000012030 | HOG:0377891.2a.2a | [Procavia capensis]\n"
                                      "MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGGVSTSSSDGKAEKSRQTAKKARVEEVSAPKVSKQGRGEEISESE")
 
+    def test_write_fasta_stream(self):
+        """Tests that write_fasta_stream writes every protein except the skipped ones"""
+        lines = [b">PROCA12070 | HOG:0377891.2a.2a\n", b"MKTRQNK\n", b"DSMSMR\n",
+                 b">ECHTE02547 | HOG:0377891.2a.2a\n", b"MKTRQNKDS\n"]
+        handle = io.StringIO()
+        written = constool.write_fasta_stream(lines, handle, skip=lambda header, index: 'PROCA12070' in header)
+        self.assertEqual(written, 1)
+        self.assertEqual(handle.getvalue().split(), [">ECHTE02547", "|", "HOG:0377891.2a.2a", "MKTRQNKDS"])
+
+    def test_write_fasta_stream_index(self):
+        """Tests that write_fasta_stream passes the position of each protein to skip"""
+        handle = io.StringIO()
+        constool.write_fasta_stream([">A", "MK", ">B", "DS", ">C", "QQ"], handle,
+                                    skip=lambda header, index: index == 0)
+        self.assertEqual(constool.indv_block(handle.getvalue())[0].split(), [">B", "DS"])
+
+    def test_get_accession_uniprot(self):
+        """Tests that get_accession reads the accession from a UniProt header"""
+        self.assertEqual(constool.get_accession(">sp|P54259|ATN1_HUMAN Atrophin-1 OS=Homo sapiens\nMKTRQ"), 'P54259')
+        self.assertEqual(constool.get_accession(">A0A024R161-2 isoform\nMKTRQ"), 'A0A024R161-2')
+
+    def test_get_accession_oma(self):
+        """Tests that get_accession reads an OMA id at the start of the header"""
+        self.assertEqual(constool.get_accession(">HUMAN27610 | FAK2_HUMAN | self | [Homo sapiens]\nMKTRQ"),
+                         'HUMAN27610')
+
+    def test_get_accession_none(self):
+        """Tests that get_accession returns None when the header has no recognised accession"""
+        self.assertIsNone(constool.get_accession(">AT1G01140.1 (version 1)\nMKTRQ"))
+        self.assertIsNone(constool.get_accession("MKTRQNKDSMSMRSGRKK"))
+
 if __name__ == '__main__':
     biskit.test.localTest()
@@ -0,0 +1,363 @@
+"""
+Streaming reading and indexed random access of protein sequences in fasta format.
+
+parse() and blocks() read fasta text one line at a time and yield one protein at a time, so a file of any size is
+read in constant memory. FastaIndex keeps a .fai index (the layout used by samtools faidx) of the offset of every
+protein in a file, and reads proteins out of a memory map of the file by position or by id, without reading the
+rest of the file.
+"""
+
+import io
+import mmap
+import os
+import re
+from collections import namedtuple
+
+
+class Record(namedtuple('Record', ['header', 'sequence'])):
+    """
+    A protein read from fasta text. The header is the identification line without the leading >, and the sequence
+    has all newline and other whitespace characters removed.
+    """
+
+    __slots__ = ()
+
+    @property
+    def id(self):
+        """The first word of the header, which is the id of the protein"""
+        return header_id(self.header)
+
+    def format(self, width=None):
+        """
+        Returns the protein as fasta text, without a trailing newline
+        Args:
+            width(int): The number of residues on each line of sequence. If None, the sequence is on a single line
+        """
+        if not width:
+            return '>' + self.header + '\n' + self.sequence
+        lines = [self.sequence[i:i + width] for i in range(0, len(self.sequence), width)]
+        return '\n'.join(['>' + self.header] + lines)
+
+
+def header_id(header):
+    """
+    Returns the id in a header line- the first word, with any leading > removed
+    """
+    words = header.lstrip('>').split()
+    return words[0] if words else ''
+
+
+def header_ids(header):
+    """
+    Returns the set of ids in a header line- the first word of each field separated by |, leaving out the species in
+    square brackets. For example '>PROCA12070 | ENSPCAG00000012030 | [Procavia capensis]' gives PROCA12070 and
+    ENSPCAG00000012030, and '>sp|P54259|ATN1_HUMAN Atrophin-1' gives sp, P54259 and ATN1_HUMAN
+    """
+    ids = set()
+    for field in header.lstrip('>').split('|'):
+        field = field.strip()
+        if field and not field.startswith('['):
+            ids.add(field.split()[0])
+    return ids
+
+
+_SPECIES = re.compile(r'\[([^\[\]]+)\]\s*$')
+
+
+def header_species(header):
+    """
+    Returns the species named in square brackets at the end of a header line, as in the fasta of the OMA browser,
+    or None if there is none
+    """
+    match = _SPECIES.search(header)
+    return match.group(1).strip() if match else None
+
+
+def _lines(source):
+    if isinstance(source, str):
+        return io.StringIO(source)
+    return source
+
+
+def blocks(source):
+    """
+    Yields the text of each protein in fasta text- the header line and the sequence lines as they appear in the
+    text, with their newline characters, and trailing whitespace removed
+    Args:
+        source: The fasta text as a string, or an iterable of its lines, such as an open file
+    """
+    block = []
+    for line in _lines(source):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.startswith('>') and block:
+            yield ''.join(block).rstrip()
+            block = []
+        if line.startswith('>') or block:
+            block.append(line if line.endswith('\n') else line + '\n')
+    if block:
+        yield ''.join(block).rstrip()
+
+
+def parse(source):
+    """
+    Yields each protein in fasta text as a Record
+    Args:
+        source: The fasta text as a string, or an iterable of its lines, such as an open file
+    """
+    header = None
+    sequence = []
+    for line in _lines(source):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.startswith('>'):
+            if header is not None:
+                yield Record(header, ''.join(sequence))
+            header = line[1:].strip()
+            sequence = []
+        elif header is not None:
+            sequence.append(''.join(line.split()))
+    if header is not None:
+        yield Record(header, ''.join(sequence))
+
+
+def read(path):
+    """
+    Yields each protein in a fasta file as a Record, reading the file one line at a time
+    """
+    with open(path, 'r') as handle:
+        for record in parse(handle):
+            yield record
+
+
+def write(records, handle, width=None):
+    """
+    Writes Records to an open file in fasta format
+    Returns:
+        The number of proteins written
+    """
+    count = 0
+    for record in records:
+        handle.write(record.format(width) + '\n')
+        count += 1
+    return count
+
+
+def make_filter(exclude_ids=None, include_ids=None, exclude_species=None, min_length=None, max_length=None,
+                exclude_residues=None, predicate=None):
+    """
+    Builds a function that decides whether a Record is kept, from any combination of the criteria below. A record is
+    kept only if it passes all of them. Ids are matched against the ids parsed from the header (see header_ids), not
+    as substrings of the text
+    Args:
+        exclude_ids(set): Records with any of these ids are dropped
+        include_ids(set): If given, only records with one of these ids are kept
+        exclude_species(set): Records of these species are dropped. Either the species name in square brackets, or
+            the five letter species code that starts an OMA id, can be given
+        min_length(int): Records with fewer residues are dropped, such as fragments
+        max_length(int): Records with more residues are dropped
+        exclude_residues(str): Records containing any of these characters in their sequence are dropped, such as 'X'
+        predicate(function): Called with each record that passed the other criteria- records for which it returns
+            False are dropped
+    Returns:
+        A function taking a Record and returning True if it is kept
+    """
+    exclude_ids = set(exclude_ids or ())
+    include_ids = set(include_ids or ())
+    exclude_species = set(exclude_species or ())
+    exclude_residues = set(exclude_residues or ())
+
+    def keep(record):
+        length = len(record.sequence)
+        if min_length is not None and length < min_length:
+            return False
+        if max_length is not None and length > max_length:
+            return False
+        if exclude_ids or include_ids:
+            ids = header_ids(record.header)
+            if ids & exclude_ids:
+                return False
+            if include_ids and not ids & include_ids:
+                return False
+        if exclude_species:
+            if header_species(record.header) in exclude_species or record.id[:5] in exclude_species:
+                return False
+        if exclude_residues and not exclude_residues.isdisjoint(record.sequence):
+            return False
+        return predicate is None or bool(predicate(record))
+
+    return keep
+
+
+def filter_records(records, **criteria):
+    """
+    Yields the records that pass the criteria, in a single pass over the records. See make_filter for the criteria
+    Args:
+        records: An iterable of Records, such as parse(handle) or a FastaIndex
+    """
+    keep = make_filter(**criteria)
+    for record in records:
+        if keep(record):
+            yield record
+
+
+def filter_file(source, destination, width=None, **criteria):
+    """
+    Copies the proteins of a fasta file that pass the criteria into another file, one protein at a time. See
+    make_filter for the criteria
+    Args:
+        source(str): The fasta file read
+        destination(str): The fasta file written. It must not be the source
+        width(int): The number of residues on each line of sequence written. If None, each sequence is on one line
+    Returns:
+        A tuple of the number of proteins kept and the number of proteins dropped
+    """
+    keep = make_filter(**criteria)
+    kept = dropped = 0
+    with open(source, 'r') as handle, open(destination, 'w') as output:
+        for record in parse(handle):
+            if keep(record):
+                output.write(record.format(width) + '\n')
+                kept += 1
+            else:
+                dropped += 1
+    return kept, dropped
+
+
+#: One line of a .fai index- the id of the protein, the number of residues, the byte offset of the sequence, the
+#: number of residues on each line and the number of bytes on each line
+IndexEntry = namedtuple('IndexEntry', ['name', 'length', 'offset', 'linebases', 'linewidth'])
+
+
+class FastaIndex:
+    """
+    Random access to the proteins of a fasta file by position or by id. The file is memory mapped, and the offset of
+    each protein is kept in a .fai index next to the file, which is built on first use and reused while it is newer
+    than the file.
+
+    Usage:
+        with FastaIndex('orthologs.fasta') as index:
+            record = index[3]
+            record = index['HUMAN27610']
+    """
+
+    def __init__(self, path, index_path=None, rebuild=False):
+        """
+        Args:
+            path(str): The fasta file
+            index_path(str): Where the index is kept. Defaults to the fasta file name followed by .fai
+            rebuild(Boolean): If true, the index is rebuilt even if an up to date one exists
+        """
+        self.path = path
+        self.index_path = index_path or path + '.fai'
+        self._file = open(path, 'rb')
+        if os.path.getsize(path):
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b''
+        if not rebuild and os.path.isfile(self.index_path) and \
+                os.path.getmtime(self.index_path) >= os.path.getmtime(path):
+            self.entries = self._load()
+        else:
+            self.entries = self._build()
+            self.save()
+        self._positions = {}
+        for position, entry in enumerate(self.entries):
+            self._positions.setdefault(entry.name, position)
+
+    def _build(self):
+        entries = []
+        data = self._map
+        position = 0
+        end = len(data)
+        current = None
+        while position < end:
+            newline = data.find(b'\n', position)
+            newline = end if newline == -1 else newline + 1
+            line = data[position:newline]
+            if line.startswith(b'>'):
+                if current is not None:
+                    entries.append(IndexEntry(*current))
+                current = [header_id(line.decode('utf-8')), 0, newline, 0, 0]
+            elif current is not None:
+                bases = len(line.strip())
+                if bases and not current[3]:
+                    current[3] = bases
+                    current[4] = len(line)
+                current[1] += bases
+            position = newline
+        if current is not None:
+            entries.append(IndexEntry(*current))
+        return entries
+
+    def _load(self):
+        entries = []
+        with open(self.index_path, 'r') as handle:
+            for line in handle:
+                fields = line.rstrip('\n').split('\t')
+                entries.append(IndexEntry(fields[0], *map(int, fields[1:5])))
+        return entries
+
+    def save(self):
+        """
+        Writes the index to index_path. An index that cannot be written is rebuilt the next time instead
+        """
+        try:
+            with open(self.index_path, 'w') as handle:
+                for entry in self.entries:
+                    handle.write('\t'.join(map(str, entry)) + '\n')
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def ids(self):
+        """Returns the ids of the proteins, in the order of the file"""
+        return [entry.name for entry in self.entries]
+
+    def position(self, name):
+        """Returns the zero indexed position of the first protein with the given id"""
+        return self._positions[name]
+
+    def _entry(self, key):
+        if isinstance(key, int):
+            return self.entries[key]
+        return self.entries[self._positions[key]]
+
+    def header(self, key):
+        """Returns the header of the protein at the position or with the id given as key"""
+        entry = self._entry(key)
+        start = self._map.rfind(b'\n', 0, entry.offset - 1) + 1
+        return self._map[start + 1:entry.offset].decode('utf-8').strip()
+
+    def sequence(self, key):
+        """Returns the sequence of the protein at the position or with the id given as key"""
+        entry = self._entry(key)
+        if not entry.length:
+            return ''
+        end = self._map.find(b'\n>', entry.offset)
+        end = len(self._map) if end == -1 else end
+        return b''.join(self._map[entry.offset:end].split()).decode('utf-8')
+
+    def __getitem__(self, key):
+        return Record(self.header(key), self.sequence(key))
+
+    def __iter__(self):
+        for position in range(len(self.entries)):
+            yield self[position]
+
+    def close(self):
+        """Closes the memory map and the file"""
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
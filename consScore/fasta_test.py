@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for fasta
+"""
+import biskit.test
+import os
+import shutil
+import tempfile
+from consScore import fasta
+
+PROTEINS = (">PROCA12070 | ENSPCAG00000012030 | HOG:0377891.2a.2a | [Procavia capensis]\n"
+            "MKTRQNKDSMSMRSGRKKEA\n"
+            "PGPREELRSR\n"
+            ">LOXAF14113 | G3TAL7 | HOG:0377891.2a.2a | [Loxodonta africana]\n"
+            "MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGG\n"
+            ">EMPTY00001\n"
+            ">ECHTE02547 | ENSETEG00000016682 | HOG:0377891.2a.2a | [Echinops telfairi]\n"
+            "MKTRQNKDSM\n"
+            "SMRSG")
+
+
+class TestFasta(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the fasta module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'proteins.fasta')
+        with open(self.path, 'w') as file:
+            file.write(PROTEINS)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse(self):
+        """Tests that parse yields each protein with its header and its sequence joined onto one line"""
+        records = list(fasta.parse(PROTEINS))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0].id, 'PROCA12070')
+        self.assertEqual(records[0].sequence, 'MKTRQNKDSMSMRSGRKKEAPGPREELRSR')
+        self.assertEqual(records[2], fasta.Record('EMPTY00001', ''))
+
+    def test_blocks(self):
+        """Tests that blocks keeps the text of each protein as it appears in the input"""
+        blocks = list(fasta.blocks(PROTEINS))
+        self.assertEqual(blocks[0], ">PROCA12070 | ENSPCAG00000012030 | HOG:0377891.2a.2a | [Procavia capensis]\n"
+                                    "MKTRQNKDSMSMRSGRKKEA\nPGPREELRSR")
+        self.assertEqual(blocks[3].splitlines()[-1], 'SMRSG')
+
+    def test_format(self):
+        """Tests that a record can be written back with wrapped sequence lines"""
+        record = fasta.Record('A', 'MKTRQNK')
+        self.assertEqual(record.format(), '>A\nMKTRQNK')
+        self.assertEqual(record.format(width=3), '>A\nMKT\nRQN\nK')
+
+    def test_header_ids(self):
+        """Tests that the ids and the species are parsed out of the header fields"""
+        header = 'PROCA12070 | ENSPCAG00000012030 | HOG:0377891.2a.2a | [Procavia capensis]'
+        self.assertEqual(fasta.header_ids(header), {'PROCA12070', 'ENSPCAG00000012030', 'HOG:0377891.2a.2a'})
+        self.assertEqual(fasta.header_species(header), 'Procavia capensis')
+        self.assertEqual(fasta.header_ids('>sp|P54259|ATN1_HUMAN Atrophin-1'), {'sp', 'P54259', 'ATN1_HUMAN'})
+        self.assertIsNone(fasta.header_species('EMPTY00001'))
+
+    def test_filter_records(self):
+        """Tests that each criterion drops the records it should, and only those"""
+        ids = lambda **criteria: [r.id for r in fasta.filter_records(fasta.parse(PROTEINS), **criteria)]
+        self.assertEqual(ids(exclude_ids={'G3TAL7', 'PROCA1207'}), ['PROCA12070', 'EMPTY00001', 'ECHTE02547'])
+        self.assertEqual(ids(include_ids={'ECHTE02547'}), ['ECHTE02547'])
+        self.assertEqual(ids(exclude_species={'Procavia capensis', 'ECHTE'}), ['LOXAF14113', 'EMPTY00001'])
+        self.assertEqual(ids(min_length=16, max_length=32), ['PROCA12070'])
+        self.assertEqual(ids(exclude_residues='X', predicate=lambda r: 'RSG' in r.sequence),
+                         ['PROCA12070', 'LOXAF14113', 'ECHTE02547'])
+        self.assertEqual(ids(exclude_residues='PE'), ['EMPTY00001', 'ECHTE02547'])
+
+    def test_filter_file(self):
+        """Tests that the filtered proteins are written to a new file and counted"""
+        destination = os.path.join(self.directory, 'filtered.fasta')
+        self.assertEqual(fasta.filter_file(self.path, destination, min_length=1), (3, 1))
+        self.assertEqual([r.id for r in fasta.read(destination)], ['PROCA12070', 'LOXAF14113', 'ECHTE02547'])
+
+    def test_index_access(self):
+        """Tests that the index gives the proteins by position and by id"""
+        with fasta.FastaIndex(self.path) as index:
+            self.assertEqual(len(index), 4)
+            self.assertEqual(index.ids(), ['PROCA12070', 'LOXAF14113', 'EMPTY00001', 'ECHTE02547'])
+            self.assertEqual(index[3].sequence, 'MKTRQNKDSMSMRSG')
+            self.assertEqual(index['LOXAF14113'].header, 'LOXAF14113 | G3TAL7 | HOG:0377891.2a.2a | [Loxodonta africana]')
+            self.assertEqual(index['EMPTY00001'].sequence, '')
+            self.assertEqual(list(index), list(fasta.read(self.path)))
+
+    def test_index_file(self):
+        """Tests that the .fai file is written in the samtools layout and reused"""
+        fasta.FastaIndex(self.path).close()
+        with open(self.path + '.fai') as file:
+            first = file.readline().split('\t')
+        self.assertEqual(first, ['PROCA12070', '30', str(len(PROTEINS.splitlines()[0]) + 1), '20', '21\n'])
+        with open(self.path + '.fai', 'a') as file:
+            file.write('EXTRA00001\t0\t0\t0\t0\n')
+        with fasta.FastaIndex(self.path) as index:
+            self.assertTrue('EXTRA00001' in index)
+        with fasta.FastaIndex(self.path, rebuild=True) as index:
+            self.assertFalse('EXTRA00001' in index)
+
+    def test_index_empty(self):
+        """Tests that an empty file gives an empty index"""
+        open(self.path, 'w').close()
+        with fasta.FastaIndex(self.path) as index:
+            self.assertEqual(len(index), 0)
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -0,0 +1,192 @@
+"""
+Neighbor-joining trees of an alignment, built with NumPy, so that Rate4Site can be given a tree instead of building
+its own, which on large alignments takes much of its runtime. Distances between proteins are the Kimura
+corrected fraction of differing residues over the columns in which neither has a gap, and are computed for every
+pair at once with matrix products. The tree is written in Newick format, as Rate4Site reads it with its -t option.
+
+Rate4Site matches the leaves of the tree to the names of the alignment it reads, which are whole header lines,
+while the leaves are the ids of the alignment made safe for Newick (see leaf_names). An alignment given to
+Rate4Site with one of these trees has to be written with write_alignment, under the same names.
+
+Usage:
+    write_tree('atn1seq.aln', 'atn1seq.tree')
+    rates = Rate4Site('atn1seq.aln', tree='atn1seq.tree')
+
+Citations
+Saitou, N. and Nei, M. 1987. The neighbor-joining method: a new method for reconstructing phylogenetic trees.
+Mol Biol Evol 4: 406-425.
+
+Kimura, M. 1983. The Neutral Theory of Molecular Evolution. Cambridge University Press.
+"""
+
+import re
+import numpy as np
+from biskit.errors import BiskitError
+from consScore.alignment import Alignment, GAP
+
+#: The distance given to pairs that are too far apart for the Kimura correction, or that share no column
+MAX_DISTANCE = 5.0
+
+
+#: The characters that cannot be part of a Newick leaf name
+_NEWICK_SPECIAL = re.compile(r"[\s():;,\[\]']")
+
+
+class TreeError(BiskitError):
+    pass
+
+
+def _alignment(msa):
+    return msa if isinstance(msa, Alignment) else Alignment.read(msa)
+
+
+def distance_matrix(msa):
+    """
+    Returns the Kimura distance between every pair of proteins of the alignment. The fraction p of differing
+    residues is counted over the columns in which neither protein has a gap, and corrected to
+    -ln(1 - p - 0.2 p^2), which is capped at MAX_DISTANCE
+    Args:
+        msa: The path to the alignment file, or an Alignment object
+    Returns:
+        A symmetric array with one row and one column for each protein, and zeros on the diagonal
+    """
+    msa = _alignment(msa)
+    matrix = np.asarray(msa.matrix)
+    lower = (matrix >= ord('a')) & (matrix <= ord('z'))
+    matrix = np.where(lower, matrix - 32, matrix).astype(np.uint8)
+    residues = (matrix != GAP).astype(np.float32)
+    shared = residues @ residues.T
+    identical = np.zeros_like(shared)
+    for code in np.unique(matrix):
+        if code != GAP:
+            same = (matrix == code).astype(np.float32)
+            identical += same @ same.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.where(shared > 0, 1 - identical / shared, 1.0).astype(float)
+        corrected = 1 - p - 0.2 * p * p
+        distances = np.where(corrected > np.exp(-MAX_DISTANCE), -np.log(corrected), MAX_DISTANCE)
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def _branch(node, length):
+    return '%s:%.6f' % (node, max(length, 0.0))
+
+
+def neighbor_joining(distances, names):
+    """
+    Builds an unrooted tree by neighbor-joining. At each step the pair of nodes that minimises the Q criterion is
+    joined, and its row and column of the distance matrix are replaced by those of the new node, so every step is a
+    few array operations over a matrix that shrinks by one. The matrix is held in single precision, which halves the
+    memory each step reads and is ample for branch lengths written to six decimals. Negative branch lengths are set
+    to zero
+    Args:
+        distances(numpy.ndarray): A symmetric distance matrix
+        names(list): The leaf name of each row
+    Returns:
+        The tree in Newick format
+    """
+    distances = np.array(distances, dtype=np.float32)
+    n = len(names)
+    if distances.shape != (n, n):
+        raise TreeError('The distance matrix does not have one row and one column for each of the {0} names'
+                        .format(n))
+    if n < 2:
+        raise TreeError('A tree needs at least two proteins')
+    nodes = list(names)
+    if n == 2:
+        half = float(distances[0, 1]) / 2
+        return '(%s,%s);' % (_branch(nodes[0], half), _branch(nodes[1], half))
+    while n > 3:
+        d = distances[:n, :n]
+        sums = d.sum(axis=1)
+        q = d * np.float32(n - 2)
+        q -= sums[:, np.newaxis]
+        q -= sums
+        np.fill_diagonal(q, np.inf)
+        i, j = sorted(divmod(int(np.argmin(q)), n))
+        dij = float(d[i, j])
+        length = 0.5 * dij + float(sums[i] - sums[j]) / (2 * (n - 2))
+        joined = 0.5 * (d[i] + d[j] - d[i, j])
+        nodes[i] = '(%s,%s)' % (_branch(nodes[i], length), _branch(nodes[j], dij - length))
+        d[i, :] = joined
+        d[:, i] = joined
+        d[i, i] = 0
+        last = n - 1
+        if j != last:
+            d[j, :] = d[last, :]
+            d[:, j] = d[:, last]
+            nodes[j] = nodes[last]
+        nodes.pop()
+        n -= 1
+    d = distances[:3, :3].astype(float)
+    lengths = [(d[0, 1] + d[0, 2] - d[1, 2]) / 2, (d[0, 1] + d[1, 2] - d[0, 2]) / 2, (d[0, 2] + d[1, 2] - d[0, 1]) / 2]
+    return '(%s);' % ','.join(_branch(node, length) for node, length in zip(nodes, lengths))
+
+
+def leaf_names(ids):
+    """
+    Returns the leaf name of each id- the id with the characters that Newick does not allow replaced by _, and a
+    suffix added to any name that is already taken, so that every leaf has its own name
+    """
+    names = []
+    taken = set()
+    for name in ids:
+        name = _NEWICK_SPECIAL.sub('_', name) or 'sequence'
+        unique = name
+        count = 1
+        while unique in taken:
+            unique = '%s_%d' % (name, count)
+            count += 1
+        taken.add(unique)
+        names.append(unique)
+    return names
+
+
+def leaves(newick):
+    """
+    Returns the names of the leaves of a tree in Newick format, in the order they appear
+    """
+    return re.findall(r'[(,]\s*([^():;,\s]+)', newick)
+
+
+def build_tree(msa):
+    """
+    Returns the neighbor-joining tree of an alignment in Newick format, with the leaf_names of the ids of the
+    alignment as leaf names
+    Args:
+        msa: The path to the alignment file, or an Alignment object
+    """
+    msa = _alignment(msa)
+    return neighbor_joining(distance_matrix(msa), leaf_names(msa.ids))
+
+
+def write_alignment(msa, path):
+    """
+    Writes an alignment in fasta format with the leaf_names of its ids as headers, so that the names Rate4Site reads
+    from it are those of the leaves of its tree
+    Args:
+        msa: The path to the alignment file, or an Alignment object
+        path(str): The alignment file written
+    Returns:
+        The path to the alignment file
+    """
+    msa = _alignment(msa)
+    renamed = Alignment(leaf_names(msa.ids), msa.matrix, reference=msa.reference)
+    with open(path, 'w') as handle:
+        renamed.write(handle)
+    return path
+
+
+def write_tree(msa, path):
+    """
+    Writes the neighbor-joining tree of an alignment to a file in Newick format
+    Args:
+        msa: The path to the alignment file, or an Alignment object
+        path(str): The tree file written
+    Returns:
+        The path to the tree file
+    """
+    with open(path, 'w') as handle:
+        handle.write(build_tree(msa) + '\n')
+    return path
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for njtree
+"""
+import biskit.test
+import os
+import shutil
+import tempfile
+import numpy as np
+from consScore import njtree
+from consScore.alignment import Alignment
+
+
+class TestNJTree(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the njtree module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def test_distance_matrix(self):
+        """Tests that distances are counted over the columns in which neither protein has a gap"""
+        msa = Alignment.parse('>a\nMKTAYI\n>b\nMKTAYI\n>c\nMK--YL\n>d\n------\n')
+        distances = njtree.distance_matrix(msa)
+        self.assertEqual(distances.shape, (4, 4))
+        self.assertTrue(np.allclose(distances, distances.T))
+        self.assertEqual(distances[0, 1], 0)
+        p = 0.25
+        self.assertAlmostEqual(distances[0, 2], -np.log(1 - p - 0.2 * p * p))
+        self.assertEqual(distances[0, 3], njtree.MAX_DISTANCE)
+        self.assertTrue(np.all(np.diag(distances) == 0))
+
+    def test_neighbor_joining(self):
+        """Tests the tree of the example of Saitou and Nei, as given on Wikipedia"""
+        distances = np.array([[0, 5, 9, 9, 8], [5, 0, 10, 10, 9], [9, 10, 0, 8, 7], [9, 10, 8, 0, 3],
+                              [8, 9, 7, 3, 0]])
+        tree = njtree.neighbor_joining(distances, ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(tree, '(((a:2.000000,b:3.000000):3.000000,c:4.000000):2.000000,e:1.000000,d:2.000000);')
+
+    def test_neighbor_joining_small(self):
+        """Tests trees of two proteins, and that one protein is refused"""
+        self.assertEqual(njtree.neighbor_joining(np.array([[0, 1], [1, 0]]), ['a', 'b']), '(a:0.500000,b:0.500000);')
+        with self.assertRaises(njtree.TreeError):
+            njtree.neighbor_joining(np.zeros((1, 1)), ['a'])
+
+    def test_write_tree(self):
+        """Tests that every protein of an alignment file is a leaf of the tree written"""
+        msa = os.getcwd() + os.sep + 'example_data' + os.sep + 'atn1seq.aln'
+        directory = tempfile.mkdtemp()
+        try:
+            path = njtree.write_tree(msa, os.path.join(directory, 'atn1seq.tree'))
+            with open(path) as file:
+                tree = file.read().strip()
+            self.assertTrue(tree.endswith(');'))
+            self.assertEqual(tree.count('('), tree.count(')'))
+            self.assertEqual(sorted(njtree.leaves(tree)), sorted(Alignment.read(msa).ids))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_leaf_names(self):
+        """Tests that leaf names are safe for Newick and unique, and that the renamed alignment uses them"""
+        names = njtree.leaf_names(['sp|P54259|ATN1_HUMAN', 'a(1):b', 'a_1__b', 'x,y'])
+        self.assertEqual(names, ['sp|P54259|ATN1_HUMAN', 'a_1__b', 'a_1__b_1', 'x_y'])
+        msa = Alignment(['a(1):b', 'a_1__b', 'x,y'], np.frombuffer(b'MKTMK-M-T', dtype=np.uint8).reshape(3, 3))
+        tree = njtree.build_tree(msa)
+        self.assertEqual(sorted(njtree.leaves(tree)), ['a_1__b', 'a_1__b_1', 'x_y'])
+        directory = tempfile.mkdtemp()
+        try:
+            path = njtree.write_alignment(msa, os.path.join(directory, 'named.aln'))
+            self.assertEqual(set(Alignment.read(path).ids), set(njtree.leaves(tree)))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -4,18 +4,102 @@ of the closest protein to that sequence. Either a string in fasta format, or the
 single letter alphabet sequence is required as input.
 """
 
+import asyncio
+import copy
 import json
 import os
+import threading
+import time
 import requests
+from consScore import coalesce
 from consScore import constool
+from consScore import fasta as fa
 from biskit.errors import BiskitError
 from requests import exceptions
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 
 class SequenceError(BiskitError):
     pass
 
 
+#: Default settings of the HTTP session shared by all OrthologFinder objects. pool_connections is the
+#: number of hosts to keep pools for, pool_maxsize the number of keep-alive connections kept per host, and
+#: timeout the (connect, read) timeout in seconds passed to every request.
+SESSION_DEFAULTS = {'pool_connections': 4, 'pool_maxsize': 16, 'pool_block': False, 'max_retries': 0,
+                    'gzip': True, 'timeout': (10, 120)}
+
+_session = None
+_session_config = dict(SESSION_DEFAULTS)
+_session_lock = threading.Lock()
+_default_cache = None
+#: Coalesces the OMA queries of OrthologFinder objects that ask for the same sequence or HOG at the same time
+_flights = coalesce.SingleFlight()
+
+
+def configure_session(**settings):
+    """
+    Changes the settings of the HTTP session shared by all OrthologFinder objects in the process. The current
+    session is closed, and a new one is created with the new settings the next time it is requested.
+    Args:
+        settings: Any of the keys in SESSION_DEFAULTS- pool_connections(int), pool_maxsize(int),
+            pool_block(Boolean), max_retries(int), gzip(Boolean) or timeout(float or tuple)
+    Returns:
+        A dictionary of the settings now in use
+    """
+    global _session
+    unknown = set(settings) - set(SESSION_DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown session settings: {0}'.format(', '.join(sorted(unknown))))
+    with _session_lock:
+        _session_config.update(settings)
+        if _session is not None:
+            _session.close()
+            _session = None
+    return dict(_session_config)
+
+
+def get_session():
+    """
+    Returns the connection pooled requests.Session shared by all OrthologFinder objects, creating it on first use
+    so that keep-alive connections to the OMA browser are reused between queries.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session(_session_config)
+        return _session
+
+
+def session_timeout():
+    """Returns the timeout that requests made through the shared session should use"""
+    return _session_config['timeout']
+
+
+def configure_cache(cache):
+    """
+    Sets the response cache consulted by OrthologFinder objects that are not given their own cache
+    Args:
+        cache(omacache.ResponseCache): The cache to use, or None to stop caching
+    """
+    global _default_cache
+    _default_cache = cache
+
+
+def _build_session(config):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=config['pool_connections'], pool_maxsize=config['pool_maxsize'],
+                          pool_block=config['pool_block'], max_retries=config['max_retries'])
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if config['gzip']:
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+    else:
+        session.headers['Accept-Encoding'] = 'identity'
+    return session
+
+
 class OrthologFinder:
     """
     Queries OMA with a protein sequence or fasta to try and retrieve the
@@ -27,8 +111,24 @@ class OrthologFinder:
     OMA_BASE_URL = 'https://omabrowser.org'
     HEADERS = {'Content-Type': 'application/json'}
 
-    def __init__(self, fasta):
+    def __init__(self, fasta, cache=None, backend=None, use_accession=True, target_size=None):
+        """
+        Args:
+            fasta(str): The protein sequence, or the protein in fasta format
+            cache(omacache.ResponseCache): Where the responses of OMA are cached. Defaults to the cache set with
+                configure_cache, if any
+            backend(omalocal.LocalOMA): A local OMA store that answers the queries instead of the OMA browser
+            use_accession(Boolean): If true and the fasta header carries a UniProt accession or OMA id, the OMA id
+                is looked up from the accession instead of searching OMA with the sequence
+            target_size(tuple): The (smallest, largest) number of members wanted in the HOG. If given, get_HOGs
+                uses the level of the HOG whose member count best fits this range, instead of the deepest level
+        """
         self.fasta = fasta
+        self.cache = cache
+        self.backend = backend
+        self.use_accession = use_accession
+        self.accession = None
+        self.id_source = ""
         self.sequence = ""
         self.id = ""
         self.ortholog_ids = []
@@ -37,19 +137,82 @@ class OrthologFinder:
         self.has_run_hogs = False
         self.save_status = 0
         self.hog_level = ""
+        self.hog_id = ""
+        self.alternative_levels = []
+        self.target_size = target_size
+        self.hog_size = None
+        self.level_sizes = {}
         self.HOGs = ""
+        self.timings = {}
+
+    #: Size in bytes of the chunks read from a streamed response
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def _get(self, url, headers=None, **kwargs):
+        """
+        Sends a GET request through the shared, connection pooled session
+        """
+        return get_session().get(url, headers=headers, timeout=session_timeout(), **kwargs)
+
+    def _stream_fasta(self, url, handle, skip):
+        """
+        Streams the fasta text at the url into the open file, leaving out the proteins selected by skip
+        """
+        response = self._get(url, stream=True)
+        try:
+            if response.status_code != 200:
+                self.save_status = response.status_code
+                raise exceptions.RequestException('There was an issue querying the database. Status code {0}'
+                                                  .format(self.save_status))
+            return constool.write_fasta_stream(response.iter_lines(chunk_size=self.STREAM_CHUNK_SIZE), handle, skip)
+        finally:
+            response.close()
+
+    def _not_found(self, what):
+        raise exceptions.RequestException('Could not find the {0} of {1} in the local OMA store'
+                                          .format(what, self.id or 'the sequence'))
+
+    def _cache(self):
+        return self.cache if self.cache is not None else _default_cache
+
+    def _cached(self, endpoint, *parts):
+        cache = self._cache()
+        if cache is None:
+            return None
+        return cache.get(endpoint, *parts)
+
+    def _store(self, endpoint, value, *parts):
+        cache = self._cache()
+        if cache is not None:
+            cache.put(endpoint, value, *parts)
 
     def retrieve_OMAid(self):
         """
         Takes a protein sequence and returns the oma id of the best protein
-        match
+        match. If the fasta header carries a UniProt accession or OMA id, the protein is looked up by that instead,
+        which is much faster than the sequence search. Which of the two was used is saved in id_source, as
+        'accession' or 'sequence'
         Returns:
            A string containing the ID of the best protein match for the entered sequence
         """
+        if self.backend is not None:
+            self.id = self.backend.protein_id(self.sequence) or ""
+            if not self.id:
+                self._not_found('OMA id')
+            self.id_source = 'sequence'
+            return
+        if self.use_accession and self.retrieve_OMAid_by_accession():
+            return
+        self.id_source = 'sequence'
+        cached = self._cached('sequence', self.sequence)
+        if cached is not None:
+            self.id = cached
+            return
         url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/api/sequence/?query={0}', variation=[self.sequence])
-        response = requests.get(url, headers=self.HEADERS)
+        response = self._get(url, headers=self.HEADERS)
         if response.status_code == 200:
             self.read_resp_protID(response)
+            self._store('sequence', self.id, self.sequence)
         if response.status_code == 504:
             self.save_status = response.status_code
             raise TimeoutError('The database timed out. Could not determine the orthologs of your sequence. Status code {0}'
@@ -59,6 +222,27 @@ class OrthologFinder:
             raise exceptions.RequestException('There was an issue querying the database. Status code {0}'
                                               .format(self.save_status))
 
+    def retrieve_OMAid_by_accession(self):
+        """
+        Looks up the OMA id of the protein from the UniProt accession or OMA id in its fasta header
+        Returns:
+            True if the OMA id was found, False if the header has no accession or OMA does not know it
+        """
+        self.accession = constool.get_accession(self.fasta)
+        if not self.accession:
+            return False
+        cached = self._cached('accession', self.accession)
+        if cached is None:
+            url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/api/protein/{0}/', variation=[self.accession])
+            response = self._get(url, headers=self.HEADERS)
+            if response.status_code != 200:
+                return False
+            cached = json.loads(response.content.decode('utf-8'))['omaid']
+            self._store('accession', cached, self.accession)
+        self.id = cached
+        self.id_source = 'accession'
+        return True
+
     def read_resp_protID(self, response):
         response = json.loads(response.content.decode('utf-8'))
         save = response['targets']
@@ -66,16 +250,32 @@ class OrthologFinder:
 
     def retrieve_HOG_level(self, root=True):
         """
-        Retrieve information on the taxonomic levels that the HOG spans through
+        Retrieve information on the taxonomic levels that the HOG spans through. The HOG is looked up by the protein,
+        since the level of the root HOG is not that of the sub-HOG the protein belongs to. Finders of the same
+        protein share a single request and cache entry
         Args:
             root(Boolean): if true, return the deepest level of the HOG. If false, return a list
             of the alternative level that the HOG spans through
         Returns: The deepest level relating the HOG, or a list of all the levels
         """
+        if self.backend is not None:
+            levels = self.backend.hog_levels(self.id)
+            if not levels:
+                self._not_found('HOG')
+            self.hog_level = levels[0][0] if root else [level for level, count in levels]
+            return self.hog_level
+        cached = self._cached('hog', self.id)
+        if cached is not None:
+            return self.parse_HOGid(cached, root)
         url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/api/hog/{0}/', variation=[self.id])
-        response = requests.get(url, headers=self.HEADERS)
+        content = _flights.do(('hog', self.id), self._fetch_HOG, url)
+        self._store('hog', content, self.id)
+        return self.parse_HOGid(content, root)
+
+    def _fetch_HOG(self, url):
+        response = self._get(url, headers=self.HEADERS)
         if response.status_code == 200:
-            return self.read_HOGid(response, root)
+            return response.content.decode('utf-8')
         if response.status_code == 504:
             self.save_status = response.status_code
             raise TimeoutError('The database timed out. Could not determine the orthologs of your sequence. Status code {0}'
@@ -90,14 +290,82 @@ class OrthologFinder:
         If root is true, return the level of the retrieved HOG. If false, return the list of all the
         taxonomic levels that the HOG spans
         """
-        response = json.loads(response.content.decode('utf-8'))
+        return self.parse_HOGid(response.content.decode('utf-8'), root)
+
+    def parse_HOGid(self, content, root):
+        """
+        Reads the level of the HOG from the text of the HOG response, as read_HOGid does
+        """
+        response = json.loads(content)
         if root:
             level = response[0]['level']
         else:
             level = response[0]['alternative_levels']
+        # A HOG id from the bulk protein record, which can name a sub-HOG, is kept
+        self.hog_id = self.hog_id or response[0].get('hog_id', '')
+        self.alternative_levels = response[0].get('alternative_levels', [])
         self.hog_level = level
         return self.hog_level
 
+    def count_HOG_members(self, level):
+        """
+        Returns the number of proteins in the HOG of the input protein at the given taxonomic level. The HOG is
+        looked up by the protein, as HOG_to_fasta downloads it, so the count is that of the HOG that is downloaded
+        """
+        hog = self.id
+        cached = self._cached('hog_members', hog, level)
+        if cached is not None:
+            return int(cached)
+        url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/api/hog/{0}/members/?level={1}',
+                                 variation=[hog, level])
+        response = self._get(url, headers=self.HEADERS)
+        if response.status_code != 200:
+            self.save_status = response.status_code
+            raise exceptions.RequestException('There was an issue querying the database. Status code {0}'
+                                              .format(self.save_status))
+        content = json.loads(response.content.decode('utf-8'))
+        members = content['members'] if isinstance(content, dict) else content
+        self._store('hog_members', str(len(members)), hog, level)
+        return len(members)
+
+    def select_HOG_level(self, target_size=None):
+        """
+        Chooses the taxonomic level of the HOG whose member count fits the target range, so that the alignment
+        and conservation scoring of widely conserved proteins stay affordable. The deepest level is counted first.
+        If it is too large, the other levels are counted one at a time, in the order OMA lists them, and counting
+        stops at the first level inside the range, so that as few member lists as possible are downloaded. If no
+        level is inside the range, the level closest to it is used.
+        Args:
+            target_size(tuple): The (smallest, largest) number of members wanted. Defaults to target_size
+        Returns:
+            The chosen level. Its member count is saved in hog_size, and the counts of every level in level_sizes
+        """
+        smallest, largest = target_size or self.target_size
+        if self.backend is not None:
+            self.level_sizes = dict(self.backend.hog_levels(self.id))
+            if not self.level_sizes:
+                self._not_found('HOG')
+        else:
+            root = self.retrieve_HOG_level(root=True)
+            self.level_sizes = {root: self.count_HOG_members(root)}
+            if self.level_sizes[root] > largest:
+                for level in self.alternative_levels:
+                    if level not in self.level_sizes:
+                        self.level_sizes[level] = self.count_HOG_members(level)
+                        if smallest <= self.level_sizes[level] <= largest:
+                            break
+
+        def distance(item):
+            level, count = item
+            if count < smallest:
+                return smallest - count, 0
+            if count > largest:
+                return count - largest, 0
+            return 0, -count
+
+        self.hog_level, self.hog_size = min(sorted(self.level_sizes.items()), key=distance)
+        return self.hog_level
+
     def update_orthoIDs(self):
         """
         Takes the OMA specific ID of a protein species, and returns a list of the
@@ -105,8 +373,11 @@ class OrthologFinder:
         Returns:
             A list of strings, the canonical IDS for the orthologs of the protein
         """
+        if self.backend is not None:
+            self.ortholog_ids.extend(self.backend.ortholog_ids(self.id))
+            return
         url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/api/protein/{0}/orthologs/', variation=[self.id])
-        response = requests.get(url, headers=self.HEADERS)
+        response = self._get(url, headers=self.HEADERS)
         if response.status_code == 200:
             self.read_resp_orthoIDs(response)
         else:
@@ -131,11 +402,20 @@ class OrthologFinder:
             dictated by OMA.Note that when the fasta file is parsed,
             the first id is the OMA ID, and the second is the canonical id.
         """
+        if self.backend is not None:
+            self.orthologs = self.backend.ortholog_fasta(self.id)
+            if self.orthologs is None:
+                self.orthologs = ""
+                self._not_found('orthologs')
+            return self.orthologs
         url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/oma/vps/{0}/fasta/', variation=[self.id])
-        response = requests.get(url)
+        self.orthologs = _flights.do(('ortholog_fasta', self.id), self._download_fasta, url)
+        return self.orthologs
+
+    def _download_fasta(self, url):
+        response = self._get(url)
         if response.status_code == 200:
-            self.orthologs = str(response.text)
-            return self.orthologs
+            return str(response.text)
         else:
             self.save_status = response.status_code
             raise exceptions.RequestException('There was an issue querying the database. Status code {0}'
@@ -145,16 +425,21 @@ class OrthologFinder:
         """
         Retrieves the fasta file containing the sequences of the proteins in the HOG of the input protein
         """
+        if self.backend is not None:
+            self.HOGs = self.backend.hog_fasta(self.id, self.hog_level)
+            if self.HOGs is None:
+                self.HOGs = ""
+                self._not_found('HOG')
+            return self.HOGs
+        cached = self._cached('hog_fasta', self.id, self.hog_level)
+        if cached is not None:
+            self.HOGs = cached
+            return self.HOGs
         url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/oma/hogs/{0}/{1}/fasta/',
                                  variation=[self.id, self.hog_level])
-        response = requests.get(url)
-        if response.status_code == 200:
-            self.HOGs = str(response.text)
-            return self.HOGs
-        else:
-            self.save_status = response.status_code
-            raise exceptions.RequestException('There was an issue querying the database. Status code {0}'
-                                              .format(self.save_status))
+        self.HOGs = _flights.do(('hog_fasta', self.id, self.hog_level), self._download_fasta, url)
+        self._store('hog_fasta', self.HOGs, self.id, self.hog_level)
+        return self.HOGs
 
     def get_HOGs(self):
         """
@@ -167,13 +452,114 @@ class OrthologFinder:
         if self.has_run_hogs:
             output = self.HOGs
         else:
-            self.retrieve_OMAid()
-            self.retrieve_HOG_level()
-            output = self.HOG_to_fasta()
-            output = constool.remove_protein(output, self.id)
+            found = _flights.do(self._flight_key('hogs'), self._find_HOGs)
+            self.id, self.id_source, self.hog_id, self.hog_level, self.hog_size, self.HOGs = found
+            output = constool.remove_protein(self.HOGs, self.id)
             self.has_run_hogs = True
         return output
 
+    def _flight_key(self, chain):
+        """
+        Identifies the queries of this object, so that objects with the same sequence share them
+        """
+        backend = id(self.backend) if self.backend is not None else None
+        accession = constool.get_accession(self.fasta) if self.use_accession else None
+        return chain, self.sequence, accession, self.id, backend, self.target_size
+
+    def _find_HOGs(self):
+        if not self.id:
+            self.retrieve_OMAid()
+        self._choose_HOG_level()
+        self.HOG_to_fasta()
+        return self.id, self.id_source, self.hog_id, self.hog_level, self.hog_size, self.HOGs
+
+    def _choose_HOG_level(self):
+        if self.target_size:
+            self.select_HOG_level()
+        else:
+            self.retrieve_HOG_level()
+
+    def HOG_to_file(self, handle, skip=None):
+        """
+        Streams the fasta of the proteins in the HOG of the input protein straight into a file, without holding the
+        whole response in memory
+        Args:
+            handle: The open file the HOG is written to
+            skip(function): Called with the header and position of each protein- proteins for which it returns True
+                are not written
+        Returns:
+            The number of proteins written
+        """
+        if self.backend is not None:
+            fasta = self.HOG_to_fasta()
+        else:
+            fasta = self._cached('hog_fasta', self.id, self.hog_level)
+        if fasta is not None:
+            return constool.write_fasta_stream(fasta.splitlines(), handle, skip)
+        url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/oma/hogs/{0}/{1}/fasta/',
+                                 variation=[self.id, self.hog_level])
+        return self._stream_fasta(url, handle, skip)
+
+    def ortholog_to_file(self, handle, skip=None):
+        """
+        Streams the fasta of the orthologs of the input protein straight into a file, without holding the whole
+        response in memory
+        Args:
+            handle: The open file the orthologs are written to
+            skip(function): Called with the header and position of each protein- proteins for which it returns True
+                are not written
+        Returns:
+            The number of proteins written
+        """
+        if self.backend is not None:
+            return constool.write_fasta_stream(self.ortholog_to_fasta().splitlines(), handle, skip)
+        url = constool.build_url(base_url=self.OMA_BASE_URL, tail='/oma/vps/{0}/fasta/', variation=[self.id])
+        return self._stream_fasta(url, handle, skip)
+
+    def _find_orthologs(self):
+        if not self.id:
+            self.retrieve_OMAid()
+        self.ortholog_to_fasta()
+        return self.id, self.id_source, self.orthologs
+
+    def save_HOGs(self, path):
+        """
+        Writes the proteins in the HOG of the input protein to a file in fasta format, as get_HOGs returns them. The
+        response is streamed and filtered one protein at a time, so large HOGs are never held in memory.
+        Args:
+            path(str): The file the HOG is written to
+        Returns:
+            The path to the file
+        """
+        if not self.fasta:
+            raise SequenceError("Input sequence is empty!")
+        self.sequence = constool.get_fasta_sequence(fasta=self.fasta)
+        if not self.id:
+            self.retrieve_OMAid()
+        self._choose_HOG_level()
+        with open(path, 'w') as handle:
+            self.HOG_to_file(handle, skip=lambda header, index: self.id in fa.header_ids(header))
+        return path
+
+    def save_orthologs(self, path):
+        """
+        Writes the input sequence followed by its orthologs to a file in fasta format, as get_orthologs returns them.
+        The response is streamed, so large ortholog sets are never held in memory.
+        Args:
+            path(str): The file the orthologs are written to
+        Returns:
+            The path to the file
+        """
+        if not self.fasta:
+            raise SequenceError("Input sequence is empty!")
+        self.sequence = constool.get_fasta_sequence(fasta=self.fasta)
+        if not self.id:
+            self.retrieve_OMAid()
+        with open(path, 'w') as handle:
+            handle.write(constool.seqnwl_strip(self.sequence) + os.linesep)
+            self.ortholog_to_file(handle, skip=lambda header, index: index == 0)
+        return path
+
     def get_orthologs(self):
         """
         Retrieves a fasta file containing the sequences of the orthologous proteins, based on the input parameters
@@ -184,9 +570,221 @@ class OrthologFinder:
         if self.has_run:
             output = self.orthologs
         else:
-            self.retrieve_OMAid()
-            output = self.ortholog_to_fasta()
+            found = _flights.do(self._flight_key('orthologs'), self._find_orthologs)
+            self.id, self.id_source, self.orthologs = found
+            output = self.orthologs
             output = constool.remove_first_protein(output)
             output = constool.seqnwl_strip(self.sequence) + os.linesep + output
             self.has_run = True
         return output
+
+    def get_HOGs_or_orthologs(self, speculative=False):
+        """
+        Retrieves the HOG of the input protein, falling back on its orthologs if the HOG could not be retrieved.
+        Args:
+            speculative(Boolean): If false, the orthologs are only queried after the HOG query has failed. If true,
+                both are queried at the same time once the OMA id is known, and the HOG is used if it was retrieved.
+                A failed HOG query then costs no extra time, at the price of an ortholog query that is usually
+                discarded
+        Returns:
+            The fasta string of the HOG or the orthologs, as get_HOGs or get_orthologs return them. The time taken
+            by each query, in seconds, is saved in timings. The time of the speculative ortholog query is also saved
+            as orthologs_speculative once it finishes, even when the HOG is used and the query is left running
+        """
+        self.timings = {}
+        if not speculative:
+            try:
+                return self._timed('hogs', self.get_HOGs)
+            except exceptions.RequestException:
+                return self._timed('orthologs', self.get_orthologs)
+        if not self.fasta:
+            raise SequenceError("Input sequence is empty!")
+        self.sequence = constool.get_fasta_sequence(fasta=self.fasta)
+        if not self.id:
+            self._timed('id', self.retrieve_OMAid)
+        # The ortholog query runs on a copy, since it cannot be interrupted once it has started and would otherwise
+        # go on changing this object after the HOG has been returned. Its state is only taken if it is used
+        shadow = copy.copy(self)
+        shadow.timings = {}
+        timings = self.timings
+
+        def speculated(future):
+            if 'orthologs' in shadow.timings:
+                timings['orthologs_speculative'] = shadow.timings['orthologs']
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            hogs = executor.submit(self._timed, 'hogs', self.get_HOGs)
+            orthologs = executor.submit(shadow._timed, 'orthologs', shadow.get_orthologs)
+            orthologs.add_done_callback(speculated)
+            try:
+                output = hogs.result()
+            except exceptions.RequestException:
+                output = orthologs.result()
+                for name in self._ORTHOLOG_STATE:
+                    setattr(self, name, getattr(shadow, name))
+                self.timings.update(shadow.timings)
+                speculated(orthologs)
+                return output
+            orthologs.cancel()
+            return output
+        finally:
+            executor.shutdown(wait=False)
+
+    #: The attributes set by get_orthologs, copied from the speculative ortholog query when its result is used
+    _ORTHOLOG_STATE = ('id', 'id_source', 'ortholog_ids', 'orthologs', 'has_run', 'save_status')
+
+    def _timed(self, name, method):
+        start = time.perf_counter()
+        try:
+            return method()
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+
+def bulk_retrieve(ids, batch_size=100):
+    """
+    Retrieves the OMA records of many proteins, batch_size proteins per request, using the bulk retrieve endpoint
+    of the OMA browser
+    Args:
+        ids(list): UniProt accessions or OMA ids of the proteins
+        batch_size(int): The number of proteins sent in each request. OMA accepts at most 100
+    Returns:
+        A dictionary mapping each id that OMA knows to its protein record
+    """
+    url = constool.build_url(base_url=OrthologFinder.OMA_BASE_URL, tail='/api/protein/bulk_retrieve/', variation=[])
+    ids = list(dict.fromkeys(ids))
+    records = {}
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        response = get_session().post(url, json={'ids': batch}, headers=OrthologFinder.HEADERS,
+                                      timeout=session_timeout())
+        if response.status_code == 504:
+            raise TimeoutError('The database timed out. Status code {0}'.format(response.status_code))
+        if response.status_code != 200:
+            raise exceptions.RequestException('There was an issue querying the database. Status code {0}'
+                                              .format(response.status_code))
+        for entry in json.loads(response.content.decode('utf-8')):
+            target = entry.get('target', entry)
+            if target:
+                records[entry.get('query_id', target.get('omaid'))] = target
+    return records
+
+
+def resolve_batch(finders, batch_size=100, cache=None):
+    """
+    Resolves the OMA ids and HOG ids of many OrthologFinder objects in a few bulk requests, instead of one
+    request per protein. Only proteins with a UniProt accession or OMA id in their fasta header can be resolved in
+    bulk- the others still need the sequence search, which retrieve_OMAid runs when they are used.
+    The bulk records do not carry the taxonomic level of the HOG, which the HOG fasta is downloaded at, so
+    retrieve_HOG_level still makes one request per protein, unless it is cached. The finders keep the HOG id of
+    their record.
+    Args:
+        finders(list): The OrthologFinder objects
+        batch_size(int): The number of proteins sent in each request
+        cache(omacache.ResponseCache): Checked before, and filled after, the bulk requests. Defaults to the cache
+            set with configure_cache
+    Returns:
+        The list of OrthologFinder objects that could not be resolved
+    """
+    cache = cache if cache is not None else _default_cache
+    pending = {}
+    for finder in finders:
+        finder.accession = constool.get_accession(finder.fasta) if finder.use_accession else None
+        if finder.id or finder.backend is not None:
+            continue
+        if not finder.accession:
+            continue
+        cached = cache.get('accession', finder.accession) if cache is not None else None
+        if cached is not None:
+            finder.id = cached
+            finder.id_source = 'accession'
+        else:
+            pending.setdefault(finder.accession, []).append(finder)
+    records = bulk_retrieve(list(pending), batch_size=batch_size) if pending else {}
+    for accession, waiting in pending.items():
+        record = records.get(accession)
+        if not record:
+            continue
+        if cache is not None:
+            cache.put('accession', record['omaid'], accession)
+        for finder in waiting:
+            finder.id = record['omaid']
+            finder.hog_id = record.get('oma_hog_id') or ""
+            finder.id_source = 'accession'
+    return [finder for finder in finders if not finder.id and finder.backend is None]
+
+
+class AsyncOrthologFinder:
+    """
+    Asynchronous counterpart of OrthologFinder, so that the orthologs of many proteins can be retrieved
+    concurrently. The queries of each protein are still made in order (sequence -> OMA id -> HOG level -> HOG
+    fasta) by an OrthologFinder, but they run in worker threads over the shared pooled session, so one event
+    loop can wait on many proteins at once.
+    """
+
+    def __init__(self, fasta, executor=None):
+        """
+        Args:
+            fasta(str): The protein sequence, or the protein in fasta format
+            executor(concurrent.futures.Executor): Where the blocking queries run. Defaults to the default
+                executor of the event loop
+        """
+        self.finder = OrthologFinder(fasta)
+        self.executor = executor
+
+    async def _run(self, method):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, method)
+
+    async def get_HOGs(self):
+        """
+        Retrieves the fasta string of the HOG of the input protein, as OrthologFinder.get_HOGs does
+        """
+        return await self._run(self.finder.get_HOGs)
+
+    async def get_orthologs(self):
+        """
+        Retrieves the fasta string of the orthologs of the input protein, as OrthologFinder.get_orthologs does
+        """
+        return await self._run(self.finder.get_orthologs)
+
+    async def get_HOGs_or_orthologs(self):
+        """
+        Retrieves the HOG of the input protein, falling back on its orthologs if the HOG could not be retrieved.
+        This is the same fallback used by ConservationPipe.call_orthologs
+        """
+        return await self._run(self.finder.get_HOGs_or_orthologs)
+
+
+async def gather_HOGs(sequences, concurrency=8, return_exceptions=False, executor=None, batch_size=100):
+    """
+    Retrieves the HOGs (or the orthologs, if the HOG cannot be retrieved) of many proteins concurrently
+    Args:
+        sequences(list): The protein sequences, or proteins in fasta format
+        concurrency(int): The largest number of proteins queried at the same time. Keep this at or below the
+            pool_maxsize of the shared session, otherwise the extra connections are not kept alive
+        return_exceptions(Boolean): If true, a protein that could not be retrieved has its exception in its place
+            in the output. If false, the first exception is raised
+        executor(concurrent.futures.Executor): Where the blocking queries run
+        batch_size(int): The OMA ids of proteins with an accession in their header are first resolved together,
+            this many per request. If None, every protein is resolved on its own
+    Returns:
+        A list of fasta strings, in the same order as the input sequences
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    semaphore = asyncio.Semaphore(concurrency)
+    finders = [AsyncOrthologFinder(sequence, executor=executor) for sequence in sequences]
+    if batch_size:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(executor, resolve_batch, [f.finder for f in finders], batch_size)
+        except (exceptions.RequestException, TimeoutError):
+            # Each protein is then resolved on its own instead
+            pass
+
+    async def bounded(finder):
+        async with semaphore:
+            return await finder.get_HOGs_or_orthologs()
+
+    return await asyncio.gather(*[bounded(finder) for finder in finders], return_exceptions=return_exceptions)
@@ -7,10 +7,16 @@ Created on Thu May 24 14:49:39 2018
 
 Test file for oma
 """
+import asyncio
 import biskit.test
+import json
 import os
+import tempfile
+import threading
+import time
 from consScore import oma
 from consScore import constool
+from consScore import omacache
 from requests import exceptions
 from unittest.mock import patch, MagicMock
 
@@ -74,7 +80,7 @@ class TestCons(biskit.test.BiskitTest):
         self.lyz.sequence = 'MKALIVLGLVLLSVTVQGKVFERCELARTLKRLGMDGYRGISLANWMCLAKWESGYNTRATNYNAGDRSTDYGIFQINSRYWCNDGKTPGAVNACHLSCSALLQDNIADAVACAKRVVRDPQGIRAWVAWRNRCQNRDVRQYVQGCGV'
         self.assertEqual(constool.build_url(base_url='https://omabrowser.org', tail='/api/sequence/?query={0}', variation=[self.lyz.sequence]), 'https://omabrowser.org/api/sequence/?query=MKALIVLGLVLLSVTVQGKVFERCELARTLKRLGMDGYRGISLANWMCLAKWESGYNTRATNYNAGDRSTDYGIFQINSRYWCNDGKTPGAVNACHLSCSALLQDNIADAVACAKRVVRDPQGIRAWVAWRNRCQNRDVRQYVQGCGV')
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_ologs_stragg(self, requests_mock):
         """Tests that a request with a bad status code raises an exception with call_orthologs"""
         requests_mock.requests.get.return_value = None
@@ -84,14 +90,14 @@ class TestCons(biskit.test.BiskitTest):
         err = cm.exception
         self.assertTrue('There was an issue querying the database. Status code' in str(err))
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_ofasta_stragg(self, requests_mock):
         """Tests that a bad request raises an exception in ortholog_to_fasta"""
         requests_mock.requests.get.status_code = 400
         with self.assertRaises(exceptions.RequestException):
             self.aggregate.ortholog_to_fasta()
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_ofasta_cdc(self, requests_mock):
         """Tests that ortholog_to_fasta correctly parses the response data"""
         requests_mock().status_code = 200
@@ -99,14 +105,14 @@ class TestCons(biskit.test.BiskitTest):
         test = self.CDC48A.ortholog_to_fasta()
         self.assertTrue('[Arabis alpina]' in test)
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_orIDs_stragg(self, requests_mock):
         """Test that update_orthoIDs returns an exception given a bad request status"""
         requests_mock().status_code = 400
         with self.assertRaises(exceptions.RequestException):
             self.aggregate.update_orthoIDs()
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_ret_hogs_stragg(self, requests_mock):
         """Tests that retrieve_HOG_level throws an exception when given a bad request status"""
         requests_mock().status_code = 400
@@ -129,7 +135,7 @@ class TestCons(biskit.test.BiskitTest):
         err = cm.exception
         self.assertEqual(str(err), 'Input sequence is empty!')
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_hog_fasta(self, mock_request):
         """Tests that HOG_to_fasta correctly parses the request response"""
         self.lyz.hog_level = "Amniota"
@@ -138,7 +144,7 @@ class TestCons(biskit.test.BiskitTest):
         test = self.lyz.HOG_to_fasta()
         self.assertTrue("HOG:0377891.2a.2a" in test)
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_read_hog_roottrue(self, mock_request):
         """tests that read_HOGid retrieves the root ID when root=True"""
         thing = MagicMock(content=self.lvlresponse)
@@ -146,7 +152,7 @@ class TestCons(biskit.test.BiskitTest):
         test = self.lyz.read_HOGid(thing, root=True)
         self.assertEqual(test, 'Amniota')
 
-    @patch('oma.requests.get')
+    @patch('oma.requests.Session.get')
     def test_read_hog_rootfalse(self, mock_request):
         """tests that read_HOGid retrieves a list of the ids when root=False """
         thing = MagicMock(content=self.lvlresponse)
@@ -156,5 +162,332 @@ class TestCons(biskit.test.BiskitTest):
         self.assertTrue('Caniformia' in test)
         self.assertTrue('Gorilla gorilla gorilla' in test)
 
+    def test_shared_session(self):
+        """Tests that all OrthologFinder objects reuse a single pooled session"""
+        self.assertIs(oma.get_session(), oma.get_session())
+        adapter = oma.get_session().get_adapter(oma.OrthologFinder.OMA_BASE_URL)
+        self.assertEqual(adapter._pool_maxsize, oma.SESSION_DEFAULTS['pool_maxsize'])
+
+    def test_configure_session(self):
+        """Tests that configure_session replaces the shared session with one using the new settings"""
+        old = oma.get_session()
+        try:
+            settings = oma.configure_session(pool_maxsize=3, timeout=5)
+            self.assertEqual(settings['pool_maxsize'], 3)
+            self.assertIsNot(old, oma.get_session())
+            self.assertEqual(oma.session_timeout(), 5)
+            self.assertEqual(oma.get_session().get_adapter('https://omabrowser.org')._pool_maxsize, 3)
+        finally:
+            oma.configure_session(**oma.SESSION_DEFAULTS)
+
+    def test_configure_session_bad(self):
+        """Tests that configure_session rejects settings it does not know about"""
+        with self.assertRaises(ValueError):
+            oma.configure_session(pool_size=3)
+
+    @patch('oma.requests.Session.get')
+    def test_session_timeout_passed(self, mock_get):
+        """Tests that the queries are sent with the timeout of the shared session"""
+        mock_get().status_code = 200
+        mock_get().text = self.fresponse
+        self.CDC48A.ortholog_to_fasta()
+        self.assertEqual(mock_get.call_args[1]['timeout'], oma.session_timeout())
+
+    @patch('consScore.oma.OrthologFinder.get_orthologs')
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_async_fallback(self, hog_mock, orth_mock):
+        """Tests that AsyncOrthologFinder falls back on the orthologs when the HOG query fails"""
+        hog_mock.side_effect = exceptions.RequestException('Status code 404')
+        orth_mock.return_value = '>orthologs'
+        test = asyncio.run(oma.AsyncOrthologFinder('MKAL').get_HOGs_or_orthologs())
+        self.assertEqual(test, '>orthologs')
+        self.assertTrue(hog_mock.called)
+
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_gather_HOGs(self, hog_mock):
+        """Tests that gather_HOGs keeps the input order and never runs more than concurrency queries at once"""
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def fake_hogs():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return 'done'
+
+        hog_mock.side_effect = fake_hogs
+        test = asyncio.run(oma.gather_HOGs(['MKAL'] * 10, concurrency=3))
+        self.assertEqual(test, ['done'] * 10)
+        self.assertTrue(running[1] <= 3)
+
+    @patch('consScore.oma.OrthologFinder.get_orthologs')
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_gather_HOGs_exceptions(self, hog_mock, orth_mock):
+        """Tests that gather_HOGs returns the exceptions in place when return_exceptions is true"""
+        hog_mock.side_effect = exceptions.RequestException('Status code 404')
+        orth_mock.side_effect = TimeoutError('The database timed out')
+        test = asyncio.run(oma.gather_HOGs(['MKAL', 'MKAL'], return_exceptions=True))
+        self.assertTrue(all(isinstance(t, TimeoutError) for t in test))
+
+    @patch('oma.requests.Session.get')
+    def test_cached_OMAid(self, mock_get):
+        """Tests that retrieve_OMAid stores the id in the cache, and does not query OMA when it is cached"""
+        mock_get().status_code = 200
+        mock_get().content = self.response
+        mock_get.reset_mock()
+        cache = omacache.ResponseCache()
+        first = oma.OrthologFinder('MKAL', cache=cache)
+        first.sequence = 'MKAL'
+        first.retrieve_OMAid()
+        second = oma.OrthologFinder('MKAL', cache=cache)
+        second.sequence = 'MKAL'
+        second.retrieve_OMAid()
+        self.assertEqual(second.id, 'ARATH09528')
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('oma.requests.Session.get')
+    def test_cached_HOG_level(self, mock_get):
+        """Tests that a cached HOG response can still be read for either the root or the alternative levels"""
+        mock_get().status_code = 200
+        mock_get().content = self.lvlresponse
+        cache = omacache.ResponseCache()
+        finder = oma.OrthologFinder('MKAL', cache=cache)
+        self.assertEqual(finder.retrieve_HOG_level(root=True), 'Amniota')
+        mock_get.reset_mock()
+        self.assertTrue('Caniformia' in finder.retrieve_HOG_level(root=False))
+        self.assertFalse(mock_get.called)
+
+    @patch('oma.requests.Session.get')
+    def test_save_HOGs_stream(self, mock_get):
+        """Tests that save_HOGs streams the HOG into the file, leaving out the input protein"""
+        mock_get().status_code = 200
+        mock_get().content = self.response
+        mock_get().iter_lines.return_value = iter(self.hresponse.splitlines())
+        finder = oma.OrthologFinder('MKAL')
+        finder.hog_level = 'Amniota'
+        finder.retrieve_HOG_level = MagicMock()
+        with tempfile.TemporaryDirectory() as directory:
+            path = finder.save_HOGs(os.path.join(directory, 'test.orth'))
+            with open(path) as file:
+                saved = file.read()
+        self.assertEqual(finder.id, 'ARATH09528')
+        self.assertTrue('HOG:0377891.2a.2a' in saved)
+        self.assertTrue(mock_get.call_args[1]['stream'])
+        self.assertTrue(mock_get().close.called)
+
+    @patch('oma.requests.Session.get')
+    def test_save_HOGs_stream_bad(self, mock_get):
+        """Tests that save_HOGs raises an exception when the HOG cannot be retrieved"""
+        mock_get().status_code = 400
+        finder = oma.OrthologFinder('MKAL')
+        finder.id = 'ARATH09528'
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(exceptions.RequestException):
+                with open(os.path.join(directory, 'test.orth'), 'w') as handle:
+                    finder.HOG_to_file(handle)
+
+    @patch('oma.requests.Session.get')
+    def test_OMAid_accession(self, mock_get):
+        """Tests that the OMA id is looked up through the accession in the header, skipping the sequence search"""
+        mock_get().status_code = 200
+        mock_get().content = b'{"omaid": "HUMAN27610", "canonicalid": "FAK2_HUMAN"}'
+        finder = oma.OrthologFinder('>sp|Q14289|FAK2_HUMAN Protein-tyrosine kinase 2-beta\nMSGVSEPLSRVKLGTLRRPEGPAEPMVV')
+        finder.retrieve_OMAid()
+        self.assertEqual(finder.id, 'HUMAN27610')
+        self.assertEqual(finder.id_source, 'accession')
+        self.assertTrue(mock_get.call_args[0][0].endswith('/api/protein/Q14289/'))
+
+    @patch('oma.requests.Session.get')
+    def test_OMAid_accession_fallback(self, mock_get):
+        """Tests that the sequence search is used when OMA does not know the accession"""
+        unknown = MagicMock(status_code=404)
+        found = MagicMock(status_code=200, content=self.response)
+        mock_get.side_effect = [unknown, found]
+        finder = oma.OrthologFinder('>sp|Q14289|FAK2_HUMAN Protein-tyrosine kinase 2-beta\nMSGVSEPLSRVKLGTLRRPEGPAEPMVV')
+        finder.retrieve_OMAid()
+        self.assertEqual(finder.id, 'ARATH09528')
+        self.assertEqual(finder.id_source, 'sequence')
+
+    @patch('oma.requests.Session.get')
+    def test_OMAid_no_accession(self, mock_get):
+        """Tests that a sequence without a recognised accession goes straight to the sequence search"""
+        mock_get().status_code = 200
+        mock_get().content = self.response
+        mock_get.reset_mock()
+        self.CDC48A.retrieve_OMAid()
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(self.CDC48A.id_source, 'sequence')
+
+    @patch('oma.requests.Session.post')
+    def test_bulk_retrieve_batches(self, mock_post):
+        """Tests that bulk_retrieve sends the ids in batches and maps each id to its record"""
+        def answer(url, **kwargs):
+            body = [{'query_id': i, 'target': {'omaid': 'OMA' + i, 'oma_hog_id': 'HOG:1'}} for i in kwargs['json']['ids']]
+            return MagicMock(status_code=200, content=bytes(json.dumps(body), 'utf-8'))
+        mock_post.side_effect = answer
+        records = oma.bulk_retrieve(['P%d' % i for i in range(5)] + ['P0'], batch_size=2)
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(records['P4']['omaid'], 'OMAP4')
+
+    @patch('oma.requests.Session.post')
+    def test_resolve_batch(self, mock_post):
+        """Tests that resolve_batch fans the bulk records out to the OrthologFinder objects"""
+        mock_post().status_code = 200
+        mock_post().content = (b'[{"query_id": "Q14289", "target": {"omaid": "HUMAN27610", "oma_hog_id": "HOG:0001"}},'
+                               b' {"query_id": "P54259", "target": null}]')
+        mock_post.reset_mock()
+        known = oma.OrthologFinder('>sp|Q14289|FAK2_HUMAN\nMSGVSEPLSRV')
+        twin = oma.OrthologFinder('>sp|Q14289|FAK2_HUMAN\nMSGVSEPLSRV')
+        unknown = oma.OrthologFinder('>sp|P54259|ATN1_HUMAN\nMKTRQNKDSM')
+        plain = oma.OrthologFinder('MKTRQNKDSM')
+        unresolved = oma.resolve_batch([known, twin, unknown, plain])
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(sorted(mock_post.call_args[1]['json']['ids']), ['P54259', 'Q14289'])
+        self.assertEqual((known.id, known.hog_id, known.id_source), ('HUMAN27610', 'HOG:0001', 'accession'))
+        self.assertEqual(twin.id, 'HUMAN27610')
+        self.assertEqual(unresolved, [unknown, plain])
+
+    @patch('oma.requests.Session.get')
+    def test_resolved_HOG_level(self, mock_get):
+        """Tests that finders resolved in bulk keep their HOG id, and get the level of their own sub-HOG"""
+        levels = {'HUMAN27610': 'Amniota', 'MOUSE01234': 'Rodentia', 'HOG:0377891': 'Vertebrata'}
+
+        def get(url, **kw):
+            query = url.rstrip('/').split('/')[-1]
+            response = MagicMock(status_code=200)
+            response.content = json.dumps([{'hog_id': 'HOG:0377891', 'level': levels[query],
+                                             'alternative_levels': []}]).encode('utf-8')
+            return response
+        mock_get.side_effect = get
+        cache = omacache.ResponseCache()
+        searched = oma.OrthologFinder('MKAL', cache=cache)
+        searched.id = 'HUMAN27610'
+        self.assertEqual(searched.retrieve_HOG_level(), 'Amniota')
+        resolved = oma.OrthologFinder('MKTR', cache=cache)
+        resolved.id, resolved.hog_id = 'MOUSE01234', 'HOG:0377891.2a.2b'
+        self.assertEqual(resolved.retrieve_HOG_level(), 'Rodentia')
+        self.assertEqual(resolved.hog_id, 'HOG:0377891.2a.2b')
+        twin = oma.OrthologFinder('MKTR', cache=cache)
+        twin.id, twin.hog_id = 'MOUSE01234', 'HOG:0377891.2a.2b'
+        self.assertEqual(twin.retrieve_HOG_level(), 'Rodentia')
+        self.assertEqual([call[0][0].split('/api/hog/')[1] for call in mock_get.call_args_list],
+                         ['HUMAN27610/', 'MOUSE01234/'])
+
+    @patch('oma.requests.Session.get')
+    def test_resolved_skips_lookup(self, mock_get):
+        """Tests that an OrthologFinder whose id is already resolved does not search for it again"""
+        mock_get().status_code = 200
+        mock_get().text = self.fresponse
+        mock_get.reset_mock()
+        finder = oma.OrthologFinder('MKTRQNKDSM')
+        finder.id = 'HUMAN27610'
+        finder.get_orthologs()
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue('/oma/vps/HUMAN27610/fasta/' in mock_get.call_args[0][0])
+
+    @patch('consScore.oma.OrthologFinder.get_orthologs')
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_speculative_hogs_win(self, hog_mock, orth_mock):
+        """Tests that the speculative mode queries both at once and uses the HOG when it is retrieved"""
+        started = threading.Barrier(2, timeout=5)
+
+        def slow(result):
+            started.wait()
+            return result
+
+        hog_mock.side_effect = lambda: slow('>HOG')
+        orth_mock.side_effect = lambda: slow('>orthologs')
+        finder = oma.OrthologFinder('MKAL')
+        finder.id = 'ARATH09528'
+        self.assertEqual(finder.get_HOGs_or_orthologs(speculative=True), '>HOG')
+        self.assertTrue('hogs' in finder.timings)
+
+    @patch('consScore.oma.OrthologFinder._find_orthologs')
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_speculative_discarded(self, hog_mock, find_mock):
+        """Tests that an ortholog query still running after the HOG won leaves the finder unchanged"""
+        started = threading.Event()
+        release = threading.Event()
+        finished = threading.Event()
+
+        def find():
+            started.set()
+            release.wait(5)
+            finished.set()
+            return 'OTHER00001', 'sequence', '>OTHER00001\nMKAL\n>MOUSE01234\nMKTL'
+
+        hog_mock.side_effect = lambda: started.wait(5) and '>HOG'
+        find_mock.side_effect = find
+        finder = oma.OrthologFinder('MKAL')
+        finder.id = 'ARATH09528'
+        self.assertEqual(finder.get_HOGs_or_orthologs(speculative=True), '>HOG')
+        self.assertFalse('orthologs_speculative' in finder.timings)
+        release.set()
+        self.assertTrue(finished.wait(5))
+        for attempt in range(100):
+            if 'orthologs_speculative' in finder.timings:
+                break
+            time.sleep(0.01)
+        self.assertEqual((finder.id, finder.orthologs, finder.has_run), ('ARATH09528', '', False))
+        self.assertFalse('orthologs' in finder.timings)
+        self.assertTrue(finder.timings['orthologs_speculative'] > 0)
+
+    @patch('consScore.oma.OrthologFinder.get_orthologs')
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_speculative_fallback(self, hog_mock, orth_mock):
+        """Tests that the speculative mode returns the orthologs when the HOG query fails, timing both"""
+        hog_mock.side_effect = exceptions.RequestException('Status code 404')
+        orth_mock.return_value = '>orthologs'
+        finder = oma.OrthologFinder('MKAL')
+        finder.id = 'ARATH09528'
+        self.assertEqual(finder.get_HOGs_or_orthologs(speculative=True), '>orthologs')
+        self.assertEqual(sorted(finder.timings), ['hogs', 'orthologs', 'orthologs_speculative'])
+
+    @patch('consScore.oma.OrthologFinder.get_orthologs')
+    @patch('consScore.oma.OrthologFinder.get_HOGs')
+    def test_not_speculative(self, hog_mock, orth_mock):
+        """Tests that without speculation the orthologs are not queried when the HOG is retrieved"""
+        hog_mock.return_value = '>HOG'
+        self.assertEqual(oma.OrthologFinder('MKAL').get_HOGs_or_orthologs(), '>HOG')
+        self.assertFalse(orth_mock.called)
+
+    @patch('oma.requests.Session.get')
+    def test_select_HOG_level(self, mock_get):
+        """Tests that select_HOG_level uses the first level whose member count fits the target range"""
+        sizes = {'Amniota': 900, 'Theria': 400, 'Primates': 120, 'Catarrhini': 60, 'Mus musculus': 2}
+
+        def answer(url, **kwargs):
+            if '/members/' in url:
+                level = url.split('level=')[1]
+                return MagicMock(status_code=200, content=bytes(json.dumps({'members': [{}] * sizes[level]}), 'utf-8'))
+            content = json.dumps([{'hog_id': 'HOG:1', 'level': 'Amniota', 'alternative_levels': list(sizes)}])
+            return MagicMock(status_code=200, content=bytes(content, 'utf-8'))
+
+        mock_get.side_effect = answer
+        finder = oma.OrthologFinder('MKAL', target_size=(50, 300))
+        finder.id = 'HUMAN27610'
+        self.assertEqual(finder.select_HOG_level(), 'Primates')
+        self.assertEqual(finder.hog_size, 120)
+        self.assertEqual(finder.level_sizes, {'Amniota': 900, 'Theria': 400, 'Primates': 120})
+        members = [call[0][0] for call in mock_get.call_args_list if '/members/' in call[0][0]]
+        self.assertEqual(len(members), 3)
+        self.assertTrue(all('/api/hog/HUMAN27610/members/' in url for url in members))
+        self.assertEqual(finder.select_HOG_level((1000, 2000)), 'Amniota')
+        self.assertEqual(finder.select_HOG_level((1, 1)), 'Mus musculus')
+
+    @patch('oma.requests.Session.get')
+    def test_select_HOG_level_small_root(self, mock_get):
+        """Tests that the other levels are not counted when the deepest level is already small enough"""
+        mock_get().status_code = 200
+        mock_get().content = self.lvlresponse
+        finder = oma.OrthologFinder('MKAL', target_size=(50, 300))
+        finder.id = 'HUMAN27610'
+        finder.count_HOG_members = MagicMock(return_value=30)
+        self.assertEqual(finder.select_HOG_level(), 'Amniota')
+        self.assertEqual(finder.count_HOG_members.call_count, 1)
+
 if __name__ == '__main__':
     biskit.test.localTest()
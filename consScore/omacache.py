@@ -0,0 +1,203 @@
+"""
+A two-tier cache for the responses of the OMA browser. Responses are content addressed- the key is a hash of the
+endpoint and the query (for example the protein sequence), and the value is the text that OMA returned. Lookups
+go to a small in-process LRU first, and then to an sqlite file on disk, so that the results survive between runs.
+
+Both tiers are bounded by the total size of the stored responses, which range from a few kilobytes for an id to
+several megabytes for the fasta of a large HOG, and the least recently used responses are evicted first.
+
+Entries are tied to an OMA release. Entries stored under a different release than the one the cache is opened
+with are dropped, so updating the release invalidates the whole cache.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+#: A reasonable place for the on-disk cache, if the caller does not care where it goes
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'consScore', 'oma_responses.sqlite')
+
+
+def _size(value):
+    return len(value.encode('utf-8'))
+
+
+def cache_key(endpoint, *parts):
+    """
+    Builds the content addressed key of a query
+    Args:
+        endpoint(str): The name of the OMA query, such as 'sequence' or 'hog_fasta'
+        parts(str): The values that identify the query, such as the protein sequence
+    Returns:
+        The sha256 hexdigest of the endpoint and the parts
+    """
+    digest = hashlib.sha256(endpoint.encode('utf-8'))
+    for part in parts:
+        digest.update(b'\0')
+        digest.update(str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Stores the responses of the OMA browser in memory and, if a path is given, on disk.
+    """
+
+    def __init__(self, path=None, release=None, ttl=30 * 24 * 3600, max_bytes=512 * 1024 * 1024, memory_entries=512,
+                 memory_bytes=None):
+        """
+        Args:
+            path(str): The sqlite file that holds the cache on disk. If None, the cache is only kept in memory
+            release(str): The OMA release that the stored responses belong to. Entries of other releases are misses
+            ttl(float): Number of seconds an entry stays valid. None means entries never expire
+            max_bytes(int): Largest total size in bytes of the responses kept on disk. The least recently used are
+                evicted first
+            memory_entries(int): Largest number of entries kept in the in-process LRU
+            memory_bytes(int): Largest total size in bytes of the responses kept in the in-process LRU. Responses
+                larger than this are only kept on disk. Defaults to an eighth of max_bytes
+        """
+        self.path = path
+        self.release = release or ''
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.memory_bytes = max_bytes // 8 if memory_bytes is None else memory_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.RLock()
+        self._db = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(responses)')]
+            if columns and 'size' not in columns:
+                # A cache written before sizes were recorded cannot be bounded, and is started again
+                self._db.execute('DROP TABLE responses')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+                             'release TEXT, created REAL, accessed REAL, size INTEGER, value TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS accessed_index ON responses (accessed)')
+            self._db.execute('DELETE FROM responses WHERE release != ?', (self.release,))
+            self._db.commit()
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, endpoint, *parts):
+        """
+        Returns the cached response of the query, or None if there is no valid entry for it
+        """
+        key = cache_key(endpoint, *parts)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._forget(key)
+            if self._db is not None:
+                row = self._db.execute('SELECT release, created, value FROM responses WHERE key = ?',
+                                       (key,)).fetchone()
+                if row is not None:
+                    release, created, value = row
+                    if release == self.release and not self._expired(created):
+                        self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+                        self._db.commit()
+                        self._remember(key, created, value)
+                        self.hits += 1
+                        return value
+                    self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, endpoint, value, *parts):
+        """
+        Stores the response of the query
+        Args:
+            endpoint(str): The name of the OMA query
+            value(str): The response of OMA
+            parts(str): The values that identify the query
+        """
+        key = cache_key(endpoint, *parts)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (key, endpoint, self.release, now, now, _size(value), value))
+                self._evict()
+                self._db.commit()
+
+    def _remember(self, key, created, value):
+        self._forget(key)
+        size = _size(value)
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = (created, value, size)
+        self._memory_size += size
+        while len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes:
+            self._memory_size -= self._memory.popitem(last=False)[1][2]
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= entry[2]
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+        if self.size() > self.max_bytes:
+            # Keeps the most recently used responses whose sizes add up to at most max_bytes
+            self._db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER '
+                             '(ORDER BY accessed DESC, rowid DESC) AS total FROM responses) WHERE total > ?)',
+                             (self.max_bytes,))
+
+    def size(self):
+        """
+        Returns the total size in bytes of the responses stored on disk, or in memory if there is no file
+        """
+        with self._lock:
+            if self._db is not None:
+                return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            return self._memory_size
+
+    def memory_size(self):
+        """
+        Returns the total size in bytes of the responses kept in the in-process LRU
+        """
+        with self._lock:
+            return self._memory_size
+
+    def __len__(self):
+        with self._lock:
+            if self._db is not None:
+                return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return len(self._memory)
+
+    def clear(self):
+        """
+        Deletes every entry of the cache, in memory and on disk
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def close(self):
+        """
+        Closes the connection to the file on disk. The in-memory entries are kept
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for omacache
+"""
+import biskit.test
+import os
+import shutil
+import tempfile
+from consScore import omacache
+
+
+class TestCache(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the omacache module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'responses.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_key(self):
+        """Tests that the key depends on both the endpoint and the query"""
+        self.assertEqual(omacache.cache_key('sequence', 'MKAL'), omacache.cache_key('sequence', 'MKAL'))
+        self.assertNotEqual(omacache.cache_key('sequence', 'MKAL'), omacache.cache_key('hog', 'MKAL'))
+        self.assertNotEqual(omacache.cache_key('hog_fasta', 'a', 'bc'), omacache.cache_key('hog_fasta', 'ab', 'c'))
+
+    def test_memory_only(self):
+        """Tests that a cache without a path stores and retrieves responses"""
+        cache = omacache.ResponseCache()
+        self.assertIsNone(cache.get('sequence', 'MKAL'))
+        cache.put('sequence', 'ARATH09528', 'MKAL')
+        self.assertEqual(cache.get('sequence', 'MKAL'), 'ARATH09528')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_persistent(self):
+        """Tests that responses stored on disk are found by a new cache opened on the same file"""
+        cache = omacache.ResponseCache(self.path, release='Jun 2018')
+        cache.put('hog_fasta', '>HUMAN1\nMKAL', 'HUMAN1', 'Amniota')
+        cache.close()
+        reopened = omacache.ResponseCache(self.path, release='Jun 2018')
+        self.assertEqual(reopened.get('hog_fasta', 'HUMAN1', 'Amniota'), '>HUMAN1\nMKAL')
+        reopened.close()
+
+    def test_release_invalidates(self):
+        """Tests that entries from another OMA release are not returned"""
+        cache = omacache.ResponseCache(self.path, release='Jun 2018')
+        cache.put('sequence', 'ARATH09528', 'MKAL')
+        cache.close()
+        reopened = omacache.ResponseCache(self.path, release='Dec 2018')
+        self.assertIsNone(reopened.get('sequence', 'MKAL'))
+        self.assertEqual(len(reopened), 0)
+        reopened.close()
+
+    def test_ttl(self):
+        """Tests that expired entries are treated as missing"""
+        cache = omacache.ResponseCache(self.path, ttl=-1)
+        cache.put('sequence', 'ARATH09528', 'MKAL')
+        self.assertIsNone(cache.get('sequence', 'MKAL'))
+        cache.close()
+
+    def test_size_eviction(self):
+        """Tests that the least recently used entries are evicted once the responses exceed the size limit"""
+        cache = omacache.ResponseCache(self.path, max_bytes=1000, memory_entries=1)
+        cache.put('sequence', 'A' * 400, 'first')
+        cache.put('sequence', 'B' * 400, 'second')
+        cache.get('sequence', 'first')
+        self.assertEqual(cache.size(), 800)
+        cache.put('hog_fasta', 'C' * 300, 'third')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size(), 700)
+        self.assertEqual(cache.get('sequence', 'first'), 'A' * 400)
+        self.assertIsNone(cache.get('sequence', 'second'))
+        cache.put('hog_fasta', 'D' * 2000, 'large')
+        self.assertLessEqual(cache.size(), 1000)
+        cache.close()
+
+    def test_memory_size(self):
+        """Tests that the in-process LRU is bounded by the size of the responses, not only by their number"""
+        cache = omacache.ResponseCache(self.path, max_bytes=10000, memory_bytes=1000)
+        for index in range(5):
+            cache.put('hog_fasta', str(index) * 400, 'HUMAN%d' % index)
+            self.assertLessEqual(cache.memory_size(), 1000)
+        self.assertEqual(cache.memory_size(), 800)
+        cache.put('hog_fasta', 'L' * 2000, 'large')
+        self.assertEqual(cache.memory_size(), 800)
+        self.assertEqual(cache.get('hog_fasta', 'large'), 'L' * 2000)
+        self.assertEqual(cache.get('hog_fasta', 'HUMAN0'), '0' * 400)
+        self.assertEqual(cache.memory_size(), 800)
+        self.assertEqual(cache.size(), 4000)
+        cache.close()
+        memory = omacache.ResponseCache(max_bytes=8000)
+        for index in range(5):
+            memory.put('hog_fasta', str(index) * 400, 'HUMAN%d' % index)
+        self.assertEqual(memory.size(), 800)
+        self.assertIsNone(memory.get('hog_fasta', 'HUMAN0'))
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -0,0 +1,167 @@
+"""
+A local, offline stand-in for the OMA browser, built from the bulk export files of OMA. The export files are read
+once into an indexed sqlite store, which can then answer the queries made by OrthologFinder- sequence to OMA id,
+HOG levels, HOG fasta and ortholog fasta- without any network access.
+
+The store is built from:
+    sequences: The protein sequences, in fasta format (oma-seqs.fa). The first word of each header is the OMA id.
+    hogs: The HOG membership, as tab separated lines of OMA id, HOG id and taxonomic level. A protein has one line
+        for each level that its HOG spans.
+    pairs: Optional. The pairwise orthologs (oma-pairs.txt), as tab separated lines starting with the two OMA ids.
+Any of the files may be gzipped. Lines starting with # are ignored.
+
+Usage:
+    store = LocalOMA.build('oma.sqlite', 'oma-seqs.fa.gz', 'oma-hogs.tsv.gz', pairs='oma-pairs.txt.gz')
+    finder = oma.OrthologFinder(sequence, backend=store)
+"""
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+from consScore import fasta
+
+
+def sequence_hash(sequence):
+    """
+    Returns the hash used to look up a protein by its sequence. Case and whitespace are ignored
+    """
+    sequence = ''.join(sequence.split()).upper()
+    return hashlib.sha1(sequence.encode('utf-8')).hexdigest()
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def _read_table(handle):
+    for line in handle:
+        if line.startswith('#') or not line.strip():
+            continue
+        yield line.rstrip('\n').split('\t')
+
+
+class LocalOMA:
+    """
+    Answers the OMA queries of OrthologFinder from a local sqlite store
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path(str): The sqlite store, as made by LocalOMA.build
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError('No local OMA store at {0}'.format(path))
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, path, sequences, hogs, pairs=None, batch_size=10000):
+        """
+        Reads the OMA export files into a new sqlite store. An existing store at path is replaced.
+        Args:
+            path(str): Where the store is written
+            sequences(str): Path to the protein sequences, in fasta format
+            hogs(str): Path to the HOG membership table
+            pairs(str): Path to the pairwise orthologs table
+            batch_size(int): Number of rows inserted at a time
+        Returns:
+            A LocalOMA object reading from the new store
+        """
+        if os.path.isfile(path):
+            os.remove(path)
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE proteins (omaid TEXT PRIMARY KEY, seqhash TEXT, header TEXT, sequence TEXT)')
+        db.execute('CREATE TABLE hogs (omaid TEXT, hog TEXT, level TEXT)')
+        db.execute('CREATE TABLE pairs (omaid TEXT, ortholog TEXT)')
+
+        def insert(statement, rows):
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    db.executemany(statement, batch)
+                    batch = []
+            if batch:
+                db.executemany(statement, batch)
+
+        with _open(sequences) as handle:
+            insert('INSERT OR REPLACE INTO proteins VALUES (?, ?, ?, ?)',
+                   ((r.id, sequence_hash(r.sequence), r.header, r.sequence) for r in fasta.parse(handle)))
+        with _open(hogs) as handle:
+            insert('INSERT INTO hogs VALUES (?, ?, ?)', (tuple(r[:3]) for r in _read_table(handle)))
+        if pairs:
+            with _open(pairs) as handle:
+                rows = ((r[0], r[1]) for r in _read_table(handle))
+                insert('INSERT INTO pairs VALUES (?, ?)', (p for r in rows for p in (r, r[::-1])))
+        db.execute('CREATE INDEX proteins_seqhash ON proteins (seqhash)')
+        db.execute('CREATE INDEX hogs_omaid ON hogs (omaid, level)')
+        db.execute('CREATE INDEX hogs_hog ON hogs (hog, level)')
+        db.execute('CREATE INDEX pairs_omaid ON pairs (omaid)')
+        db.commit()
+        db.close()
+        return cls(path)
+
+    def _query(self, statement, parameters):
+        with self._lock:
+            return self._db.execute(statement, parameters).fetchall()
+
+    def protein_id(self, sequence):
+        """
+        Returns the OMA id of the protein with exactly the given sequence, or None if there is no such protein
+        """
+        rows = self._query('SELECT omaid FROM proteins WHERE seqhash = ? ORDER BY omaid LIMIT 1',
+                           (sequence_hash(sequence),))
+        return rows[0][0] if rows else None
+
+    def hog_levels(self, omaid):
+        """
+        Returns the taxonomic levels that the HOG of the protein spans, together with the member count of the HOG
+        at each level, as a list of (level, count) tuples ordered from the largest HOG to the smallest
+        """
+        return self._query('SELECT h.level, COUNT(m.omaid) FROM hogs h JOIN hogs m ON m.hog = h.hog AND '
+                           'm.level = h.level WHERE h.omaid = ? GROUP BY h.level ORDER BY COUNT(m.omaid) DESC, '
+                           'h.level', (omaid,))
+
+    def hog_fasta(self, omaid, level):
+        """
+        Returns the members of the HOG of the protein at the given level, as a fasta string, or None if the
+        protein has no HOG at that level
+        """
+        rows = self._query('SELECT p.header, p.sequence FROM hogs h JOIN hogs m ON m.hog = h.hog AND '
+                           'm.level = h.level JOIN proteins p ON p.omaid = m.omaid WHERE h.omaid = ? AND '
+                           'h.level = ? ORDER BY p.omaid', (omaid, level))
+        if not rows:
+            return None
+        return '\n'.join('>{0}\n{1}'.format(header, sequence) for header, sequence in rows)
+
+    def ortholog_ids(self, omaid):
+        """
+        Returns the OMA ids of the pairwise orthologs of the protein
+        """
+        return [r[0] for r in self._query('SELECT ortholog FROM pairs WHERE omaid = ? ORDER BY ortholog',
+                                          (omaid,))]
+
+    def ortholog_fasta(self, omaid):
+        """
+        Returns the protein followed by its pairwise orthologs as a fasta string, in the layout of the OMA browser,
+        or None if the protein has no orthologs
+        """
+        rows = self._query('SELECT header, sequence FROM proteins WHERE omaid = ? UNION ALL SELECT * FROM '
+                           '(SELECT p.header, p.sequence FROM pairs o JOIN proteins p ON p.omaid = o.ortholog '
+                           'WHERE o.omaid = ? ORDER BY p.omaid)', (omaid, omaid))
+        if len(rows) < 2:
+            return None
+        return '\n'.join('>{0}\n{1}'.format(header, sequence) for header, sequence in rows)
+
+    def close(self):
+        """
+        Closes the connection to the store
+        """
+        with self._lock:
+            self._db.close()
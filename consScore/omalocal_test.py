@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for omalocal, using a small synthetic OMA export
+"""
+import biskit.test
+import gzip
+import os
+import shutil
+import tempfile
+from consScore import oma
+from consScore import omalocal
+from requests import exceptions
+
+SEQUENCES = """>HUMAN00001 | ATN1 | [Homo sapiens]
+MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGGVSTSSSDGKAEKSRQTAKKARVE
+EASTPKVNKQ
+>MOUSE00001 | Atn1 | [Mus musculus]
+MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGGVSTSSSDGKAEKSRQTAKKARVD
+>CHICK00001 | ATN1 | [Gallus gallus]
+MKTRQNKDSMSMRSGRKKEAPGPRDELRSR
+>DANRE00001 | atn1a | [Danio rerio]
+MKTRQNKESMSMRSGRKKEAPG
+"""
+
+HOGS = """# omaid\thog\tlevel
+HUMAN00001\tHOG:0001.1a\tMammalia
+MOUSE00001\tHOG:0001.1a\tMammalia
+HUMAN00001\tHOG:0001\tAmniota
+MOUSE00001\tHOG:0001\tAmniota
+CHICK00001\tHOG:0001\tAmniota
+"""
+
+PAIRS = """HUMAN00001\tMOUSE00001\t1:1
+HUMAN00001\tDANRE00001\t1:n
+"""
+
+
+class TestLocalOMA(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the omalocal module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        sequences = os.path.join(cls.directory, 'oma-seqs.fa.gz')
+        with gzip.open(sequences, 'wt') as file:
+            file.write(SEQUENCES)
+        hogs = os.path.join(cls.directory, 'oma-hogs.tsv')
+        with open(hogs, 'w') as file:
+            file.write(HOGS)
+        pairs = os.path.join(cls.directory, 'oma-pairs.txt')
+        with open(pairs, 'w') as file:
+            file.write(PAIRS)
+        cls.store = omalocal.LocalOMA.build(os.path.join(cls.directory, 'oma.sqlite'), sequences, hogs, pairs)
+        cls.human = ('MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGGVSTSSSDGKAEKSRQTAKKARVE'
+                     'EASTPKVNKQ')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store.close()
+        shutil.rmtree(cls.directory)
+
+    def test_protein_id(self):
+        """Tests that a protein is found by its sequence, ignoring case and line breaks"""
+        self.assertEqual(self.store.protein_id(self.human.lower()), 'HUMAN00001')
+        self.assertIsNone(self.store.protein_id('MKAL'))
+
+    def test_hog_levels(self):
+        """Tests that the levels are listed from the largest HOG to the smallest"""
+        self.assertEqual(self.store.hog_levels('HUMAN00001'), [('Amniota', 3), ('Mammalia', 2)])
+
+    def test_hog_fasta(self):
+        """Tests that the HOG fasta contains exactly the members of the HOG at that level"""
+        fasta = self.store.hog_fasta('MOUSE00001', 'Mammalia')
+        self.assertTrue('>HUMAN00001 | ATN1 | [Homo sapiens]' in fasta)
+        self.assertFalse('CHICK00001' in fasta)
+        self.assertIsNone(self.store.hog_fasta('DANRE00001', 'Amniota'))
+
+    def test_ortholog_fasta(self):
+        """Tests that the ortholog fasta starts with the protein, followed by its orthologs"""
+        fasta = self.store.ortholog_fasta('HUMAN00001')
+        self.assertTrue(fasta.startswith('>HUMAN00001'))
+        self.assertTrue('DANRE00001' in fasta)
+        self.assertEqual(self.store.ortholog_ids('MOUSE00001'), ['HUMAN00001'])
+
+    def test_finder_HOGs(self):
+        """Tests that OrthologFinder retrieves the HOG from the local store, without the input protein"""
+        finder = oma.OrthologFinder(self.human, backend=self.store)
+        hogs = finder.get_HOGs()
+        self.assertEqual(finder.id, 'HUMAN00001')
+        self.assertEqual(finder.hog_level, 'Amniota')
+        self.assertTrue('MOUSE00001' in hogs and 'CHICK00001' in hogs)
+        self.assertFalse('HUMAN00001' in hogs)
+
+    def test_finder_orthologs(self):
+        """Tests that OrthologFinder retrieves the orthologs from the local store"""
+        finder = oma.OrthologFinder(self.human, backend=self.store)
+        orthologs = finder.get_orthologs()
+        self.assertTrue('DANRE00001' in orthologs)
+
+    def test_finder_target_size(self):
+        """Tests that OrthologFinder picks the HOG level from the member counts of the local store"""
+        finder = oma.OrthologFinder(self.human, backend=self.store, target_size=(1, 2))
+        hogs = finder.get_HOGs()
+        self.assertEqual((finder.hog_level, finder.hog_size), ('Mammalia', 2))
+        self.assertFalse('CHICK00001' in hogs)
+
+    def test_finder_missing(self):
+        """Tests that a sequence missing from the store raises the same exception as a failed query"""
+        finder = oma.OrthologFinder('MKALIVLGLV', backend=self.store)
+        with self.assertRaises(exceptions.RequestException):
+            finder.get_HOGs()
+
+if __name__ == '__main__':
+    biskit.test.localTest()
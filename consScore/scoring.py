@@ -0,0 +1,206 @@
+"""
+Conservation scores computed directly from an alignment with NumPy, as a fast alternative to Rate4Site when
+Bayesian rates are not needed, for example to triage many proteins. Each column is scored from the frequencies of
+the amino acids in it, weighted so that groups of near identical sequences do not dominate the score.
+
+Methods:
+    entropy: One minus the Shannon entropy of the column, divided by the largest possible entropy
+    jsd: The Jensen-Shannon divergence between the column and the background amino acid frequencies
+
+Both scores run from 0 to 1, and unlike the Rate4Site score, a higher value means a more conserved column.
+
+Citations
+Capra, J.A. and Singh, M. 2007. Predicting functionally important residues from sequence conservation.
+Bioinformatics 23: 1875-1882.
+
+Henikoff, S. and Henikoff, J.G. 1994. Position-based sequence weights. J Mol Biol 243: 574-578.
+"""
+
+import numpy as np
+from biskit import ProfileCollection
+from biskit.errors import BiskitError
+from consScore.alignment import Alignment
+
+#: The amino acids scored. Any other character, such as a gap or an X, counts as a gap
+AMINO_ACIDS = 'ARNDCQEGHILKMFPSTWYV'
+
+#: The background frequencies of the amino acids, in the order of AMINO_ACIDS, from the BLOSUM62 data
+BLOSUM62_BACKGROUND = np.array([0.074, 0.052, 0.045, 0.054, 0.025, 0.034, 0.054, 0.074, 0.026, 0.068, 0.099,
+                                0.058, 0.025, 0.047, 0.039, 0.057, 0.051, 0.013, 0.032, 0.073])
+
+#: The scoring methods that can be chosen
+METHODS = ('entropy', 'jsd')
+
+#: Added to each amino acid frequency so that no frequency is zero
+PSEUDOCOUNT = 1e-7
+
+_CODES = np.full(256, len(AMINO_ACIDS), dtype=np.intp)
+_CODES[np.frombuffer(AMINO_ACIDS.encode('ascii'), dtype=np.uint8)] = np.arange(len(AMINO_ACIDS))
+_CODES[np.frombuffer(AMINO_ACIDS.lower().encode('ascii'), dtype=np.uint8)] = np.arange(len(AMINO_ACIDS))
+
+
+class ScoringError(BiskitError):
+    pass
+
+
+def _symbols(msa):
+    return _CODES[msa.matrix]
+
+
+def _counts(symbols, weights=None):
+    counts = np.empty((len(AMINO_ACIDS) + 1, symbols.shape[1]))
+    for symbol in range(len(AMINO_ACIDS) + 1):
+        matches = symbols == symbol
+        counts[symbol] = matches.sum(axis=0) if weights is None else weights @ matches
+    return counts
+
+
+def henikoff_weights(msa):
+    """
+    Returns the position based weight of each sequence of the alignment. At each column, every different symbol
+    gets an equal share, divided equally among the sequences that have it. Gaps count as a symbol
+    Args:
+        msa(Alignment): The alignment
+    Returns:
+        An array of one weight for each sequence, adding up to 1
+    """
+    if not len(msa):
+        return np.zeros(0)
+    symbols = _symbols(msa)
+    counts = _counts(symbols)
+    kinds = (counts > 0).sum(axis=0)
+    shares = counts[symbols, np.arange(symbols.shape[1])] * kinds
+    weights = (1.0 / shares).sum(axis=1)
+    return weights / weights.sum()
+
+
+def column_frequencies(msa, weights=None):
+    """
+    Returns the frequencies of the amino acids in each column, ignoring gaps, and the fraction of gaps in each column
+    Args:
+        msa(Alignment): The alignment
+        weights(numpy.ndarray): The weight of each sequence. If None, every sequence has the same weight
+    Returns:
+        An array with one row for each of AMINO_ACIDS and one column for each alignment column, and an array of the
+        gap fraction of each column
+    """
+    if weights is None:
+        weights = np.full(len(msa), 1.0 / len(msa)) if len(msa) else np.zeros(0)
+    counts = _counts(_symbols(msa), weights)
+    gaps = counts[-1]
+    frequencies = counts[:-1] + PSEUDOCOUNT
+    return frequencies / frequencies.sum(axis=0), gaps
+
+
+def shannon_entropy(frequencies):
+    """
+    Returns one minus the Shannon entropy of each column, divided by the largest possible entropy, so that a column
+    of a single amino acid scores 1
+    """
+    entropy = -(frequencies * np.log2(frequencies)).sum(axis=0)
+    return 1 - entropy / np.log2(len(AMINO_ACIDS))
+
+
+def jensen_shannon(frequencies, background=BLOSUM62_BACKGROUND):
+    """
+    Returns the Jensen-Shannon divergence, in bits, between the amino acid frequencies of each column and the
+    background frequencies
+    """
+    background = np.asarray(background, dtype=float)
+    background = (background / background.sum())[:, np.newaxis]
+    middle = (frequencies + background) / 2
+    divergence = (frequencies * np.log2(frequencies / middle)).sum(axis=0) + \
+        (background * np.log2(background / middle)).sum(axis=0)
+    return divergence / 2
+
+
+def score_columns(msa, method='jsd', weighted=True, gap_penalty=True, background=BLOSUM62_BACKGROUND):
+    """
+    Scores the conservation of every column of an alignment
+    Args:
+        msa(Alignment): The alignment
+        method(str): One of METHODS
+        weighted(Boolean): If true, the sequences are given Henikoff weights
+        gap_penalty(Boolean): If true, each score is multiplied by the fraction of the (weighted) sequences that
+            do not have a gap in the column
+        background(numpy.ndarray): The background frequencies used by jsd, in the order of AMINO_ACIDS
+    Returns:
+        An array of the score of each column
+    """
+    if method not in METHODS:
+        raise ScoringError('Unknown scoring method {0}. Choose one of {1}'.format(method, ', '.join(METHODS)))
+    weights = henikoff_weights(msa) if weighted else None
+    frequencies, gaps = column_frequencies(msa, weights)
+    if method == 'entropy':
+        scores = shannon_entropy(frequencies)
+    else:
+        scores = jensen_shannon(frequencies, background)
+    if gap_penalty:
+        scores = scores * (1 - gaps)
+    return scores
+
+
+class ConservationScorer:
+    """
+    Scores the residues of the first sequence of an alignment, and returns the scores in the same dictionary or
+    ProfileCollection as Rate4Site. The QQ interval and the standard deviation of Rate4Site have no equivalent here
+    """
+
+    def __init__(self, msa, method='jsd', profile=True, identity=True, score=True, gapped=False, weighted=True,
+                 gap_penalty=True):
+        """
+        Args:
+            msa: The path to the alignment file, or an Alignment object
+            method(str): One of METHODS
+            profile(Boolean): If true, the scores are returned in a ProfileCollection, otherwise in a dictionary
+            If the following parameters are true, the scores contain that information, in the order of the arguments
+                identity (boolean): The identity of the amino acid (Single letter code) at each position
+                score(boolean): The conservation scores. Higher value = higher conservation
+                gapped(boolean): The number of aligned sequences having an amino acid (non-gapped) from the overall
+                    number of sequences at each position
+            weighted(Boolean): If true, the sequences are given Henikoff weights
+            gap_penalty(Boolean): If true, scores of gapped columns are lowered by their gap fraction
+        """
+        self.msa = msa if isinstance(msa, Alignment) else Alignment.read(msa)
+        self.method = method
+        self.profile = profile
+        self.identity = identity
+        self.score = score
+        self.gapped = gapped
+        self.weighted = weighted
+        self.gap_penalty = gap_penalty
+        self.num_sequences = len(self.msa)
+        self.alpha = None
+        self.result = None
+
+    def run(self):
+        """
+        Scores the alignment
+        Returns:
+            A dictionary or a ProfileCollection, as Rate4Site.run returns them
+        """
+        columns = self.msa.columns()
+        scores = score_columns(self.msa, method=self.method, weighted=self.weighted,
+                               gap_penalty=self.gap_penalty)[columns]
+        residues = self.msa.matrix[self.msa.reference, columns].tobytes().decode('ascii')
+        filled = len(self.msa) - self.msa.gaps[:, columns].sum(axis=0)
+        if self.profile:
+            self.result = ProfileCollection()
+            if self.identity:
+                self.result.set('Amino Acid', list(residues), asarray=2)
+            if self.score:
+                self.result.set('Conservation Score', scores.tolist(), asarray=2)
+            if self.gapped:
+                self.result.set('Gapped', (filled / self.num_sequences).tolist())
+        else:
+            self.result = {}
+            for i in range(len(columns)):
+                row = []
+                if self.identity:
+                    row.append(residues[i])
+                if self.score:
+                    row.append(float(scores[i]))
+                if self.gapped:
+                    row.append('%d/%d' % (filled[i], self.num_sequences))
+                self.result[i] = tuple(row)
+        return self.result
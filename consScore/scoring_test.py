@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for scoring
+"""
+import biskit.test
+import os
+import numpy as np
+from consScore import scoring
+from consScore.alignment import Alignment
+
+ALIGNED = (">A\n"
+           "MKW-L\n"
+           ">B\n"
+           "MKW-I\n"
+           ">C\n"
+           "MKWDV\n"
+           ">D\n"
+           "MRF-A\n")
+
+
+class TestScoring(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the scoring module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.msa = Alignment.parse(ALIGNED)
+
+    def test_henikoff_weights(self):
+        """Tests that the odd one out sequence gets the largest weight, and that the weights add up to 1"""
+        weights = scoring.henikoff_weights(self.msa)
+        self.assertAlmostEqual(weights.sum(), 1)
+        self.assertEqual(int(np.argmax(weights)), 3)
+        self.assertAlmostEqual(weights[0], weights[1])
+
+    def test_column_frequencies(self):
+        """Tests the amino acid frequencies and gap fraction of the columns"""
+        frequencies, gaps = scoring.column_frequencies(self.msa)
+        self.assertAlmostEqual(frequencies[scoring.AMINO_ACIDS.index('M'), 0], 1, places=4)
+        self.assertAlmostEqual(frequencies[scoring.AMINO_ACIDS.index('K'), 1], 0.75, places=4)
+        self.assertEqual(list(gaps), [0, 0, 0, 0.75, 0])
+
+    def test_entropy(self):
+        """Tests that an invariant column scores 1 and a variable one scores lower"""
+        scores = scoring.score_columns(self.msa, method='entropy', weighted=False)
+        self.assertAlmostEqual(scores[0], 1, places=4)
+        self.assertTrue(scores[0] > scores[1] > scores[4])
+        self.assertTrue(scores[3] < 0.5)
+
+    def test_jsd(self):
+        """Tests that the divergence from the background ranks conserved columns first"""
+        scores = scoring.score_columns(self.msa, method='jsd')
+        self.assertTrue(all(0 <= s <= 1 for s in scores))
+        self.assertTrue(scores[2] > scores[4])
+        self.assertTrue(scores[0] > scores[4])
+
+    def test_unknown_method(self):
+        """Tests that an unknown method raises an error"""
+        with self.assertRaises(scoring.ScoringError):
+            scoring.score_columns(self.msa, method='rate4site')
+
+    def test_scorer_dict(self):
+        """Tests that the scorer gives one entry for each residue of the first sequence, as Rate4Site does"""
+        result = scoring.ConservationScorer(self.msa, profile=False, gapped=True).run()
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0][0], 'M')
+        self.assertEqual(result[3][0], 'L')
+        self.assertEqual(result[3][2], '4/4')
+        self.assertTrue(isinstance(result[1][1], float))
+
+    def test_scorer_profile(self):
+        """Tests that the scorer fills a ProfileCollection with the profiles of Rate4Site"""
+        path = os.path.join(os.path.dirname(__file__), 'example_data', 'atn1seq.aln')
+        result = scoring.ConservationScorer(path, method='entropy', gapped=True).run()
+        self.assertEqual(len(result['Conservation Score']), len(result['Amino Acid']))
+        self.assertTrue(all(0 < g <= 1 for g in result['Gapped']))
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -8,8 +8,13 @@ Created on Thurs Sept 13 2018
 
 import biskit.test
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from consScore import aminoCons
+from consScore import fasta
 from consScore import seq2conservation as sq
+from consScore.alignment import Alignment
 from requests import exceptions
 from unittest.mock import patch
 
@@ -27,7 +32,7 @@ class Test(biskit.test.BiskitTest):
 
         with open((os.getcwd()+os.sep+'example_data'+os.sep+'CDC48Aseq.txt'), 'r') as file:
             arabidopsisCDC48A = file.read()
-        cls.CDC48A = sq.ConservationPipe(arabidopsisCDC48A, cache=False)
+        cls.CDC48A = sq.ConservationPipe(arabidopsisCDC48A, cache=False, workdir=cls.cwd)
 
         with open((os.getcwd()+os.sep+'example_data'+os.sep+'multiFasta.fasta'), 'r') as file:
             cls.ex_seq = file.read()
@@ -91,6 +96,159 @@ class Test(biskit.test.BiskitTest):
         self.assertTrue(mock_hog.called)
         self.assertTrue(type(tester), dict)
 
+    @patch('consScore.seq2conservation.ConservationPipe.run_pipe')
+    def test_pipe_coalesced(self, mock_run):
+        """tests that coalesced pipes of the same sequence share a single run, and pipes scoring otherwise do not"""
+        mock_run.return_value = {0: ('A', 0.6979)}
+        sq.remember_results(8)
+        try:
+            first = sq.ConservationPipe('>first\nMKALIVLGLVAAA', name='first', cache=False, coalesce=True)
+            twin = sq.ConservationPipe('>first\nMKALIVLGLVAAA', name='first', cache=False, coalesce=True)
+            self.assertEqual(first.pipe(), twin.pipe())
+            self.assertEqual(mock_run.call_count, 1)
+            self.assertIsNot(first.scores, twin.scores)
+            sq.ConservationPipe('>other\nMKALIVLGLVAAA', name='second', cache=False, coalesce=True).pipe()
+            sq.ConservationPipe('>first\nMKALIVLGLVAAA', workdir='other', cache=False, coalesce=True).pipe()
+            self.assertEqual(mock_run.call_count, 1)
+            sq.ConservationPipe('>first\nMKALIVLGLVAAA', name='first', qqint=True, cache=False, coalesce=True).pipe()
+            sq.ConservationPipe('>first\nMKALIVLGLVAAA', name='first', method='jsd', cache=False,
+                                coalesce=True).pipe()
+            sq.ConservationPipe('>first\nMKALIVLGLVAAA', name='first').pipe()
+            self.assertEqual(mock_run.call_count, 4)
+        finally:
+            sq.remember_results(0)
+        sq.ConservationPipe('>first\nMKALIVLGLVAAA', name='first', cache=False, coalesce=True).pipe()
+        self.assertEqual(mock_run.call_count, 5)
+
+    @patch('consScore.seq2conservation.oma.OrthologFinder')
+    @patch('consScore.seq2conservation.aminoCons.build_alignment')
+    def test_pipe_coalesced_names(self, mock_aln, mock_finder):
+        """tests that pipes of the same sequence under other names and workdirs share one alignment"""
+        mock_finder.return_value.get_HOGs_or_orthologs.return_value = self.ex_seq
+        mock_finder.return_value.has_run_hogs = False
+        example = os.getcwd() + os.sep + 'example_data' + os.sep + 'atn1seq.aln'
+
+        def align(orthologs, profile=None, cwd=None):
+            path = os.path.join(cwd, os.path.basename(orthologs).split('.')[0] + '.aln')
+            shutil.copy(example, path)
+            aminoCons.record_strategy(path, 'FFT-NS-2', '--retree 2', 2, 10)
+            return path
+        mock_aln.side_effect = align
+        directory = tempfile.mkdtemp()
+        sq.remember_results(8)
+        try:
+            pipes = [sq.ConservationPipe('>%s\nMKALIVLGLVAAA' % name, name=name, method='jsd', coalesce=True,
+                                         workdir=os.path.join(directory, name)) for name in ('first', 'second')]
+            pipes[0].pipe()
+            self.assertTrue(pipes[1].pipe() is not None)
+            self.assertIsNot(pipes[1].scores, pipes[0].scores)
+            self.assertEqual(mock_aln.call_count, 1)
+            self.assertEqual(sorted(os.listdir(pipes[1].workdir)), ['second.aln', 'second.strategy'])
+            self.assertEqual(Alignment.read(pipes[1].alignment).ids, Alignment.read(example).ids)
+            self.assertEqual(aminoCons.read_strategy(pipes[1].alignment)['strategy'], 'FFT-NS-2')
+        finally:
+            sq.remember_results(0)
+            shutil.rmtree(directory)
+
+    def test_call_scores(self):
+        """tests that a scoring method other than rate4site is used instead of calling Rate4Site"""
+        pipe = sq.ConservationPipe('MKALIVLGLVAAA', method='jsd', profile=False)
+        scores = pipe.call_scores(os.getcwd()+os.sep+'example_data'+os.sep + 'atn1seq.aln')
+        self.assertEqual(scores, pipe.scores)
+        self.assertTrue(isinstance(scores[0][1], float))
+        self.assertIsNone(pipe.alpha)
+        with self.assertRaises(sq.PipelineError):
+            sq.ConservationPipe('MKALIVLGLVAAA', method='jsd', std=True)
+
+    def test_call_reduction(self):
+        """tests that redundant orthologs are removed from the ortholog file and counted"""
+        path = os.getcwd() + os.sep + 'Redundant.orth'
+        with open(path, 'w') as file:
+            file.write('>a\nMKALIVLGLVAAAKW\n>b\nMKALIVLGLVAAAKW\n>c\nWWPPHHQQEERRTT\n')
+        pipe = sq.ConservationPipe('MKALIVLGLVAAA', redundancy=0.95)
+        self.assertEqual(pipe.call_reduction(path), 1)
+        self.assertEqual(pipe.removed, 1)
+        with open(path, 'r') as file:
+            self.assertEqual(file.read().count('>'), 2)
+        self.assertEqual(sq.ConservationPipe('MKALIVLGLVAAA').call_reduction(path), 0)
+        os.remove(path)
+
+    def test_call_subsample(self):
+        """tests that the ortholog file is capped with the input sequence kept first"""
+        path = os.getcwd() + os.sep + 'Capped.orth'
+        with open(path, 'w') as file:
+            file.write('>a\nWWPPHHQQEERRTT\n>query\nMKALIVLGLVAAAKW\n>b\nMKALIVLGLVAAAKWW\n')
+        pipe = sq.ConservationPipe('MKALIVLGLVAAAKW', max_sequences=2)
+        self.assertEqual(pipe.call_subsample(path), 1)
+        with open(path, 'r') as file:
+            self.assertTrue(file.read().startswith('>query'))
+        with open(path, 'w') as file:
+            file.write('>a\nWWPPHHQQEERRTT\n>b\nMKALIVLGLVAAAKWW\n>c\nCCCCYYYYNNNN\n')
+        self.assertEqual(pipe.call_subsample(path), 2)
+        with open(path, 'r') as file:
+            records = list(fasta.parse(file))
+        self.assertEqual(records[0], fasta.Record('Input Sequence', 'MKALIVLGLVAAAKW'))
+        self.assertEqual(len(records), 2)
+        os.remove(path)
+
+    @patch('consScore.seq2conservation.aminoCons.update_alignment')
+    def test_call_update(self, mock_update):
+        """tests that call_update passes the realignment threshold and the Mafft profile on"""
+        mock_update.return_value = 'updated.aln'
+        pipe = sq.ConservationPipe('MKALIVLGLVAAA', incremental=True, realign_fraction=0.5, alignment_profile='FFT-NS-2')
+        self.assertEqual(pipe.call_update('cached.aln', 'new.orth'), 'updated.aln')
+        mock_update.assert_called_with('cached.aln', 'new.orth', threshold=0.5, profile='FFT-NS-2', cwd=pipe.workdir)
+        self.assertEqual(pipe.alignment, 'updated.aln')
+
+    @patch('consScore.seq2conservation.oma.OrthologFinder')
+    @patch('consScore.seq2conservation.aminoCons.build_alignment')
+    def test_pipe_threads(self, mock_aln, mock_finder):
+        """tests that pipes run in threads write to their own workdir, and never change the cwd"""
+        mock_finder.return_value.get_HOGs_or_orthologs.return_value = self.ex_seq
+        mock_finder.return_value.has_run_hogs = False
+        mock_aln.return_value = os.getcwd() + os.sep + 'example_data' + os.sep + 'atn1seq.aln'
+        directory = tempfile.mkdtemp()
+        try:
+            pipes = [sq.ConservationPipe('MKALIVLGLVAAA', name='pipe%d' % i, method='jsd', coalesce=False,
+                                         workdir=os.path.join(directory, 'pipe%d' % i)) for i in range(4)]
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(lambda pipe: pipe.pipe(), pipes))
+            self.assertEqual(os.getcwd(), self.cwd)
+            self.assertTrue(all(result is not None for result in results))
+            folders = sorted(call[1]['cwd'] for call in mock_aln.call_args_list)
+            self.assertEqual(folders, [pipe.workdir for pipe in pipes])
+            for pipe in pipes:
+                self.assertEqual(os.listdir(pipe.workdir), [])
+        finally:
+            shutil.rmtree(directory)
+
+    @patch('consScore.seq2conservation.oma.OrthologFinder')
+    @patch('consScore.aminoCons.ExeConfigCache.get')
+    @patch('consScore.aminoCons.subprocess.run')
+    def test_pipe_in_memory(self, mock_run, mock_exe, mock_finder):
+        """tests that an in memory pipe aligns the orthologs without writing them, or the alignment, to files"""
+        mock_finder.return_value.get_HOGs_or_orthologs.return_value = self.ex_seq
+        mock_finder.return_value.has_run_hogs = False
+        mock_exe.return_value.bin = 'mafft'
+        mock_run.return_value.returncode = 0
+        with open(os.getcwd() + os.sep + 'example_data' + os.sep + 'atn1seq.aln', 'r') as file:
+            mock_run.return_value.stdout = file.read()
+        directory = tempfile.mkdtemp()
+        try:
+            pipe = sq.ConservationPipe('MKALIVLGLVAAA', method='jsd', cache=False, coalesce=False, in_memory=True,
+                                       workdir=directory)
+            self.assertTrue(pipe.pipe() is not None)
+            self.assertEqual(mock_run.call_args[1]['input'].count('>'), self.ex_seq.count('>'))
+            self.assertTrue(isinstance(pipe.alignment, Alignment))
+            self.assertEqual(os.listdir(directory), [])
+            pipe = sq.ConservationPipe('MKALIVLGLVAAA', name='cached', method='jsd', coalesce=False, in_memory=True,
+                                       workdir=directory)
+            pipe.pipe()
+            self.assertEqual(sorted(os.listdir(directory)), ['cached.aln', 'cached.strategy'])
+            self.assertEqual(aminoCons.read_strategy(pipe.alignment)['sequences'], str(self.ex_seq.count('>')))
+        finally:
+            shutil.rmtree(directory)
+
     @classmethod
     def tearDownClass(cls):
         os.remove(os.getcwd()+ os.sep + 'Protein_Sequence.orth')
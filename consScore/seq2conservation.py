@@ -31,7 +31,17 @@ Bayesian methods are superior. Mol Biol Evol 21: 1781-1791.
 
 from consScore import oma
 from consScore import aminoCons
+from consScore import coalesce
+from consScore import constool
+from consScore import fasta
+from consScore import scoring
+from consScore import sketch
+from consScore import treecache
+import copy
+import io
 import os
+import shutil
+import tempfile
 from biskit.errors import BiskitError
 from requests import RequestException
 
@@ -40,6 +50,22 @@ class PipelineError(BiskitError):
     pass
 
 
+#: Coalesces the runs of identical ConservationPipe objects that are made with coalesce. Finished results are only
+#: kept if remember_results asks for it
+_pipes = coalesce.SingleFlight()
+
+
+def remember_results(count):
+    """
+    Sets how many finished results of coalesced pipes are kept, so that an identical pipe started later returns them
+    instead of running again. Zero, the default, keeps none and drops any that were kept, so only pipes running at
+    the same time share a run
+    """
+    _pipes.remember = count
+    if not count:
+        _pipes.forget()
+
+
 class ConservationPipe:
 
     """
@@ -49,7 +75,11 @@ class ConservationPipe:
     """
 
     def __init__(self, sequence, name=None, cache=True, profile=True, identity=True, score=True, qqint=False, std=False,
-                gapped=False):
+                gapped=False, backend=None, stream=False, coalesce=False, speculative=False,
+                target_size=None, method='rate4site', redundancy=None, max_sequences=None, seed=0,
+                alignment_profile=None, incremental=False, realign_fraction=0.2, tree_cache=None,
+                tree=None, rate_profile='accurate', workdir=None,
+                in_memory=False):
         """
         Args:
             sequence (str): The sequence of the protein of interest, or the filepath of the fasta file containing
@@ -65,6 +95,56 @@ class ConservationPipe:
                 std(boolean): The standard deviation of hte posterior rate distribution
                 gapped(boolean): MSA DATA, the number of aligned sequences having an amino acid (non-gapped) from the overall
                     number of sequences at each position
+            backend(omalocal.LocalOMA): A local OMA store to retrieve the orthologs from, instead of the OMA browser
+            stream(boolean): When true, the orthologs are streamed from OMA straight into the .orth file instead of
+            being held in memory. Useful for very large HOGs
+            coalesce(boolean): When true, pipes of the same sequence with the same options that change the scores
+            share a single run, whatever their name and workdir. A pipe that starts while an identical one is running
+            waits for it instead of querying OMA and running Mafft and Rate4Site again, then takes its scores and, if
+            it caches, writes its alignment and strategy files under its own name and workdir. A pipe with an
+            alignment of its own already cached does not share. Finished runs are only shared if remember_results
+            was called
+            speculative(boolean): When true, the HOG and the orthologs are queried at the same time, and the HOG is
+            used if it could be retrieved. Saves the time of the HOG query when it fails. Has no effect with stream
+            target_size(tuple): The (smallest, largest) number of sequences wanted in the HOG, for example (50, 300).
+            When given, the level of the HOG that best fits the range is used instead of the deepest level, which keeps
+            the cost of the alignment and scoring predictable. The level used is saved in hog_level and its size in
+            hog_size
+            method(str): How the conservation scores are calculated- 'rate4site', or one of the faster scores of the
+            scoring module, 'entropy' or 'jsd'. Those give the same outputs except qqint and std, and higher values mean
+            higher conservation. The alpha parameter is only calculated by rate4site
+            redundancy(float): When given, orthologs whose sequence identity to another ortholog is at or above this
+            fraction, for example 0.95, are collapsed to one representative before the alignment. The number of
+            orthologs removed is saved in removed
+            max_sequences(int): When given, at most this many sequences, chosen to be as diverse as possible, are
+            aligned. The input sequence is always kept as the reference. This bounds the time taken by the alignment and
+            scoring. The number of orthologs left out is saved in subsampled
+            seed(int): Seeds the choice of the sequences kept under max_sequences, so that the same seed gives the same
+            choice
+            alignment_profile: The aminoCons.AlignmentProfile that Mafft is run with, or the name of a Mafft strategy
+            such as 'FFT-NS-2', or 'adaptive' to choose the strategy from the size of the orthologs. Defaults to letting
+            Mafft choose
+            incremental(boolean): When true, and an alignment of the same name is cached, the orthologs are retrieved
+            again and only those missing from the cached alignment are added to it, instead of reusing the cached
+            alignment as it is. The columns of the cached alignment are kept. See aminoCons.update_alignment
+            realign_fraction(float): With incremental, the alignment is built again from scratch when the new orthologs
+            are more than this fraction of the cached ones
+            tree_cache(treecache.TreeCache): Where Rate4Site trees are kept and reused. Pipes whose alignment is the
+            same, such as reruns with other outputs, reuse the tree built the first time instead of building it again.
+            True uses a cache in the default location
+            tree(str): 'nj' gives Rate4Site a neighbor-joining tree built with njtree instead of letting it build its
+            own, which is much faster for large alignments. Defaults to the tree Rate4Site builds
+            rate_profile(str): 'fast', 'balanced' or 'accurate', the Rate4Site performance profile. fast computes
+            maximum likelihood rates, several times faster than the empirical Bayes rates of accurate, for screens of
+            many proteins. See aminoCons.RATE4SITE_PROFILES
+            workdir(str): The directory the orthologs and the alignment are written to, and the programs are run in.
+            The pipe never changes the current working directory, so pipes with different names, or different
+            workdirs, can run at the same time in threads of one process. Defaults to Sequence_Alignments in the
+            current working directory
+            in_memory(boolean): When true, the orthologs are kept in memory and aligned by passing them to Mafft
+            through stdin, instead of being written to a file that Mafft reads and writes the alignment of. The
+            alignment is only written to the working directory if Rate4Site needs it, or if it is cached. Ignores
+            stream. See aminoCons.align_sequences
 
         Note: If name is more than one word, then the words should not be separated using a space (For example, name="Silly Potatoes")
         becuase this causes errors in the file handling. Instead, workds should be separated using characters such as an
@@ -85,28 +165,132 @@ class ConservationPipe:
         self.qqint = qqint
         self.gapped = gapped
         self.std = std
+        self.backend = backend
+        self.stream = stream
+        self.coalesce = coalesce
+        self.speculative = speculative
+        self.target_size = target_size
+        if method != 'rate4site':
+            if method not in scoring.METHODS:
+                raise PipelineError('Unknown scoring method {0}'.format(method))
+            if qqint or std:
+                raise PipelineError('The QQ interval and the standard deviation are only calculated by rate4site')
+        self.method = method
+        self.redundancy = redundancy
+        self.removed = 0
+        self.max_sequences = max_sequences
+        self.seed = seed
+        self.subsampled = 0
+        self.alignment_profile = alignment_profile
+        self.incremental = incremental
+        self.realign_fraction = realign_fraction
+        self.tree_cache = treecache.TreeCache() if tree_cache is True else tree_cache
+        self.tree = tree
+        self.rate_profile = rate_profile
+        self.workdir = os.path.abspath(workdir or os.path.join(os.getcwd(), 'Sequence_Alignments'))
+        self.made_workdir = False
+        self.in_memory = in_memory
+        self.hog_level = ""
+        self.hog_size = None
+        self.timings = {}
         self.orthologs = ""
         self.alignment = ""
+        self.outputs = {}
         self.scores = None
         self.alpha = None
 
-    def call_orthologs(self):
+    def read_input(self):
         """
-        Retrieves the HOGS of the input sequence. This is done by querying the OMA online database.
+        Returns the input sequence, reading it from the input file if a file was given
         """
         if os.path.isfile(self.input):
             with open(self.input, "r") as file:
-                sequence = file.read()
-            ortholog_call = oma.OrthologFinder(sequence)
-        else:
-            ortholog_call = oma.OrthologFinder(self.input)
-        try:
-            self.orthologs = ortholog_call.get_HOGs()
-        except RequestException:
-            self.orthologs = ortholog_call.get_orthologs()
-        with open("%s.orth" % (self.name), "w") as o_file:
-            o_file.write(self.orthologs)
-        return os.getcwd() + os.sep + "%s.orth" % (self.name)
+                return file.read()
+        return self.input
+
+    def work_path(self, filename=None):
+        """
+        Returns the absolute path to a file in the working directory of the pipe, or to the working directory itself
+        if no file name is given, making the directory if needed
+        """
+        if not os.path.isdir(self.workdir):
+            os.makedirs(self.workdir, exist_ok=True)
+            self.made_workdir = True
+        return self.workdir + os.sep + filename if filename else self.workdir
+
+    def call_orthologs(self):
+        """
+        Retrieves the HOGS of the input sequence. This is done by querying the OMA online database.
+        """
+        if self.stream:
+            ortholog_call = oma.OrthologFinder(self.read_input(), backend=self.backend, target_size=self.target_size)
+            path = self.work_path("%s.orth" % (self.name))
+            try:
+                ortholog_call.save_HOGs(path)
+                self.hog_level, self.hog_size = ortholog_call.hog_level, ortholog_call.hog_size
+            except RequestException:
+                ortholog_call.save_orthologs(path)
+            return path
+        path = self.work_path("%s.orth" % (self.name))
+        with open(path, "w") as o_file:
+            o_file.write(self.get_orthologs())
+        return path
+
+    def get_orthologs(self):
+        """
+        Retrieves the HOGS or the orthologs of the input sequence from the OMA database
+        Returns:
+            The orthologs in fasta format
+        """
+        ortholog_call = oma.OrthologFinder(self.read_input(), backend=self.backend, target_size=self.target_size)
+        self.orthologs = ortholog_call.get_HOGs_or_orthologs(speculative=self.speculative)
+        self.timings = ortholog_call.timings
+        if ortholog_call.has_run_hogs:
+            self.hog_level, self.hog_size = ortholog_call.hog_level, ortholog_call.hog_size
+        return self.orthologs
+
+    def call_reduction(self, orthologs):
+        """
+        Collapses near identical orthologs to one representative, rewriting the ortholog file. Does nothing unless
+        redundancy is set
+        Args:
+            orthologs(str): The filepath to the file containing the orthologs of the input, in fasta format
+        Returns:
+            The number of orthologs removed
+        """
+        if self.redundancy is None:
+            return 0
+        self.removed = sketch.reduce_file(orthologs, threshold=self.redundancy)[1]
+        return self.removed
+
+    def call_subsample(self, orthologs):
+        """
+        Keeps at most max_sequences of the orthologs, as different from each other as possible, rewriting the
+        ortholog file. The input sequence is kept first- it is added to the orthologs if they do not contain it, as
+        the HOGs do not. Does nothing unless max_sequences is set
+        Args:
+            orthologs(str): The filepath to the file containing the orthologs of the input, in fasta format
+        Returns:
+            The number of orthologs left out
+        """
+        if self.max_sequences is None:
+            return 0
+        records, query = self.with_query(fasta.read(orthologs))
+        kept, self.subsampled = sketch.subsample(records, self.max_sequences, query=query.sequence, seed=self.seed)
+        with open(orthologs, 'w') as handle:
+            fasta.write(kept, handle)
+        return self.subsampled
+
+    def with_query(self, records):
+        """
+        Returns the orthologs as a list of fasta Records, with the input protein added first if none of them has its
+        sequence, and the Record of the input protein
+        """
+        records = list(records)
+        query = next(fasta.parse(constool.header_check(self.read_input())))
+        if not any(record.sequence.upper() == query.sequence.upper() for record in records):
+            records.insert(0, query)
+        return records, query
 
     def call_alignment(self, orthologs):
         """
@@ -116,25 +300,93 @@ class ConservationPipe:
         Returns:
             The filepath to the the msa
         """
-        alignment = aminoCons.build_alignment(orthologs)
+        alignment = aminoCons.build_alignment(orthologs, profile=self.alignment_profile, cwd=self.work_path())
+        self.alignment = alignment
+        return alignment
+
+    def call_memory_alignment(self, msa):
+        """
+        Retrieves the orthologs, reduces and caps them as call_reduction and call_subsample do, and aligns them, all
+        in memory. The alignment is only written to msa, with its strategy recorded next to it, if Rate4Site scores it
+        or if it is cached
+        Args:
+            msa(str): The filepath the msa is written to
+        Returns:
+            The filepath to the msa if Rate4Site scores it, and otherwise the msa as an Alignment object
+        """
+        records = list(fasta.parse(self.get_orthologs()))
+        if self.redundancy is not None:
+            records, self.removed = sketch.reduce_redundancy(records, threshold=self.redundancy)
+        if self.max_sequences is not None:
+            records, query = self.with_query(records)
+            records, self.subsampled = sketch.subsample(records, self.max_sequences, query=query.sequence,
+                                                        seed=self.seed)
+        written = self.method == 'rate4site' or self.cache
+        alignment = aminoCons.align_sequences(records, profile=self.alignment_profile, path=msa if written else None)
+        self.alignment = msa if written else alignment
+        return msa if self.method == 'rate4site' else alignment
+
+    def call_update(self, msa, orthologs):
+        """
+        Adds the orthologs missing from a cached MSA to it with Mafft, or aligns them again if too many are missing
+        Args:
+            msa(str): The filepath to the cached msa
+            orthologs(str): The filepath to the file containing the orthologs of the input, in fasta format
+        Returns:
+            The filepath to the the msa
+        """
+        alignment = aminoCons.update_alignment(msa, orthologs, threshold=self.realign_fraction,
+                                               profile=self.alignment_profile, cwd=self.work_path())
         self.alignment = alignment
         return alignment
 
     def call_rate4site(self, msa):
         """
-        Calls Rate4Site to calculate various statistics of the amino acids in the input sequence
+        Calls Rate4Site to calculate various statistics of the amino acids in the input sequence. Rate4Site is run in
+        a scratch directory of its own inside the working directory, since it names some of its output files the same
+        for every job
         Args:
             msa(str): The filepath to the file containing the msa
         Returns:
             The alpha parameter of the data
         """
-        conservation_score = aminoCons.Rate4Site(msa, profile=self.profile, cache=self.cache, identity=self.identity,
-                                                 score=self.score, qqint=self.qqint, gapped=self.gapped, std=self.std)
-        self.scores = conservation_score.run()
-        self.alpha = conservation_score.alpha
-        conservation_score.close()
+        scratch = tempfile.mkdtemp(prefix='%s_' % self.name, dir=self.work_path())
+        try:
+            conservation_score = aminoCons.Rate4Site(msa, profile=self.profile, cache=self.cache,
+                                                     identity=self.identity, score=self.score, qqint=self.qqint,
+                                                     gapped=self.gapped, std=self.std, tree=self.tree,
+                                                     tree_cache=self.tree_cache, rate_profile=self.rate_profile,
+                                                     cwd=scratch, tempdir=scratch)
+            self.scores = conservation_score.run()
+            self.alpha = conservation_score.alpha
+            conservation_score.close()
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
         return self.alpha
 
+    def call_scorer(self, msa):
+        """
+        Scores the conservation of the amino acids in the input sequence with the scoring module, instead of
+        Rate4Site
+        Args:
+            msa(str): The filepath to the file containing the msa
+        Returns:
+            The scores, as call_rate4site stores them
+        """
+        scorer = scoring.ConservationScorer(msa, method=self.method, profile=self.profile, identity=self.identity,
+                                            score=self.score, gapped=self.gapped)
+        self.scores = scorer.run()
+        self.alpha = None
+        return self.scores
+
+    def call_scores(self, msa):
+        """
+        Calls Rate4Site or the scoring module, depending on the chosen method
+        """
+        if self.method == 'rate4site':
+            return self.call_rate4site(msa)
+        return self.call_scorer(msa)
+
     def pipe(self):
         """
         Queries the OMA database, Mafft and Rate4Site in sequence to get the
@@ -142,24 +394,87 @@ class ConservationPipe:
             A dictionary containing the various statistical scores mapped to each amino acid, depending
             on which inputs were selected.
         """
-        old_dir = os.getcwd()
-        directory = old_dir + os.sep + 'Sequence_Alignments'
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        os.chdir(directory)
+        if not self.coalesce or os.path.isfile(os.path.join(self.workdir, '%s.aln' % self.name)):
+            return self.run_pipe()
+        key = (constool.get_fasta_sequence(constool.header_check(self.read_input())), id(self.backend), self.target_size,
+               self.method, self.redundancy, self.max_sequences, self.seed, self.profile, self.identity, self.score,
+               self.qqint, self.std, self.gapped, repr(self.alignment_profile), self.incremental, self.realign_fraction,
+               self.tree, self.rate_profile)
+        led = []
 
-        msa = directory+os.sep+'%s.aln' % (self.name)
-        if os.path.isfile(msa):
+        def lead():
+            led.append(True)
+            self.scores = self.run_pipe()
+            return {name: getattr(self, name) for name in self._SHARED}
+        shared = _pipes.do(key, lead)
+        if not led:
+            self.follow(shared)
+        return self.scores
+
+    #: The results of a coalesced run that the pipes sharing it take over
+    _SHARED = ('scores', 'alpha', 'removed', 'subsampled', 'hog_level', 'hog_size', 'timings', 'orthologs',
+               'outputs')
+
+    def follow(self, shared):
+        """
+        Takes over the results of a run shared with an identical pipe, and writes its alignment and strategy files
+        under the name and in the workdir of this pipe if it caches
+        Args:
+            shared(dict): The attributes in _SHARED of the pipe that ran
+        """
+        for name, value in shared.items():
+            setattr(self, name, copy.deepcopy(value))
+        if self.cache:
+            for extension, text in self.outputs.items():
+                path = self.work_path(self.name + extension)
+                with open(path, 'w') as handle:
+                    handle.write(text)
+                if extension == '.aln':
+                    self.alignment = path
+
+    def read_outputs(self, msa):
+        """
+        Returns the text of the alignment and of its strategy file, by file extension, so that the pipes that share
+        this run can write them under their own name
+        """
+        outputs = {}
+        if isinstance(self.alignment, str) and os.path.isfile(self.alignment):
+            with open(self.alignment, 'r') as handle:
+                outputs['.aln'] = handle.read()
+        elif self.alignment and not isinstance(self.alignment, str):
+            text = io.StringIO()
+            self.alignment.write(text)
+            outputs['.aln'] = text.getvalue()
+        if os.path.isfile(aminoCons.strategy_path(msa)):
+            with open(aminoCons.strategy_path(msa), 'r') as handle:
+                outputs['.strategy'] = handle.read()
+        return outputs
+
+    def run_pipe(self):
+        """
+        Runs the pipe for this object only, without sharing the run with identical pipes
+        """
+        msa = self.work_path('%s.aln' % (self.name))
+        if os.path.isfile(msa) and not self.incremental:
+            aln = msa
+            self.call_scores(aln)
+        elif self.in_memory and not os.path.isfile(msa):
+            self.call_scores(self.call_memory_alignment(msa))
             aln = msa
-            self.call_rate4site(aln)
         else:
             orth = self.call_orthologs()
-            aln = self.call_alignment(orth)
-            self.call_rate4site(aln)
-            os.remove(os.getcwd() + os.sep + "%s.orth" % (self.name))
-
-        aminoCons.clean_alignment(aln, self.cache)
-        os.chdir(old_dir)
-        if not self.cache and not os.listdir(directory):
-            os.rmdir(directory)
+            self.call_reduction(orth)
+            self.call_subsample(orth)
+            if os.path.isfile(msa):
+                aln = self.call_update(msa, orth)
+            else:
+                aln = self.call_alignment(orth)
+            self.call_scores(aln)
+            os.remove(self.work_path("%s.orth" % (self.name)))
+
+        if self.coalesce:
+            self.outputs = self.read_outputs(aln)
+        aminoCons.clean_alignment(aln, self.cache, cwd=self.workdir)
+        if not self.cache and self.made_workdir and not os.listdir(self.workdir):
+            os.rmdir(self.workdir)
         return self.scores
@@ -0,0 +1,217 @@
+"""
+MinHash sketches of protein sequences, for comparing thousands of orthologs without aligning them. Each sequence is
+reduced to the smallest hashes of its k-mers under a fixed set of hash functions. The fraction of hashes two
+sketches share estimates the Jaccard index of their k-mer sets, from which their sequence identity is estimated as
+in Mash.
+
+Used to collapse near identical orthologs, such as those of closely related strains, to one representative before
+they are aligned, and to choose a diverse subset of orthologs when their number has to be capped.
+
+Citation
+Ondov, B.D. et al. 2016. Mash: fast genome and metagenome distance estimation using MinHash. Genome Biol 17: 132.
+"""
+
+import numpy as np
+from consScore import fasta
+
+#: Length of the k-mers hashed
+DEFAULT_K = 5
+
+#: Number of hash functions, and so of hashes kept for each sequence
+DEFAULT_SIZE = 128
+
+#: The prime modulus of the hash functions
+_PRIME = (1 << 31) - 1
+
+_CODES = np.full(256, 20, dtype=np.int64)
+_CODES[np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)] = np.arange(20)
+
+
+def identity_to_jaccard(identity, k=DEFAULT_K):
+    """
+    Returns the Jaccard index of the k-mer sets expected of two sequences with the given identity
+    """
+    shared = np.exp(-k * (1 - identity))
+    return shared / (2 - shared)
+
+
+def jaccard_to_identity(jaccard, k=DEFAULT_K):
+    """
+    Returns the sequence identity estimated from the Jaccard index of the k-mer sets of two sequences
+    """
+    jaccard = np.asarray(jaccard, dtype=float)
+    with np.errstate(divide='ignore'):
+        return 1 + np.log(2 * jaccard / (1 + jaccard)) / k
+
+
+class MinHasher:
+    """
+    Builds MinHash sketches of protein sequences. Sketches are only comparable if they were built with the same k,
+    size and seed
+    """
+
+    def __init__(self, k=DEFAULT_K, size=DEFAULT_SIZE, seed=0):
+        """
+        Args:
+            k(int): Length of the k-mers hashed
+            size(int): Number of hash functions
+            seed(int): Seed of the random hash functions
+        """
+        self.k = k
+        self.size = size
+        random = np.random.RandomState(seed)
+        self._a = random.randint(1, _PRIME, size=(size, 1)).astype(np.int64)
+        self._b = random.randint(0, _PRIME, size=(size, 1)).astype(np.int64)
+
+    def kmers(self, sequence):
+        """
+        Returns the distinct k-mers of the sequence, each encoded as an integer
+        """
+        codes = _CODES[np.frombuffer(sequence.upper().encode('ascii'), dtype=np.uint8)]
+        if len(codes) < self.k:
+            return np.zeros(0, dtype=np.int64)
+        windows = np.lib.stride_tricks.sliding_window_view(codes, self.k)
+        return np.unique(windows @ (21 ** np.arange(self.k, dtype=np.int64)))
+
+    def sketch(self, sequence):
+        """
+        Returns the sketch of the sequence, an array of the smallest hash of its k-mers under each hash function.
+        A sequence shorter than k has no k-mers, and a sketch that matches no other
+        """
+        kmers = self.kmers(sequence) % _PRIME
+        if not len(kmers):
+            return np.full(self.size, -1, dtype=np.int64)
+        return ((self._a * kmers + self._b) % _PRIME).min(axis=1)
+
+    def sketches(self, sequences):
+        """
+        Returns the sketches of the sequences, one row for each sequence
+        """
+        sketches = np.empty((len(sequences), self.size), dtype=np.int64)
+        for row, sequence in enumerate(sequences):
+            sketches[row] = self.sketch(sequence)
+        return sketches
+
+
+def jaccard(sketch, sketches):
+    """
+    Returns the estimated Jaccard index of the k-mers of the sketched sequence with each of the other sketches
+    Args:
+        sketch(numpy.ndarray): One sketch
+        sketches(numpy.ndarray): Sketches, one in each row
+    """
+    if sketch[0] == -1:
+        return np.zeros(len(sketches))
+    return (sketches == sketch).mean(axis=1)
+
+
+def reduce_redundancy(records, threshold=0.95, hasher=None):
+    """
+    Collapses the sequences whose estimated identity to another sequence is at or above the threshold to one
+    representative. Sequences are visited greedily, the first record and then the rest from longest to shortest, and
+    each one is kept only if it is not redundant with a sequence kept before it. The first record, the reference of
+    the alignment, is always kept
+    Args:
+        records(list): The fasta Records
+        threshold(float): The sequence identity, between 0 and 1, at which two sequences are redundant
+        hasher(MinHasher): Builds the sketches. Defaults to MinHasher()
+    Returns:
+        The kept records, in their input order, and the number of records removed
+    """
+    records = list(records)
+    if len(records) < 2:
+        return records, 0
+    hasher = hasher or MinHasher()
+    sketches = hasher.sketches([r.sequence for r in records])
+    minimum = identity_to_jaccard(threshold, hasher.k)
+    order = [0] + sorted(range(1, len(records)), key=lambda i: -len(records[i].sequence))
+    kept = np.empty((len(records), hasher.size), dtype=np.int64)
+    count = 0
+    keep = np.zeros(len(records), dtype=bool)
+    for i in order:
+        if count and jaccard(sketches[i], kept[:count]).max() >= minimum:
+            continue
+        kept[count] = sketches[i]
+        count += 1
+        keep[i] = True
+    return [r for r, k in zip(records, keep) if k], len(records) - count
+
+
+def reduce_file(source, destination=None, threshold=0.95, hasher=None):
+    """
+    Collapses the redundant sequences of a fasta file, as reduce_redundancy does
+    Args:
+        source(str): The fasta file read
+        destination(str): The fasta file written. Defaults to overwriting the source
+        threshold(float): The sequence identity, between 0 and 1, at which two sequences are redundant
+        hasher(MinHasher): Builds the sketches
+    Returns:
+        The number of records kept and the number of records removed
+    """
+    kept, removed = reduce_redundancy(fasta.read(source), threshold=threshold, hasher=hasher)
+    with open(destination or source, 'w') as handle:
+        fasta.write(kept, handle)
+    return len(kept), removed
+
+
+def subsample(records, cap, query=None, seed=0, hasher=None):
+    """
+    Chooses at most cap records that are as different from each other as possible. Starting from the query, the
+    record farthest from every record chosen so far is added, until cap records are chosen. Distances are one minus
+    the estimated Jaccard index of the sketches. Ties are broken in an order shuffled with the seed, so the choice is
+    the same for the same seed
+    Args:
+        records(list): The fasta Records
+        cap(int): The largest number of records kept, counting the query
+        query(str): The sequence of the query. Its record is always kept, and comes first in the output. If None,
+            or if no record has this sequence, the first record is the query
+        seed(int): Seeds the hash functions and the order of ties
+        hasher(MinHasher): Builds the sketches. Defaults to MinHasher(seed=seed)
+    Returns:
+        The kept records, the query first and then the others in their input order, and the number of records removed
+    """
+    records = list(records)
+    if cap < 1:
+        raise ValueError('The cap must be at least 1')
+    if not records:
+        return records, 0
+    start = 0
+    if query is not None:
+        query = ''.join(query.split()).upper()
+        start = next((i for i, r in enumerate(records) if r.sequence.upper() == query), 0)
+    if len(records) <= cap:
+        chosen = range(len(records))
+    else:
+        hasher = hasher or MinHasher(seed=seed)
+        sketches = hasher.sketches([r.sequence for r in records])
+        order = np.random.RandomState(seed).permutation(len(records))
+        sketches = sketches[order]
+        distances = 1 - jaccard(sketches[np.flatnonzero(order == start)[0]], sketches)
+        taken = np.zeros(len(records), dtype=bool)
+        taken[order == start] = True
+        for _ in range(cap - 1):
+            candidate = int(np.argmax(np.where(taken, -1, distances)))
+            taken[candidate] = True
+            distances = np.minimum(distances, 1 - jaccard(sketches[candidate], sketches))
+        chosen = sorted(order[taken])
+    kept = [records[start]] + [records[i] for i in chosen if i != start]
+    return kept, len(records) - len(kept)
+
+
+def subsample_file(source, cap, destination=None, query=None, seed=0, hasher=None):
+    """
+    Caps the number of sequences in a fasta file, as subsample does
+    Args:
+        source(str): The fasta file read
+        cap(int): The largest number of records kept, counting the query
+        destination(str): The fasta file written. Defaults to overwriting the source
+        query(str): The sequence of the query
+        seed(int): Seeds the hash functions and the order of ties
+        hasher(MinHasher): Builds the sketches
+    Returns:
+        The number of records kept and the number of records removed
+    """
+    kept, removed = subsample(fasta.read(source), cap, query=query, seed=seed, hasher=hasher)
+    with open(destination or source, 'w') as handle:
+        fasta.write(kept, handle)
+    return len(kept), removed
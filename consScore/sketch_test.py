@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for sketch
+"""
+import biskit.test
+import os
+import shutil
+import tempfile
+import numpy as np
+from consScore import fasta
+from consScore import sketch
+
+BASE = 'MKTRQNKDSMSMRSGRKKEAPGPREELRSRGRASPGGVSTSSSDGKAEKSRQTAKKARVEEVSAPKVSKQGRGEEISESESEETNAPKKTKTEQELPRPQSPS'
+
+
+class TestSketch(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the sketch module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.hasher = sketch.MinHasher()
+        self.close = BASE[:50] + 'W' + BASE[51:]
+        self.other = BASE[::-1]
+
+    def test_identity_jaccard(self):
+        """Tests that the identity and Jaccard index conversions are inverses of each other"""
+        jaccard = sketch.identity_to_jaccard(0.95)
+        self.assertAlmostEqual(float(sketch.jaccard_to_identity(jaccard)), 0.95)
+        self.assertAlmostEqual(float(sketch.identity_to_jaccard(1.0)), 1.0)
+
+    def test_sketch(self):
+        """Tests that identical sequences have identical sketches, and that similar ones share most hashes"""
+        sketches = self.hasher.sketches([BASE, BASE, self.close, self.other])
+        scores = sketch.jaccard(sketches[0], sketches)
+        self.assertEqual(scores[1], 1.0)
+        self.assertTrue(0.7 < scores[2] < 1.0)
+        self.assertTrue(scores[3] < 0.2)
+
+    def test_short_sequence(self):
+        """Tests that a sequence shorter than k matches nothing, not even itself"""
+        short = self.hasher.sketch('MKT')
+        self.assertEqual(sketch.jaccard(short, np.array([short])).max(), 0)
+
+    def test_reduce_redundancy(self):
+        """Tests that near identical sequences collapse to one, keeping the first record and the input order"""
+        records = [fasta.Record('query', self.close), fasta.Record('a', BASE), fasta.Record('b', self.other),
+                   fasta.Record('c', BASE + 'A')]
+        kept, removed = sketch.reduce_redundancy(records, threshold=0.95)
+        self.assertEqual([r.header for r in kept], ['query', 'b'])
+        self.assertEqual(removed, 2)
+        kept, removed = sketch.reduce_redundancy(records, threshold=1.0)
+        self.assertEqual([r.header for r in kept], ['query', 'a', 'b', 'c'])
+
+    def test_reduce_file(self):
+        """Tests that the fasta file is rewritten without the redundant records"""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'orthologs.orth')
+            with open(path, 'w') as file:
+                fasta.write([fasta.Record('a', BASE), fasta.Record('b', BASE)], file)
+            self.assertEqual(sketch.reduce_file(path), (1, 1))
+            self.assertEqual([r.header for r in fasta.read(path)], ['a'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_subsample(self):
+        """Tests that the cap keeps the query first and prefers the most different sequences"""
+        records = [fasta.Record('a', BASE), fasta.Record('b', BASE + 'A'), fasta.Record('query', self.close),
+                   fasta.Record('c', self.other), fasta.Record('d', BASE + 'AA')]
+        kept, removed = sketch.subsample(records, 2, query=self.close)
+        self.assertEqual([r.header for r in kept], ['query', 'c'])
+        self.assertEqual(removed, 3)
+        kept, removed = sketch.subsample(records, 3, query='ZZZZZ')
+        self.assertEqual(kept[0].header, 'a')
+        self.assertEqual(len(kept), 3)
+        self.assertEqual(kept, sketch.subsample(records, 3, query='ZZZZZ')[0])
+        self.assertEqual(sketch.subsample(records, 10), (records, 0))
+
+if __name__ == '__main__':
+    biskit.test.localTest()
@@ -0,0 +1,97 @@
+"""
+A cache of the phylogenetic trees that Rate4Site builds, so that an alignment that is scored again- with other
+outputs, or by another pipe with the same orthologs- reuses its tree instead of building it again. Trees are files
+in Newick format in a directory, named by a hash of the content of the alignment they were built from. The hash
+covers the ids and aligned sequences only, so the same alignment in fasta or clustal format, or wrapped
+differently, has the same key.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from consScore.alignment import Alignment
+
+#: A reasonable place for the trees, if the caller does not care where they go
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'consScore', 'trees')
+
+
+def alignment_hash(msa):
+    """
+    Returns the sha256 hexdigest of the ids and aligned sequences of an alignment
+    Args:
+        msa: The path to the alignment file, or an Alignment object
+    """
+    if not isinstance(msa, Alignment):
+        msa = Alignment.read(msa)
+    digest = hashlib.sha256()
+    for name, row in zip(msa.ids, msa.matrix):
+        digest.update(name.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(row.tobytes())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class TreeCache:
+    """
+    Stores trees in Newick format, keyed by the alignment they were built from
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path(str): The directory the trees are kept in. Defaults to DEFAULT_PATH
+        """
+        self.path = path or DEFAULT_PATH
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def tree_path(self, key):
+        """
+        Returns where the tree of the alignment with the given hash is kept
+        """
+        return os.path.join(self.path, key + '.tree')
+
+    def get(self, msa):
+        """
+        Returns the path to the cached tree of the alignment, or None if there is none
+        Args:
+            msa: The path to the alignment file, an Alignment object, or the hash of an alignment
+        """
+        key = msa if _is_key(msa) else alignment_hash(msa)
+        path = self.tree_path(key)
+        return path if os.path.isfile(path) else None
+
+    def put(self, msa, tree):
+        """
+        Stores a copy of a tree built from the alignment. The copy is written under a temporary name and then moved
+        into place, so that a tree is never read half written
+        Args:
+            msa: The path to the alignment file, an Alignment object, or the hash of an alignment
+            tree(str): The path to the tree file, in Newick format
+        Returns:
+            The path to the cached tree
+        """
+        key = msa if _is_key(msa) else alignment_hash(msa)
+        handle, temporary = tempfile.mkstemp(suffix='.part', dir=self.path)
+        os.close(handle)
+        shutil.copyfile(tree, temporary)
+        os.replace(temporary, self.tree_path(key))
+        return self.tree_path(key)
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.path) if name.endswith('.tree')])
+
+    def clear(self):
+        """
+        Deletes every cached tree
+        """
+        for name in os.listdir(self.path):
+            if name.endswith('.tree'):
+                os.remove(os.path.join(self.path, name))
+
+
+def _is_key(msa):
+    return isinstance(msa, str) and len(msa) == 64 and not os.path.exists(msa) and \
+        all(c in '0123456789abcdef' for c in msa)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test file for treecache
+"""
+import biskit.test
+import os
+import shutil
+import tempfile
+from consScore import treecache
+from consScore.alignment import Alignment
+
+
+class TestTreeCache(biskit.test.BiskitTest):
+    """
+    Test suite testing the behaviour of the treecache module
+    """
+
+    TAGS = [biskit.test.NORMAL]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = treecache.TreeCache(os.path.join(self.directory, 'trees'))
+        self.msa = os.path.join(self.directory, 'orth.aln')
+        with open(self.msa, 'w') as file:
+            file.write('>a\nMK-T\n>b\nMKWT\n')
+        self.tree = os.path.join(self.directory, 'TheTree.txt')
+        with open(self.tree, 'w') as file:
+            file.write('(a:0.1,b:0.2);\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_alignment_hash(self):
+        """Tests that the hash depends on the aligned content, not on the file layout"""
+        wrapped = Alignment.parse('>a first\nMK\n-T\n>b\nMKWT\n')
+        self.assertEqual(treecache.alignment_hash(self.msa), treecache.alignment_hash(wrapped))
+        self.assertNotEqual(treecache.alignment_hash(self.msa),
+                            treecache.alignment_hash(Alignment.parse('>a\nMKT-\n>b\nMKWT\n')))
+
+    def test_put_get(self):
+        """Tests that a stored tree is found again by its alignment, or by the hash of the alignment"""
+        self.assertIsNone(self.cache.get(self.msa))
+        path = self.cache.put(self.msa, self.tree)
+        self.assertEqual(self.cache.get(self.msa), path)
+        self.assertEqual(self.cache.get(treecache.alignment_hash(self.msa)), path)
+        with open(path) as file:
+            self.assertEqual(file.read(), '(a:0.1,b:0.2);\n')
+        self.assertEqual(len(self.cache), 1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+if __name__ == '__main__':
+    biskit.test.localTest()